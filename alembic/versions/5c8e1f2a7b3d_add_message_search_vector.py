@@ -0,0 +1,64 @@
+"""Add full-text search vector to messages
+
+Revision ID: 5c8e1f2a7b3d
+Revises: 4a6f9e0bb0f4
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "5c8e1f2a7b3d"
+down_revision = "4a6f9e0bb0f4"
+branch_labels = None
+depends_on = None
+
+
+# Inline base64 images are excluded; content is capped well below the 1MB
+# tsvector limit so very long console dumps cannot fail the insert.
+SEARCH_VECTOR_EXPR = """
+    CASE
+        WHEN {row}message_format IN ('BASE64_PNG', 'BASE64_JPEG') THEN NULL
+        ELSE to_tsvector('english', left(coalesce({row}content, ''), 100000))
+    END
+"""
+
+
+def upgrade() -> None:
+    op.add_column("message", sa.Column("search_vector", postgresql.TSVECTOR(), nullable=True))
+
+    conn = op.get_bind()
+    conn.execute(sa.text(f"""
+        CREATE OR REPLACE FUNCTION message_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR_EXPR.format(row="NEW.")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """))
+    conn.execute(sa.text("""
+        CREATE TRIGGER message_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF content, message_format ON message
+        FOR EACH ROW EXECUTE FUNCTION message_search_vector_update();
+    """))
+
+    # Backfill existing rows
+    conn.execute(sa.text(f"UPDATE message SET search_vector = {SEARCH_VECTOR_EXPR.format(row='')}"))
+
+    op.create_index(
+        "ix_message_search_vector",
+        "message",
+        ["search_vector"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_message_search_vector", table_name="message")
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP TRIGGER IF EXISTS message_search_vector_trigger ON message"))
+    conn.execute(sa.text("DROP FUNCTION IF EXISTS message_search_vector_update()"))
+    op.drop_column("message", "search_vector")
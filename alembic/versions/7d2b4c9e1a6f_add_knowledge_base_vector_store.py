@@ -0,0 +1,72 @@
+"""Add pgvector-backed knowledge base tables
+
+Revision ID: 7d2b4c9e1a6f
+Revises: 5c8e1f2a7b3d
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7d2b4c9e1a6f"
+down_revision = "5c8e1f2a7b3d"
+branch_labels = None
+depends_on = None
+
+
+# HNSW index for the default embedding model (text-embedding-3-small, 1536
+# dims). Indexes for other models are created on first use by
+# utils.pqa_pg_store.ensure_embedding_index.
+DEFAULT_MODEL_INDEX = "ix_kb_chunk_embedding_text_embedding_3_small"
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+    op.create_table(
+        "kb_document",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("user_id", sa.Uuid(), nullable=False),
+        sa.Column("file_name", sa.String(length=512), nullable=False),
+        sa.Column("content_md5", sa.String(length=32), nullable=False),
+        sa.Column("embedding_model", sa.String(length=255), nullable=False),
+        sa.Column("docname", sa.String(length=255), nullable=False),
+        sa.Column("doc", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], name="fk_kb_document_user_id", ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "file_name", "embedding_model", name="uq_kb_document_user_file_model"),
+    )
+    op.create_index("ix_kb_document_user_id", "kb_document", ["user_id"])
+
+    # Raw SQL: the dimensionless pgvector column has no SQLAlchemy type here
+    conn.execute(sa.text("""
+        CREATE TABLE kb_chunk (
+            id BIGSERIAL PRIMARY KEY,
+            document_id UUID NOT NULL
+                CONSTRAINT fk_kb_chunk_document_id REFERENCES kb_document (id) ON DELETE CASCADE,
+            user_id UUID NOT NULL,
+            embedding_model VARCHAR(255) NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            text TEXT NOT NULL,
+            media BYTEA,
+            embedding vector NOT NULL
+        )
+    """))
+    op.create_index("ix_kb_chunk_document_id", "kb_chunk", ["document_id"])
+    op.create_index("ix_kb_chunk_user_id", "kb_chunk", ["user_id"])
+    conn.execute(sa.text(f"""
+        CREATE INDEX {DEFAULT_MODEL_INDEX} ON kb_chunk
+        USING hnsw ((embedding::vector(1536)) vector_cosine_ops)
+        WHERE embedding_model = 'text-embedding-3-small'
+    """))
+
+
+def downgrade() -> None:
+    op.drop_table("kb_chunk")
+    op.drop_index("ix_kb_document_user_id", table_name="kb_document")
+    op.drop_table("kb_document")
@@ -2,6 +2,7 @@ import asyncio
 import json
 from math import ceil
 import os
+from contextlib import closing
 from datetime import date, datetime, timedelta
 from time import time
 import logging
@@ -9,6 +10,7 @@ from logging.handlers import RotatingFileHandler
 from typing import Any, Dict, List
 import hashlib
 import secrets
+import threading
 from uuid import UUID
 from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
@@ -21,6 +23,10 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from pathlib import Path
 from fastapi import UploadFile, File
+# Every LiteLLM request (chat, tool planning, PaperQA) goes through the shared scheduler;
+# installed before OpenInterpreter and the tools import litellm
+from core import llm_scheduler
+llm_scheduler.install()
 from utils.custom_functions import custom_tool
 import redis
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -50,18 +56,24 @@ from utils.custom_instructions import get_custom_instructions  # Generic Assista
 
 # Import prompt manager
 from utils.prompt_manager import init_prompt_manager, get_prompt_manager
-from knowledge_base_routes import router as knowledge_base_router, MAX_PAPER_SIZE
+from knowledge_base_routes import router as knowledge_base_router, MAX_PAPER_SIZE, MAX_BULK_TOTAL_SIZE
 from conversation_routes import router as conversation_router
 from mcp_routes import router as mcp_router
-from sqlmodel import Session
+from station_routes import router as station_router
+from sqlmodel import Session, select
+from core.db import engine
 from auth import (
     generate_auth_token, verify_password, is_authenticated, get_auth_token,
     add_auth_session, remove_auth_session, SESSION_TIMEOUT, get_db, get_current_user
 )
 
 from utils.system_prompt import sys_prompt # New (for reasoning LLMs, like GPT-5), also contains Open Interpreter prompt
-from utils.pqa_multi_tenant import ensure_user_pqa_settings
 from core.mcp_manager import mcp_manager
+from core.conversation_recorder import ConversationRecorder
+from core.kernel_auth import issue_kernel_token, refresh_kernel_token, revoke_kernel_token
+from core.cache import redis_client
+from core import kb_progress
+from utils.pqa_media_store import MEDIA_ROOT, MEDIA_URL_PREFIX
 
 #import interpreter.core.llm.llm as llm_mod
 
@@ -583,6 +595,8 @@ MAX_UPLOADS_PER_SESSION = 100  # Maximum files per session
 CLAMD_HOST = "localhost"  # Docker service name
 CLAMD_PORT = 3310
 CHAT_RATE_LIMIT = "10/minute"
+# How long a chat request waits for the session's previous turn to finish
+CHAT_TURN_WAIT_SECONDS = float(os.getenv("CHAT_TURN_WAIT_SECONDS", "30"))
 
 # Initialize rate limiter
 limiter = Limiter(key_func=get_remote_address)
@@ -603,6 +617,9 @@ app = FastAPI(root_path=root_path)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 app.mount('/' + str(STATIC_DIR), StaticFiles(directory=STATIC_DIR), name="static")
+# Knowledge base figures, extracted once at index time (utils/pqa_media_store.py)
+MEDIA_ROOT.mkdir(parents=True, exist_ok=True)
+app.mount(MEDIA_URL_PREFIX, StaticFiles(directory=MEDIA_ROOT), name="kb-media")
 # Serve frontend assets (CSS/JS) for shared pages under a stable, prefixed path
 app.mount('/assets', StaticFiles(directory='frontend'), name='assets')
 
@@ -611,6 +628,7 @@ init_prompt_manager()
 app.include_router(knowledge_base_router)
 app.include_router(conversation_router, prefix="/conversations", tags=["conversations"])
 app.include_router(mcp_router)
+app.include_router(station_router)
 
 # Get CORS origins from environment variable or use defaults
 cors_origins_env = os.getenv("CORS_ORIGINS", "")
@@ -656,6 +674,8 @@ class RequestSizeLimitMiddleware(BaseHTTPMiddleware):
                     # Allow larger files for knowledge-base uploads while keeping chat uploads constrained
                     if path.endswith("/knowledge-base/papers/upload"):
                         max_size = MAX_PAPER_SIZE
+                    elif path.endswith("/knowledge-base/papers/bulk-upload"):
+                        max_size = MAX_BULK_TOTAL_SIZE
                     elif path.endswith("/upload"):
                         max_size = MAX_FILE_SIZE
                     else:
@@ -676,6 +696,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Conversation-Persistence"],
 )
 
 
@@ -703,6 +724,16 @@ def make_session_key(user_id: str | int, session_id: str) -> str:
     return f"{user_id}:{session_id}"
 
 
+# One interpreter turn at a time per session (held until interpreter.chat returns)
+_chat_turn_locks: dict[str, threading.Lock] = {}
+_chat_turn_locks_guard = threading.Lock()
+
+
+def chat_turn_lock(session_key: str) -> threading.Lock:
+    with _chat_turn_locks_guard:
+        return _chat_turn_locks.setdefault(session_key, threading.Lock())
+
+
 async def scan_file(file_path: Path) -> tuple[bool, str]:
     """Scan a file for viruses using ClamAV"""
     # TODO: Not implemented yet
@@ -744,7 +775,6 @@ async def check_session_upload_limit(user_id: str, session_id: str) -> bool:
     return file_count < MAX_UPLOADS_PER_SESSION
 
 
-redis_client = redis.Redis(host="redis", port=6379, db=0)
 # Global dictionary to store interpreter instances
 # Not thread safe, but should be ok for proof of concept
 interpreter_instances: Dict[str, OpenInterpreter] = {}
@@ -876,6 +906,19 @@ async def list_users(token: str = Depends(get_auth_token), db: Session = Depends
         raise HTTPException(status_code=500, detail="Failed to list users")
 
 
+@app.get("/llm-scheduler/metrics")
+async def llm_scheduler_metrics(token: str = Depends(get_auth_token)):
+    """Queue times, rate-limit hits and remaining budgets per model (superuser only)"""
+    try:
+        _ensure_superuser(token)
+        return await asyncio.to_thread(llm_scheduler.get_scheduler_metrics)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading LLM scheduler metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read LLM scheduler metrics")
+
+
 @app.post("/users", response_model=UserPublic, status_code=201)
 async def create_user_admin(user_in: UserCreate, token: str = Depends(get_auth_token), db: Session = Depends(get_db)):
     """Create a new user (superuser only)"""
@@ -1055,6 +1098,7 @@ def get_or_create_interpreter(session_key: str, token: str | None = None, db: Se
         # Return existing instance if it exists
         if session_key in interpreter_instances:
             logger.info(f"Retrieved existing interpreter for session {session_key}")
+            refresh_kernel_token(session_key)
             return interpreter_instances[session_key]
 
         # Create new interpreter instance with default settings
@@ -1112,6 +1156,10 @@ def get_or_create_interpreter(session_key: str, token: str | None = None, db: Se
         interpreter.max_output = 64000 # Max number of characters (not tokens) for code outputs (SEA local, GPT5)
         interpreter.computer.import_computer_api = False
         interpreter.computer.run("python", custom_tool)
+        # The kernel's identity for internal API calls (core/kernel_auth.py)
+        user_id, raw_session_id = session_key.split(":", 1)
+        kernel_token = issue_kernel_token(user_id, raw_session_id)
+        interpreter.computer.run("python", f"_KERNEL_TOKEN = {kernel_token!r}")
         interpreter.auto_run = True
 
         # Store the instance
@@ -1157,6 +1205,12 @@ def clear_session(session_key: str):
             interpreter.reset()
             # Remove from instances dict
             del interpreter_instances[session_key]
+        revoke_kernel_token(session_key)
+
+        with _chat_turn_locks_guard:
+            lock = _chat_turn_locks.get(session_key)
+            if lock is not None and not lock.locked():
+                del _chat_turn_locks[session_key]
 
         # Clear Redis keys
         redis_client.delete(f"{LAST_ACTIVE_PREFIX}{session_key}")
@@ -1188,6 +1242,7 @@ def clear_all_interpreter_instances():
         for session_key, interpreter in list(interpreter_instances.items()):
             try:
                 interpreter.reset()
+                revoke_kernel_token(session_key)
                 logger.info(f"Reset interpreter for session {session_key}")
             except Exception as e:
                 logger.error(f"Error resetting interpreter for session {session_key}: {str(e)}")
@@ -1292,13 +1347,22 @@ async def chat_endpoint(request: Request, background_tasks: BackgroundTasks, tok
             raise HTTPException(status_code=401, detail="Invalid or expired token")
         session_key = make_session_key(user.id, session_id)
 
+        # Opt-in server-side persistence: when the client names a conversation,
+        # streamed output is assembled and stored here instead of being re-posted.
+        recorder = None
+        conversation_id = body.get("conversation_id")
+        if conversation_id:
+            try:
+                conversation_uuid = UUID(str(conversation_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid conversation_id")
+            if crud.get_user_conversation(session=db, conversation_id=conversation_uuid, user_id=user.id) is None:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            recorder = ConversationRecorder(conversation_uuid)
+
         logger.info(f"Received messages for session {session_key}")
         interpreter = get_or_create_interpreter(session_key, token, db)
 
-        # Ensure user PQA directories and settings exist
-        # Index building now happens lazily in query_knowledge_base()
-        ensure_user_pqa_settings(user.id)
-
         # Gather MCP tools first so we can include them in custom instructions
         tool_defs = []
         tool_lookup = {}
@@ -1334,15 +1398,6 @@ async def chat_endpoint(request: Request, background_tasks: BackgroundTasks, tok
 
         redis_client.set(f"{LAST_ACTIVE_PREFIX}{session_key}", str(time()))
 
-        # Update interpreter messages from any loaded conversation FIRST
-        stored_messages = redis_client.get(f"messages:{session_key}")
-        if stored_messages:
-            try:
-                interpreter.messages = json.loads(stored_messages)
-                logger.info(f"Restored {len(interpreter.messages)} messages from Redis for session {session_key}")
-            except Exception as e:
-                logger.warning(f"Failed to restore messages from Redis: {str(e)}")
-
         # MCP tools are now available via mcp_tools.py (generated at startup and when connections change)
         # No need to regenerate on every chat request
 
@@ -1365,8 +1420,44 @@ async def chat_endpoint(request: Request, background_tasks: BackgroundTasks, tok
         except Exception as exc:
             logger.warning("MCP planning/execution skipped: %s", exc)
 
+        progress_channel = kb_progress.open_channel(user.id, session_id)
+
+        turn_lock = chat_turn_lock(session_key)
+
+        def finish_turn():
+            # Runs once interpreter.chat has stopped changing interpreter.messages
+            try:
+                if recorder is not None:
+                    recorder.close()
+                redis_client.set(
+                    f"messages:{session_key}", json.dumps(interpreter.messages)
+                )
+            finally:
+                turn_lock.release()
+
         def event_stream():
+            if not turn_lock.acquire(timeout=CHAT_TURN_WAIT_SECONDS):
+                kb_progress.close_channel(progress_channel)
+                error_message = {"error": "The previous reply in this session is still finishing. Please try again."}
+                yield f"data: {json.dumps(error_message)}\n\n"
+                return
+            chat_started = False
             try:
+                # Update interpreter messages from any loaded conversation FIRST
+                stored_messages = redis_client.get(f"messages:{session_key}")
+                if stored_messages:
+                    try:
+                        interpreter.messages = json.loads(stored_messages)
+                        logger.info(f"Restored {len(interpreter.messages)} messages from Redis for session {session_key}")
+                    except Exception as e:
+                        logger.warning(f"Failed to restore messages from Redis: {str(e)}")
+
+                if recorder is not None and isinstance(messages[-1], dict):
+                    user_turn = dict(messages[-1])
+                    # Store what the user saw, not the LLM-facing attachment instructions
+                    if body.get("user_display_content"):
+                        user_turn["content"] = body["user_display_content"]
+                    recorder.record_user_message(user_turn)
                 if tool_runs:
                     streamed_keys: set[str] = set()
                     repos_summary = None
@@ -1414,21 +1505,36 @@ async def chat_endpoint(request: Request, background_tasks: BackgroundTasks, tok
                             "type": "message",
                             "content": repos_summary,
                         }
+                        if recorder is not None:
+                            recorder.feed(chunk)
                         yield f"data: {json.dumps(chunk)}\n\n"
 
-                for result in interpreter.chat(messages[-1], stream=True):
-                    data = json.dumps(result) if isinstance(result, dict) else result
-                    yield f"data: {data}\n\n"
+                # Knowledge base queries started by this turn report progress
+                # on the session's channel; interleave it with interpreter output.
+                # On a disconnect the interpreter is stopped, and the turn is
+                # finished (messages saved, lock released) only once it has.
+                chat_stream = interpreter.chat(messages[-1], stream=True)
+                chat_started = True
+                with closing(kb_progress.iter_with_progress(
+                    chat_stream, progress_channel,
+                    interrupt=interpreter.computer.stop, on_exit=finish_turn,
+                )) as stream:
+                    for is_progress, result in stream:
+                        if recorder is not None and not is_progress:
+                            recorder.feed(result)
+                        data = json.dumps(result) if isinstance(result, dict) else result
+                        yield f"data: {data}\n\n"
             except Exception as e:
                 logger.error(f"Error in chat stream: {str(e)}")
                 error_message = {"error": str(e)}
                 yield f"data: {json.dumps(error_message)}\n\n"
             finally:
-                redis_client.set(
-                    f"messages:{session_key}", json.dumps(interpreter.messages)
-                )
+                kb_progress.close_channel(progress_channel)
+                if not chat_started:
+                    finish_turn()
 
-        return StreamingResponse(event_stream(), media_type="text/event-stream")
+        headers = {"X-Conversation-Persistence": "server"} if recorder is not None else None
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
 
     except Exception as e:
         logger.error(f"Unexpected error in chat_endpoint: {str(e)}")
@@ -1472,6 +1578,62 @@ def clear_endpoint(request: Request, token: str = Depends(get_auth_token)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def _to_interpreter_message(msg: dict) -> dict | None:
+    """Convert a stored conversation message to the format the interpreter expects.
+
+    Returns None for messages that should not be replayed into the context.
+    """
+    # Skip console messages with active_line format as they cause issues
+    if (msg.get("message_type") == "console" and
+        msg.get("message_format") == "active_line"):
+        return None
+
+    # Convert to format the interpreter expects (with required fields)
+    if msg.get("role") in ["user", "assistant"]:
+        # For user/assistant messages, use message type
+        return {
+            "role": msg.get("role"),
+            "type": "message",
+            "content": msg.get("content", "")
+        }
+    elif msg.get("role") == "computer":
+        # For computer messages, convert to user with appropriate type (computer outputs are shown as user messages)
+        msg_type = msg.get("message_type", "message")
+        if msg_type == "console":
+            # Skip console messages entirely as they're not needed for context
+            # (Python environment state is not preserved between sessions)
+            return None
+        interpreter_msg = {
+            "role": "user", # "assistant", # Changed to "user" as assistant role does not support image output
+            "type": msg_type if msg_type in ["code", "message", "image"] else "message",
+            "content": msg.get("content", "")
+        }
+        if msg.get("message_format"):
+            interpreter_msg["format"] = msg.get("message_format")
+        return interpreter_msg
+    return None
+
+
+def _store_loaded_conversation(session_key: str, interpreter_messages: list[dict]) -> None:
+    """Store replayable messages in Redis and drop the session's interpreter."""
+    # Store messages in Redis - the interpreter will load them on next chat request
+    redis_client.set(
+        f"messages:{session_key}", json.dumps(interpreter_messages)
+    )
+
+    # Clear any existing interpreter instance so it gets recreated with new messages
+    if session_key in interpreter_instances:
+        try:
+            interpreter_instances[session_key].reset()
+            del interpreter_instances[session_key]
+            revoke_kernel_token(session_key)
+            logger.info(f"Cleared existing interpreter for session {session_key}")
+        except Exception as e:
+            logger.warning(f"Error clearing existing interpreter: {str(e)}")
+
+    logger.info(f"Stored {len(interpreter_messages)} messages in Redis for session {session_key}")
+
+
 @app.post("/load-conversation")
 async def load_conversation_endpoint(request: Request, token: str = Depends(get_auth_token), db: Session = Depends(get_db)):
     """Load a conversation's messages into the interpreter context"""
@@ -1493,52 +1655,11 @@ async def load_conversation_endpoint(request: Request, token: str = Depends(get_
         # Convert frontend message format to interpreter format
         interpreter_messages = []
         for msg in messages:
-            # Skip console messages with active_line format as they cause issues
-            if (msg.get("message_type") == "console" and 
-                msg.get("message_format") == "active_line"):
-                continue
-                
-            # Convert to format the interpreter expects (with required fields)
-            if msg.get("role") in ["user", "assistant"]:
-                # For user/assistant messages, use message type
-                interpreter_msg = {
-                    "role": msg.get("role"),
-                    "type": "message",
-                    "content": msg.get("content", "")
-                }
+            interpreter_msg = _to_interpreter_message(msg)
+            if interpreter_msg is not None:
                 interpreter_messages.append(interpreter_msg)
-            elif msg.get("role") == "computer":
-                # For computer messages, convert to user with appropriate type (computer outputs are shown as user messages)
-                msg_type = msg.get("message_type", "message")
-                if msg_type == "console":
-                    # Skip console messages entirely as they're not needed for context
-                    # (Python environment state is not preserved between sessions)
-                    continue
-                else:
-                    interpreter_msg = {
-                        "role": "user", # "assistant", # Changed to "user" as assistant role does not support image output
-                        "type": msg_type if msg_type in ["code", "message", "image"] else "message",
-                        "content": msg.get("content", "")
-                    }
-                    if msg.get("message_format"):
-                        interpreter_msg["format"] = msg.get("message_format")
-                    interpreter_messages.append(interpreter_msg)
-        
-        # Store messages in Redis - the interpreter will load them on next chat request
-        redis_client.set(
-            f"messages:{session_key}", json.dumps(interpreter_messages)
-        )
         
-        # Clear any existing interpreter instance so it gets recreated with new messages
-        if session_key in interpreter_instances:
-            try:
-                interpreter_instances[session_key].reset()
-                del interpreter_instances[session_key]
-                logger.info(f"Cleared existing interpreter for session {session_key}")
-            except Exception as e:
-                logger.warning(f"Error clearing existing interpreter: {str(e)}")
-        
-        logger.info(f"Stored {len(interpreter_messages)} messages in Redis for session {session_key}")
+        _store_loaded_conversation(session_key, interpreter_messages)
         return {"status": "Conversation loaded", "message_count": len(interpreter_messages)}
         
     except Exception as e:
@@ -1546,6 +1667,70 @@ async def load_conversation_endpoint(request: Request, token: str = Depends(get_
         raise HTTPException(status_code=500, detail=f"Failed to load conversation: {str(e)}")
 
 
+def _read_interpreter_messages(conversation_id: UUID) -> list[dict]:
+    """Stream a conversation's messages from Postgres and convert them for the interpreter."""
+    statement = (
+        select(
+            models.Message.role,
+            models.Message.content,
+            models.Message.message_type,
+            models.Message.message_format,
+        )
+        .where(
+            models.Message.conversation_id == conversation_id,
+            # Console output is never replayed, so don't fetch it at all
+            models.Message.message_type != models.MessageType.CONSOLE,
+        )
+        .order_by(models.Message.created_at)
+        .execution_options(yield_per=200)
+    )
+    interpreter_messages = []
+    with Session(engine) as session:
+        for role, content, message_type, message_format in session.exec(statement):
+            interpreter_msg = _to_interpreter_message({
+                "role": role.value,
+                "content": content,
+                "message_type": message_type.value,
+                "message_format": message_format.value if message_format else None,
+            })
+            if interpreter_msg is not None:
+                interpreter_messages.append(interpreter_msg)
+    return interpreter_messages
+
+
+@app.post("/load-conversation/{conversation_id}")
+async def load_conversation_by_id_endpoint(
+    conversation_id: UUID,
+    request: Request,
+    token: str = Depends(get_auth_token),
+    db: Session = Depends(get_db),
+):
+    """Load a stored conversation into the interpreter context directly from the database"""
+    try:
+        session_id = request.headers.get("x-session-id")
+        if not session_id:
+            raise HTTPException(status_code=400, detail="x-session-id header is required")
+
+        user = get_current_user(token)
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+        if crud.get_user_conversation(session=db, conversation_id=conversation_id, user_id=user.id) is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        session_key = make_session_key(user.id, session_id)
+        interpreter_messages = await asyncio.to_thread(_read_interpreter_messages, conversation_id)
+
+        _store_loaded_conversation(session_key, interpreter_messages)
+        return {"status": "Conversation loaded", "message_count": len(interpreter_messages)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error loading conversation {conversation_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to load conversation: {str(e)}")
+
+
 async def has_executable_header(file_path: Path) -> bool:
     """Check for executable file headers"""
     with open(file_path, "rb") as f:
@@ -1,11 +1,20 @@
-from typing import Any
+from typing import Any, Iterator
 from uuid import UUID
+import json
 import secrets
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+import sqlalchemy as sa
 from sqlmodel import Session, select
 
 from auth import get_db, get_auth_token, get_current_user
+from core.db import engine
+from core.cache import (
+    get_shared_conversation_cache,
+    invalidate_shared_conversation_cache,
+    set_shared_conversation_cache,
+)
 from models import (
     User,
     Conversation,
@@ -17,6 +26,8 @@ from models import (
     ConversationShared,
     ConversationShareCreate,
     ConversationShareResponse,
+    ConversationSearchHit,
+    ConversationSearchResults,
     Message,
     MessageCreate,
     MessagePublic,
@@ -27,6 +38,43 @@ from models import (
 
 router = APIRouter()
 
+# Rows fetched per round trip by the server-side cursor used for exports
+EXPORT_YIELD_PER = 50
+
+# Ranked full-text search over the trigger-maintained message.search_vector
+# (GIN indexed). Snippets are only generated for the page of conversations returned.
+CONVERSATION_SEARCH_SQL = sa.text("""
+    WITH q AS (
+        SELECT websearch_to_tsquery('english', :q) AS query
+    ),
+    hits AS (
+        SELECT m.conversation_id, m.id, ts_rank_cd(m.search_vector, q.query) AS rank
+        FROM message m
+        JOIN conversation c ON c.id = m.conversation_id
+        CROSS JOIN q
+        WHERE c.user_id = :user_id AND m.search_vector @@ q.query
+    ),
+    ranked AS (
+        SELECT conversation_id,
+               max(rank) AS rank,
+               count(*) AS hit_count,
+               (array_agg(id ORDER BY rank DESC))[1] AS message_id,
+               count(*) OVER () AS total
+        FROM hits
+        GROUP BY conversation_id
+        ORDER BY rank DESC
+        LIMIT :limit OFFSET :skip
+    )
+    SELECT c.id, c.title, c.is_favorite, c.updated_at, r.rank, r.hit_count, r.message_id, r.total,
+           ts_headline('english', left(m.content, 20000), q.query,
+                       'StartSel=**, StopSel=**, MaxFragments=2, MaxWords=25, MinWords=8') AS snippet
+    FROM ranked r
+    JOIN conversation c ON c.id = r.conversation_id
+    JOIN message m ON m.id = r.message_id
+    CROSS JOIN q
+    ORDER BY r.rank DESC, c.updated_at DESC
+""")
+
 
 def get_current_user_dependency(token: str = Depends(get_auth_token)) -> User:
     """Dependency to get the current user from auth token"""
@@ -92,6 +140,39 @@ def read_favorite_conversations(
     return ConversationsPublic(data=conversations, count=count)
 
 
+@router.get("/search", response_model=ConversationSearchResults)
+def search_conversations(
+    session: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user_dependency),
+    q: str = Query(..., min_length=1, max_length=500),
+    skip: int = 0,
+    limit: int = 20,
+) -> Any:
+    """
+    Full-text search across the current user's conversations, ranked by relevance.
+    """
+    rows = session.exec(
+        CONVERSATION_SEARCH_SQL,
+        params={"q": q, "user_id": current_user.id, "limit": limit, "skip": skip},
+    ).all()
+
+    hits = [
+        ConversationSearchHit(
+            id=row.id,
+            title=row.title,
+            is_favorite=row.is_favorite,
+            updated_at=row.updated_at,
+            rank=row.rank,
+            hit_count=row.hit_count,
+            message_id=row.message_id,
+            snippet=row.snippet,
+        )
+        for row in rows
+    ]
+    count = rows[0].total if rows else 0
+    return ConversationSearchResults(data=hits, count=count)
+
+
 @router.get("/{conversation_id}", response_model=ConversationWithMessages)
 def read_conversation(
     conversation_id: UUID,
@@ -128,6 +209,55 @@ def read_conversation(
     )
 
 
+def _export_conversation_ndjson(conversation_id: UUID) -> Iterator[bytes]:
+    """Yield a conversation header line followed by one NDJSON line per message.
+
+    Uses its own DB session because the request-scoped one is closed before the
+    response body is streamed. ``yield_per`` switches psycopg2 to a server-side
+    cursor, so only one batch of messages is held in memory at a time.
+    """
+    with Session(engine) as session:
+        conversation = session.get(Conversation, conversation_id)
+        if conversation is None:
+            return
+        header = ConversationPublic.model_validate(conversation, from_attributes=True).model_dump(mode="json")
+        yield (json.dumps({"type": "conversation", **header}) + "\n").encode("utf-8")
+
+        statement = (
+            select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.created_at)
+            .execution_options(yield_per=EXPORT_YIELD_PER)
+        )
+        for message in session.exec(statement):
+            line = MessagePublic.model_validate(message, from_attributes=True).model_dump(mode="json")
+            session.expunge(message)
+            yield (json.dumps({"type": "message", **line}) + "\n").encode("utf-8")
+
+
+@router.get("/{conversation_id}/export")
+def export_conversation(
+    conversation_id: UUID,
+    session: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user_dependency),
+) -> StreamingResponse:
+    """
+    Stream a conversation as NDJSON: a ``conversation`` line, then ``message`` lines.
+    """
+    conversation = session.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    if conversation.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    return StreamingResponse(
+        _export_conversation_ndjson(conversation_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversation-{conversation_id}.ndjson"'},
+    )
+
+
 @router.post("/", response_model=ConversationPublic)
 def create_conversation(
     *, 
@@ -167,8 +297,10 @@ def delete_conversation(
     if conversation.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
+    share_token = conversation.share_token
     session.delete(conversation)
     session.commit()
+    invalidate_shared_conversation_cache(share_token)
     return GenericMessage(message="Conversation deleted successfully")
 
 
@@ -215,6 +347,7 @@ def add_message(
     session.add(conversation)
     session.commit()
     session.refresh(message)
+    invalidate_shared_conversation_cache(conversation.share_token)
     
     return message
 
@@ -279,6 +412,8 @@ def update_conversation(
     session.add(conversation)
     session.commit()
     session.refresh(conversation)
+    # The shared payload includes the title
+    invalidate_shared_conversation_cache(conversation.share_token)
     return conversation
 
 
@@ -360,10 +495,12 @@ def remove_share_link(
     if conversation.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
+    share_token = conversation.share_token
     conversation.share_token = None
     conversation.is_shared = False
     session.add(conversation)
     session.commit()
+    invalidate_shared_conversation_cache(share_token)
     
     return GenericMessage(message="Share link removed successfully")
 
@@ -373,9 +510,13 @@ def get_shared_conversation(
     *,
     session: Session = Depends(get_db),
     share_token: str,
+    request: Request,
 ) -> Any:
     """
     Get a shared conversation by its share token (public access).
+
+    The serialized payload is cached in Redis per (share_token, updated_at) and
+    served with a strong ETag, so repeat views answer ``304 Not Modified``.
     """
     conversation = session.exec(
         select(Conversation).where(
@@ -386,19 +527,31 @@ def get_shared_conversation(
     
     if not conversation:
         raise HTTPException(status_code=404, detail="Shared conversation not found")
-    
-    # Get messages for this conversation
-    messages_statement = (
-        select(Message)
-        .where(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at)
-    )
-    messages = session.exec(messages_statement).all()
-    
-    return ConversationShared(
-        id=conversation.id,
-        title=conversation.title,
-        created_at=conversation.created_at,
-        updated_at=conversation.updated_at,
-        messages=messages
-    )
\ No newline at end of file
+
+    cached = get_shared_conversation_cache(share_token, conversation.updated_at)
+    if cached is not None:
+        etag, body = cached
+    else:
+        # Get messages for this conversation
+        messages_statement = (
+            select(Message)
+            .where(Message.conversation_id == conversation.id)
+            .order_by(Message.created_at)
+        )
+        messages = session.exec(messages_statement).all()
+
+        body = ConversationShared(
+            id=conversation.id,
+            title=conversation.title,
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at,
+            messages=messages
+        ).model_dump_json().encode("utf-8")
+        etag = set_shared_conversation_cache(share_token, conversation.updated_at, body)
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
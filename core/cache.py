@@ -0,0 +1,76 @@
+"""
+Shared Redis client and response caches.
+
+The Redis connection lives here (rather than in app.py) so routers and
+background workers can use it without importing the FastAPI application.
+"""
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.Redis(
+    host=os.getenv("REDIS_HOST", "redis"),
+    port=int(os.getenv("REDIS_PORT", "6379")),
+    db=0,
+)
+
+SHARED_CONVERSATION_PREFIX = "shared_conversation:"
+SHARED_CONVERSATION_TTL = 24 * 60 * 60  # 1 day; stale versions simply expire
+
+
+def _shared_conversation_key(share_token: str, updated_at: datetime) -> str:
+    return f"{SHARED_CONVERSATION_PREFIX}{share_token}:{updated_at.isoformat()}"
+
+
+def make_etag(payload: bytes) -> str:
+    """Strong ETag (quoted hex digest) for a serialized response body."""
+    return f'"{hashlib.sha256(payload).hexdigest()}"'
+
+
+def get_shared_conversation_cache(share_token: str, updated_at: datetime) -> tuple[str, bytes] | None:
+    """Return ``(etag, body)`` for a cached shared conversation, or None on miss."""
+    try:
+        raw = redis_client.get(_shared_conversation_key(share_token, updated_at))
+    except redis.RedisError as exc:
+        logger.warning(f"Shared conversation cache read failed: {exc}")
+        return None
+    if not raw:
+        return None
+    try:
+        cached = json.loads(raw)
+        return cached["etag"], cached["body"].encode("utf-8")
+    except Exception:
+        return None
+
+
+def set_shared_conversation_cache(share_token: str, updated_at: datetime, body: bytes) -> str:
+    """Cache a serialized shared conversation and return its ETag."""
+    etag = make_etag(body)
+    try:
+        redis_client.set(
+            _shared_conversation_key(share_token, updated_at),
+            json.dumps({"etag": etag, "body": body.decode("utf-8")}),
+            ex=SHARED_CONVERSATION_TTL,
+        )
+    except redis.RedisError as exc:
+        logger.warning(f"Shared conversation cache write failed: {exc}")
+    return etag
+
+
+def invalidate_shared_conversation_cache(share_token: Any) -> None:
+    """Drop every cached version of a shared conversation."""
+    if not share_token:
+        return
+    try:
+        keys = list(redis_client.scan_iter(match=f"{SHARED_CONVERSATION_PREFIX}{share_token}:*"))
+        if keys:
+            redis_client.delete(*keys)
+    except redis.RedisError as exc:
+        logger.warning(f"Shared conversation cache invalidation failed: {exc}")
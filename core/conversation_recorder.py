@@ -0,0 +1,249 @@
+"""
+Server-side conversation persistence for the chat stream.
+
+When the client passes a ``conversation_id`` to ``/chat`` the backend assembles
+the streamed OpenInterpreter chunks into complete messages (mirroring the
+rules used by ``frontend/assistant.js``) and persists them as ``Message`` rows.
+Completed messages are handed to a single background writer thread which
+drains whatever is queued and writes it in one transaction, so the streaming
+thread never blocks on the database.
+"""
+import json
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Any
+from uuid import UUID
+
+from sqlmodel import Session
+
+import crud
+from core.cache import invalidate_shared_conversation_cache
+from core.db import engine
+from models import Conversation, MessageFormat, MessageRecipient, MessageRole, MessageType
+
+logger = logging.getLogger(__name__)
+
+STD_STREAM_RECIPIENTS = ("stdout", "stderr")
+_BASE64_IMAGE_HEADERS = ("iVBORw0KGgo", "/9j/")  # PNG, JPEG
+
+_VALID_ROLES = {r.value for r in MessageRole}
+_VALID_TYPES = {t.value for t in MessageType}
+_VALID_FORMATS = {f.value for f in MessageFormat}
+_VALID_RECIPIENTS = {r.value for r in MessageRecipient}
+
+
+def _as_text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    try:
+        return json.dumps(content)
+    except Exception:
+        return str(content)
+
+
+def build_message_row(
+    role: str | None,
+    content: Any,
+    message_type: str | None = None,
+    message_format: str | None = None,
+    recipient: str | None = None,
+) -> dict[str, Any] | None:
+    """Coerce an assembled chat message into ``Message`` column values.
+
+    Returns None for messages the UI never persists (transient tool status,
+    ``active_line`` markers, empty console output, unknown roles).
+    """
+    if role not in _VALID_ROLES:
+        return None
+    text = _as_text(content)
+    message_type = message_type if message_type in _VALID_TYPES else MessageType.MESSAGE.value
+
+    if message_format == "tool_status":
+        return None
+    if message_type == MessageType.CONSOLE.value:
+        if message_format == MessageFormat.ACTIVE_LINE.value or not text.strip():
+            return None
+        if message_format not in _VALID_FORMATS:
+            message_format = MessageFormat.OUTPUT.value
+    elif not text:
+        return None
+
+    return {
+        "role": MessageRole(role),
+        "content": text,
+        "message_type": MessageType(message_type),
+        # stdout/stderr and other UI-only formats are not part of the DB enum
+        "message_format": MessageFormat(message_format) if message_format in _VALID_FORMATS else None,
+        "recipient": MessageRecipient(recipient) if recipient in _VALID_RECIPIENTS else None,
+    }
+
+
+class ConversationWriter:
+    """Single background thread that batches message inserts per conversation."""
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[tuple[UUID, list[dict[str, Any]]]]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="conversation-writer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, conversation_id: UUID, rows: list[dict[str, Any]]) -> None:
+        if not rows:
+            return
+        self._ensure_started()
+        self._queue.put((conversation_id, rows))
+
+    def _run(self) -> None:
+        while True:
+            conversation_id, rows = self._queue.get()
+            batches: dict[UUID, list[dict[str, Any]]] = {conversation_id: list(rows)}
+            # Drain everything that queued up while the previous batch was written
+            while True:
+                try:
+                    cid, more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.setdefault(cid, []).extend(more)
+            for cid, batch in batches.items():
+                try:
+                    with Session(engine) as session:
+                        crud.add_conversation_messages(
+                            session=session, conversation_id=cid, messages=batch
+                        )
+                        conversation = session.get(Conversation, cid)
+                        if conversation is not None:
+                            invalidate_shared_conversation_cache(conversation.share_token)
+                except Exception as exc:
+                    logger.error(
+                        "Failed to persist %d streamed messages for conversation %s: %s",
+                        len(batch), cid, exc,
+                    )
+
+
+conversation_writer = ConversationWriter()
+
+
+class ConversationRecorder:
+    """Assemble streamed chunks into messages and queue them for persistence."""
+
+    def __init__(self, conversation_id: UUID, writer: ConversationWriter = conversation_writer) -> None:
+        self.conversation_id = conversation_id
+        self._writer = writer
+        # Active message per (role, type), same keying as the frontend
+        self._active: dict[tuple[str, str], dict[str, Any]] = {}
+        self._completed: list[dict[str, Any]] = []
+        # Stamp rows in stream order; created_at drives message ordering on read
+        self._last_stamp: datetime | None = None
+
+    def _stamp(self) -> datetime:
+        now = datetime.utcnow()
+        if self._last_stamp is not None and now <= self._last_stamp:
+            now = self._last_stamp + timedelta(microseconds=1)
+        self._last_stamp = now
+        return now
+
+    def _complete(self, message: dict[str, Any]) -> None:
+        row = build_message_row(
+            message["role"],
+            message["content"],
+            message["type"],
+            message.get("format"),
+            message.get("recipient"),
+        )
+        if row is not None:
+            row["created_at"] = message["created_at"]
+            self._completed.append(row)
+
+    def _flush(self) -> None:
+        if self._completed:
+            self._writer.submit(self.conversation_id, self._completed)
+            self._completed = []
+
+    def record_user_message(self, message: dict[str, Any]) -> None:
+        """Persist the user turn that started this stream."""
+        row = build_message_row(
+            MessageRole.USER.value,
+            message.get("content"),
+            message.get("type") or message.get("message_type"),
+            message.get("format") or message.get("message_format"),
+            message.get("recipient"),
+        )
+        if row is not None:
+            row["created_at"] = self._stamp()
+            self._writer.submit(self.conversation_id, [row])
+
+    def feed(self, chunk: Any) -> None:
+        """Consume one streamed chunk; flushes whenever a message boundary is reached."""
+        if not isinstance(chunk, dict) or chunk.get("error"):
+            return
+
+        recipient = (chunk.get("recipient") or "").lower() or None
+        chunk_type = chunk.get("type")
+        chunk_format = chunk.get("format")
+        if chunk_type in ("message", "text") and recipient in STD_STREAM_RECIPIENTS:
+            chunk_type = "console"
+            chunk_format = chunk_format or recipient
+        if chunk_type == "console":
+            if chunk_format == MessageFormat.ACTIVE_LINE.value:
+                return
+            chunk_format = chunk_format or recipient or MessageFormat.OUTPUT.value
+
+        key = (chunk.get("role") or "", chunk_type or "")
+        content = _as_text(chunk.get("content"))
+
+        if chunk.get("start"):
+            previous = self._active.pop(key, None)
+            if previous is not None:
+                self._complete(previous)
+            self._active[key] = {
+                "role": chunk.get("role"),
+                "type": chunk_type,
+                "format": chunk_format,
+                "recipient": recipient,
+                "content": "",
+                "created_at": self._stamp(),
+            }
+
+        message = self._active.get(key)
+        if message is None:
+            return
+
+        # OpenInterpreter streams consecutive base64 images without a start marker
+        if (
+            message["type"] == "image"
+            and message["content"]
+            and (chunk_format or message["format"] or "").startswith("base64.")
+            and not chunk.get("start")
+            and content.lstrip().startswith(_BASE64_IMAGE_HEADERS)
+        ):
+            self._complete(message)
+            self._flush()
+            message = {**message, "content": "", "created_at": self._stamp()}
+            self._active[key] = message
+
+        message["format"] = chunk_format or message["format"]
+        message["recipient"] = recipient or message["recipient"]
+        message["content"] += content
+
+        if chunk.get("end"):
+            self._active.pop(key, None)
+            self._complete(message)
+            self._flush()
+
+    def close(self) -> None:
+        """Persist any message still open when the stream ends or is aborted."""
+        for message in self._active.values():
+            self._complete(message)
+        self._active.clear()
+        self._flush()
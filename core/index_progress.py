@@ -0,0 +1,223 @@
+"""
+Live progress of knowledge base index builds.
+
+The index worker (``index_worker.py``) runs builds in its own process, so
+progress is relayed through Redis:
+
+* ``kb_index:events:<user_id>`` is a pub/sub channel carrying one event per
+  step of the build;
+* ``kb_index:progress:<user_id>`` holds the latest event, so a client that
+  connects mid-build starts from the current counts.
+
+Every event carries the build's file counts (queued, parsed, embedded,
+cached, failed, done) and an ETA; file events also carry the file name and
+per-stage durations. ``GET /knowledge-base/index/events`` streams them as SSE.
+"""
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+import redis
+
+from core.cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL_PREFIX = "kb_index:events:"
+PROGRESS_KEY_PREFIX = "kb_index:progress:"
+PROGRESS_TTL_SECONDS = 24 * 60 * 60
+# Files listed as the slowest in index_status.json
+SLOWEST_FILES_LIMIT = 10
+
+TERMINAL_EVENTS = ("finished", "failed")
+# Index job states (core/index_queue.py) that mean another build is coming
+_ACTIVE_JOB_STATES = ("queued", "running", "retrying")
+
+
+def _events_channel(user_id: Any) -> str:
+    return f"{EVENTS_CHANNEL_PREFIX}{user_id}"
+
+
+def _progress_key(user_id: Any) -> str:
+    return f"{PROGRESS_KEY_PREFIX}{user_id}"
+
+
+def _total_seconds(entry: dict) -> float:
+    return round(sum(v for k, v in entry.items() if k.endswith("_seconds") and k != "total_seconds"), 3)
+
+
+class IndexProgress:
+    """Tracks one index build and publishes its progress.
+
+    With ``publish=False`` only timings are collected (used when a query
+    brings the store up to date itself).
+    """
+
+    def __init__(self, user_id: Any, publish: bool = True) -> None:
+        self.user_id = str(user_id)
+        self.publish = publish
+        self.build_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.phase = "starting"
+        self.counts = {"queued": 0, "parsed": 0, "embedded": 0, "cached": 0, "failed": 0, "done": 0}
+        self.files: dict[str, dict] = {}
+        self._t_start = time.perf_counter()
+        self._t_files: Optional[float] = None
+        self._marks: dict[str, float] = {}
+
+    # -- build lifecycle ----------------------------------------------------
+
+    def set_phase(self, phase: str) -> None:
+        self.phase = phase
+        self._publish("phase")
+
+    def queue_files(self, names: list[str], removed: int = 0, unchanged: int = 0) -> None:
+        self.phase = "documents"
+        self.counts["queued"] = len(names)
+        self._t_files = time.perf_counter()
+        self._publish("queued", queued_files=sorted(names), removed=removed, unchanged=unchanged)
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.phase = "failed" if error else "finished"
+        if error:
+            self._publish("failed", error=error[:500])
+        else:
+            self._publish("finished", slowest_files=self.slowest_files())
+
+    # -- per-file steps -----------------------------------------------------
+
+    def _lap(self, name: str) -> float:
+        """Seconds since the previous step of ``name`` (or since it started)."""
+        now = time.perf_counter()
+        seconds = now - self._marks.get(name, now)
+        self._marks[name] = now
+        return round(seconds, 3)
+
+    def file_started(self, name: str) -> None:
+        self._marks[name] = time.perf_counter()
+        self.files[name] = {"file": name}
+
+    def resume(self, name: str) -> None:
+        """Restart the step timer, e.g. once a parse slot is free, so waiting is not counted."""
+        self._marks[name] = time.perf_counter()
+
+    def file_parsed(self, name: str, chunks: int) -> None:
+        self.counts["parsed"] += 1
+        self.files[name].update(parse_seconds=self._lap(name), chunks=chunks)
+        self._publish("parsed", **self.files[name])
+
+    def file_embedded(self, name: str) -> None:
+        self.counts["embedded"] += 1
+        self.files[name]["embed_seconds"] = self._lap(name)
+        self._publish("embedded", **self.files[name])
+
+    def file_cached(self, name: str, chunks: int) -> None:
+        """Chunks and embeddings were reused from the shared chunk cache."""
+        self.counts["cached"] += 1
+        self.files[name].update(cached=True, chunks=chunks, load_seconds=self._lap(name))
+
+    def file_done(self, name: str) -> None:
+        self.counts["done"] += 1
+        entry = self.files[name]
+        entry["store_seconds"] = self._lap(name)
+        entry["total_seconds"] = _total_seconds(entry)
+        self._publish("file_done", **entry)
+
+    def file_failed(self, name: str, stage: str, error: Any) -> None:
+        self.counts["failed"] += 1
+        entry = self.files.setdefault(name, {"file": name})
+        entry.update({"failed_stage": stage, "error": str(error)[:500], f"{stage}_seconds": self._lap(name)})
+        entry["total_seconds"] = _total_seconds(entry)
+        self._publish("file_failed", **entry)
+
+    # -- derived values -----------------------------------------------------
+
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining time at the build's file throughput so far (None until a file finishes)."""
+        finished = self.counts["done"] + self.counts["failed"]
+        remaining = self.counts["queued"] - finished
+        if self._t_files is None:
+            return None
+        if remaining <= 0:
+            return 0.0
+        if finished == 0:
+            return None
+        return round((time.perf_counter() - self._t_files) / finished * remaining, 1)
+
+    def slowest_files(self, limit: int = SLOWEST_FILES_LIMIT) -> list[dict]:
+        timed = [f for f in self.files.values() if "total_seconds" in f]
+        timed.sort(key=lambda f: f["total_seconds"], reverse=True)
+        return timed[:limit]
+
+    def snapshot(self) -> dict:
+        return {
+            "build_id": self.build_id,
+            "started_at": self.started_at,
+            "phase": self.phase,
+            "elapsed_seconds": round(time.perf_counter() - self._t_start, 3),
+            "files": dict(self.counts),
+            "eta_seconds": self.eta_seconds(),
+        }
+
+    def _publish(self, event: str, **fields: Any) -> None:
+        if not self.publish:
+            return
+        payload = json.dumps({"event": event, **self.snapshot(), **fields})
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(_progress_key(self.user_id), payload, ex=PROGRESS_TTL_SECONDS)
+            pipe.publish(_events_channel(self.user_id), payload)
+            pipe.execute()
+        except redis.RedisError as exc:
+            # Progress is best effort; never fail a build over it
+            logger.debug(f"[PQA] Failed to publish index progress for user {self.user_id}: {exc}")
+
+
+def read_index_progress(user_id: Any) -> Optional[dict]:
+    """The latest progress event for a user's index build, if any."""
+    try:
+        raw = redis_client.get(_progress_key(user_id))
+    except redis.RedisError as exc:
+        logger.warning(f"[PQA] Failed to read index progress for user {user_id}: {exc}")
+        return None
+    return json.loads(raw) if raw else None
+
+
+def _build_expected(user_id: Any) -> bool:
+    from core.index_queue import get_index_job
+
+    return get_index_job(user_id).get("state") in _ACTIVE_JOB_STATES
+
+
+def iter_index_events(user_id: Any, heartbeat_seconds: float = 15.0) -> Iterator[Optional[dict]]:
+    """Yield a user's index progress events as they are published.
+
+    Starts with the latest stored event, then follows the pub/sub channel
+    until the user has no build running or queued. ``None`` is yielded every
+    ``heartbeat_seconds`` without events so the caller can keep the
+    connection alive.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_events_channel(user_id))
+    try:
+        latest = read_index_progress(user_id)
+        if latest is not None:
+            yield latest
+        if not _build_expected(user_id) and (latest is None or latest["event"] in TERMINAL_EVENTS):
+            return
+        while True:
+            message = pubsub.get_message(timeout=heartbeat_seconds)
+            if message is None:
+                if not _build_expected(user_id):
+                    return
+                yield None
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event["event"] in TERMINAL_EVENTS and not _build_expected(user_id):
+                return
+    finally:
+        pubsub.close()
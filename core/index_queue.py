@@ -0,0 +1,260 @@
+"""
+Durable, coalescing knowledge-base index job queue (Redis).
+
+Uploads and deletes call ``enqueue_index_job``; the dedicated worker process
+(``index_worker.py``) claims due jobs and runs the build. Each user has at
+most one pending job:
+
+* ``kb_index:pending`` is a sorted set of user ids scored by when the job may
+  run. Re-enqueueing only moves the score, so a burst of uploads coalesces
+  into one build. The score is pushed back by ``INDEX_JOB_DEBOUNCE_SECONDS``
+  on every request, capped at ``INDEX_JOB_MAX_DELAY_SECONDS`` after the first.
+* Claiming a job pushes its score out by a lease instead of removing it, so a
+  job whose worker dies is picked up again once the lease expires.
+* ``kb_index:job:<user_id>`` holds job state, attempts and timings, surfaced
+  through ``read_index_status``.
+* ``kb_index:lock:<user_id>`` keeps two workers from building the same
+  user's index at once.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import redis
+
+from core.cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+INDEX_JOB_DEBOUNCE_SECONDS = float(os.getenv("INDEX_JOB_DEBOUNCE_SECONDS", "5"))
+INDEX_JOB_MAX_DELAY_SECONDS = float(os.getenv("INDEX_JOB_MAX_DELAY_SECONDS", "60"))
+INDEX_JOB_LEASE_SECONDS = int(os.getenv("INDEX_JOB_LEASE_SECONDS", "300"))
+INDEX_JOB_MAX_ATTEMPTS = int(os.getenv("INDEX_JOB_MAX_ATTEMPTS", "3"))
+INDEX_JOB_RETRY_BASE_SECONDS = float(os.getenv("INDEX_JOB_RETRY_BASE_SECONDS", "30"))
+
+PENDING_KEY = "kb_index:pending"
+JOB_KEY_PREFIX = "kb_index:job:"
+LOCK_KEY_PREFIX = "kb_index:lock:"
+
+
+def _job_key(user_id: Any) -> str:
+    return f"{JOB_KEY_PREFIX}{user_id}"
+
+
+def _lock_key(user_id: Any) -> str:
+    return f"{LOCK_KEY_PREFIX}{user_id}"
+
+
+# KEYS: pending, job  ARGV: user_id, now, debounce, max_delay
+_ENQUEUE_SCRIPT = redis_client.register_script("""
+local first = redis.call('HGET', KEYS[2], 'first_requested_at')
+if not first then
+    first = ARGV[2]
+    redis.call('HSET', KEYS[2], 'first_requested_at', first)
+end
+local run_at = math.min(tonumber(ARGV[2]) + tonumber(ARGV[3]), tonumber(first) + tonumber(ARGV[4]))
+redis.call('ZADD', KEYS[1], run_at, ARGV[1])
+redis.call('HINCRBY', KEYS[2], 'generation', 1)
+redis.call('HINCRBY', KEYS[2], 'coalesced_requests', 1)
+redis.call('HSET', KEYS[2], 'last_requested_at', ARGV[2])
+if redis.call('HGET', KEYS[2], 'state') ~= 'running' then
+    redis.call('HSET', KEYS[2], 'state', 'queued', 'attempts', 0)
+end
+return run_at
+""")
+
+# KEYS: pending  ARGV: now, lease_until
+_CLAIM_SCRIPT = redis_client.register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #due == 0 then
+    return false
+end
+redis.call('ZADD', KEYS[1], ARGV[2], due[1])
+return due[1]
+""")
+
+# KEYS: pending, job  ARGV: user_id, claimed_generation
+_FINISH_SCRIPT = redis_client.register_script("""
+if redis.call('HGET', KEYS[2], 'generation') == ARGV[2] then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+""")
+
+# KEYS: lock  ARGV: worker_id
+_RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# KEYS: lock  ARGV: worker_id, lease_seconds
+_EXTEND_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+
+def enqueue_index_job(user_id: Any) -> None:
+    """Request an index build for a user (coalesced and debounced)."""
+    try:
+        _ENQUEUE_SCRIPT(
+            keys=[PENDING_KEY, _job_key(user_id)],
+            args=[str(user_id), time.time(), INDEX_JOB_DEBOUNCE_SECONDS, INDEX_JOB_MAX_DELAY_SECONDS],
+        )
+    except redis.RedisError as exc:
+        logger.error(f"[PQA] Failed to enqueue index job for user {user_id}: {exc}")
+
+
+def get_index_job(user_id: Any) -> dict:
+    """Return the job record for a user (empty dict if none or Redis is down)."""
+    try:
+        raw = redis_client.hgetall(_job_key(user_id))
+        pending_score = redis_client.zscore(PENDING_KEY, str(user_id))
+    except redis.RedisError as exc:
+        logger.warning(f"[PQA] Failed to read index job for user {user_id}: {exc}")
+        return {}
+    job = {k.decode(): v.decode() for k, v in raw.items()}
+    if not job:
+        return {}
+    for field in ("generation", "claimed_generation", "attempts", "coalesced_requests", "batched_requests"):
+        if field in job:
+            job[field] = int(job[field])
+    for field in (
+        "first_requested_at", "last_requested_at", "started_at", "finished_at",
+        "duration_seconds", "queue_seconds", "next_attempt_at",
+    ):
+        if field in job:
+            job[field] = float(job[field])
+    if job.get("state") == "queued" and pending_score is not None:
+        job["scheduled_at"] = pending_score
+    if job.get("state") == "running":
+        job["rerun_requested"] = job.get("generation", 0) > job.get("claimed_generation", 0)
+    return job
+
+
+class ClaimedJob:
+    """A claimed index job; keeps its lease alive until finished."""
+
+    def __init__(self, user_id: str, worker_id: str, generation: int, queue_seconds: float) -> None:
+        self.user_id = user_id
+        self.worker_id = worker_id
+        self.generation = generation
+        self.queue_seconds = queue_seconds
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_lease, name=f"index-lease-{user_id}", daemon=True)
+        self._heartbeat.start()
+
+    def _renew_lease(self) -> None:
+        interval = max(INDEX_JOB_LEASE_SECONDS / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                if not _EXTEND_LOCK_SCRIPT(
+                    keys=[_lock_key(self.user_id)], args=[self.worker_id, INDEX_JOB_LEASE_SECONDS]
+                ):
+                    # The lease expired and another worker may hold the lock now;
+                    # extending it would keep that worker's lock alive for us
+                    logger.warning(f"[PQA] Index job lease for user {self.user_id} was lost by {self.worker_id}.")
+                    return
+                # Leave the score alone once a newer request has rescheduled it
+                generation = redis_client.hget(_job_key(self.user_id), "generation")
+                if int(generation or 0) == self.generation:
+                    redis_client.zadd(
+                        PENDING_KEY, {self.user_id: time.time() + INDEX_JOB_LEASE_SECONDS}, xx=True
+                    )
+            except redis.RedisError as exc:
+                logger.warning(f"[PQA] Failed to renew index job lease for user {self.user_id}: {exc}")
+
+    def _close(self) -> None:
+        self._stop.set()
+        self._heartbeat.join(timeout=5)
+        try:
+            _RELEASE_LOCK_SCRIPT(keys=[_lock_key(self.user_id)], args=[self.worker_id])
+        except redis.RedisError as exc:
+            logger.warning(f"[PQA] Failed to release index lock for user {self.user_id}: {exc}")
+
+    def _requeue_if_requested(self) -> bool:
+        """Drop the pending entry, or reschedule it if a request arrived mid-build."""
+        if _FINISH_SCRIPT(keys=[PENDING_KEY, _job_key(self.user_id)], args=[self.user_id, self.generation]):
+            return False
+        redis_client.zadd(PENDING_KEY, {self.user_id: time.time() + INDEX_JOB_DEBOUNCE_SECONDS})
+        return True
+
+    def succeed(self) -> None:
+        self._close()
+        finished = time.time()
+        rerun = self._requeue_if_requested()
+        redis_client.hset(_job_key(self.user_id), mapping={
+            "state": "queued" if rerun else "succeeded",
+            "finished_at": finished,
+            "duration_seconds": round(finished - self.started_at, 3),
+            "attempts": 0,
+        })
+        redis_client.hdel(_job_key(self.user_id), "last_error", "next_attempt_at")
+
+    def fail(self, error: str) -> None:
+        self._close()
+        finished = time.time()
+        job_key = _job_key(self.user_id)
+        attempts = redis_client.hincrby(job_key, "attempts", 1)
+        mapping = {
+            "finished_at": finished,
+            "duration_seconds": round(finished - self.started_at, 3),
+            "last_error": error[:2000],
+        }
+        if attempts < INDEX_JOB_MAX_ATTEMPTS:
+            retry_at = finished + INDEX_JOB_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            redis_client.zadd(PENDING_KEY, {self.user_id: retry_at})
+            mapping.update({"state": "retrying", "next_attempt_at": retry_at})
+        else:
+            # Give up unless a newer request arrived while this attempt ran
+            if self._requeue_if_requested():
+                mapping["state"] = "queued"
+                mapping["attempts"] = 0
+            else:
+                mapping["state"] = "failed"
+        redis_client.hset(job_key, mapping=mapping)
+
+
+def claim_index_job(worker_id: str) -> Optional[ClaimedJob]:
+    """Claim the next due job, or return None if nothing is ready."""
+    now = time.time()
+    user_id = _CLAIM_SCRIPT(keys=[PENDING_KEY], args=[now, now + INDEX_JOB_LEASE_SECONDS])
+    if not user_id:
+        return None
+    user_id = user_id.decode() if isinstance(user_id, bytes) else str(user_id)
+
+    if not redis_client.set(_lock_key(user_id), worker_id, nx=True, ex=INDEX_JOB_LEASE_SECONDS):
+        # Another worker is still building this user's index; try again shortly
+        redis_client.zadd(PENDING_KEY, {user_id: now + INDEX_JOB_DEBOUNCE_SECONDS})
+        return None
+
+    job_key = _job_key(user_id)
+    pipe = redis_client.pipeline()
+    pipe.hget(job_key, "generation")
+    pipe.hget(job_key, "first_requested_at")
+    pipe.hget(job_key, "coalesced_requests")
+    generation_raw, first_raw, requests_raw = pipe.execute()
+    generation = int(generation_raw or 0)
+    queue_seconds = round(now - float(first_raw), 3) if first_raw else 0.0
+
+    redis_client.hset(job_key, mapping={
+        "state": "running",
+        "claimed_generation": generation,
+        "started_at": now,
+        "queue_seconds": queue_seconds,
+        "worker": worker_id,
+        # Requests folded into this run; the counter restarts for the next one
+        "batched_requests": int(requests_raw or 0),
+        "coalesced_requests": 0,
+    })
+    # Requests from here on open a new debounce window
+    redis_client.hdel(job_key, "first_requested_at")
+    return ClaimedJob(user_id, worker_id, generation, queue_seconds)
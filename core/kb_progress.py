@@ -0,0 +1,204 @@
+"""
+Knowledge base query progress events for the chat SSE stream.
+
+A knowledge base query runs in the API process (``core/kb_query_service.py``)
+while the chat stream that triggered it is blocked waiting on the kernel.
+The chat stream opens a channel for its (user, session) and
+``iter_with_progress`` interleaves the interpreter's chunks with events the
+query publishes to that channel:
+
+* ``retrieval``    - chunks selected for evidence (and cutoff skips);
+* ``evidence``     - one per evidence summary, with its citation and score;
+* ``answer_token`` - answer text as it is generated;
+* ``answer_cache`` - the answer was served from the cache.
+
+Events are rendered as transient ``tool_status`` chunks, which the frontend
+shows as status lines and the conversation recorder does not persist.
+"""
+import logging
+import os
+import queue
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_CHUNK = "chunk"
+_PROGRESS = "progress"
+_ERROR = "error"
+_DONE = "done"
+
+# How long a disconnected chat stream waits for the interpreter to stop
+STOP_TIMEOUT_SECONDS = float(os.getenv("CHAT_STOP_TIMEOUT", "10"))
+
+
+class ProgressChannel:
+    """Thread-safe queue shared by a chat stream and the queries it triggers."""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.queue: queue.Queue = queue.Queue()
+        self.answer_streaming = False
+
+    def put(self, kind: str, item: Any = None) -> None:
+        self.queue.put((kind, item))
+
+
+_channels: dict[str, ProgressChannel] = {}
+_channels_lock = threading.Lock()
+
+
+def _channel_key(user_id: Any, session_id: Optional[str]) -> str:
+    return f"{user_id}:{session_id}"
+
+
+def open_channel(user_id: Any, session_id: str) -> ProgressChannel:
+    channel = ProgressChannel(_channel_key(user_id, session_id))
+    with _channels_lock:
+        _channels[channel.key] = channel
+    return channel
+
+
+def close_channel(channel: ProgressChannel) -> None:
+    with _channels_lock:
+        if _channels.get(channel.key) is channel:
+            del _channels[channel.key]
+
+
+def publish(user_id: Any, session_id: Optional[str], event: dict) -> None:
+    """Send a progress event to the session's chat stream, if one is open."""
+    if not session_id:
+        return
+    with _channels_lock:
+        channel = _channels.get(_channel_key(user_id, session_id))
+    if channel is not None:
+        channel.put(_PROGRESS, event)
+
+
+def _status_chunk(content: str, start: bool = False, end: bool = False, event: Optional[dict] = None) -> dict:
+    chunk = {"role": "computer", "type": "message", "format": "tool_status", "content": content}
+    if start:
+        chunk["start"] = True
+    if end:
+        chunk["end"] = True
+    if event is not None:
+        chunk["kb_event"] = event
+    return chunk
+
+
+def progress_chunks(channel: ProgressChannel, event: dict) -> list[dict]:
+    """Render one progress event as SSE chunks."""
+    kind = event.get("event")
+    chunks = []
+    if kind != "answer_token" and channel.answer_streaming:
+        channel.answer_streaming = False
+        chunks.append(_status_chunk("", end=True))
+
+    if kind == "retrieval":
+        text = f"📚 Knowledge base: {event['chunks']} passages selected"
+        if event.get("chunks_skipped"):
+            text += f" ({event['chunks_skipped']} below relevance cutoff)"
+        chunks.append(_status_chunk(text, start=True, end=True, event=event))
+    elif kind == "evidence":
+        source = " (cached)" if event.get("cached") else ""
+        chunks.append(_status_chunk(
+            f"📄 Evidence{source}: {event['citation']} — relevance {event['score']}/10",
+            start=True, end=True, event=event,
+        ))
+    elif kind == "answer_cache":
+        chunks.append(_status_chunk(
+            f"📚 Knowledge base answer served from cache ({event['result']})",
+            start=True, end=True, event=event,
+        ))
+    elif kind == "answer_token":
+        if not channel.answer_streaming:
+            channel.answer_streaming = True
+            chunks.append(_status_chunk("✍️ Drafting answer: ", start=True))
+        chunks.append(_status_chunk(event.get("text", "")))
+    return chunks
+
+
+def iter_with_progress(
+    chunks: Iterator[Any],
+    channel: ProgressChannel,
+    interrupt: Optional[Callable[[], None]] = None,
+    on_exit: Optional[Callable[[], None]] = None,
+    stop_timeout: float = STOP_TIMEOUT_SECONDS,
+) -> Iterator[tuple[bool, Any]]:
+    """Yield ``(is_progress, chunk)`` from ``chunks`` interleaved with progress events.
+
+    ``chunks`` (the interpreter's stream) is consumed on a helper thread so the
+    caller can forward progress while the interpreter is blocked on a tool call.
+    Closing this generator early (client disconnect) calls ``interrupt`` and
+    waits up to ``stop_timeout`` seconds for the producer to stop.
+    ``on_exit`` runs once both this generator and the producer are done, so
+    callers can save interpreter state only after ``chunks`` stopped changing
+    it; if the producer outlives the timeout it runs on the producer thread.
+    """
+    stop = threading.Event()
+    exit_lock = threading.Lock()
+    pending = [2]  # consumer + producer
+
+    def _arrive() -> None:
+        with exit_lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if last and on_exit is not None:
+            try:
+                on_exit()
+            except Exception as exc:
+                logger.error(f"Chat stream cleanup failed for {channel.key}: {exc}")
+
+    def _produce() -> None:
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                channel.put(_CHUNK, chunk)
+        except Exception as exc:
+            channel.put(_ERROR, exc)
+        finally:
+            close = getattr(chunks, "close", None)
+            if stop.is_set() and close is not None:
+                close()
+            channel.put(_DONE)
+            _arrive()
+
+    producer = threading.Thread(target=_produce, name=f"chat-stream-{channel.key}", daemon=True)
+    producer.start()
+    finished = False
+    try:
+        while True:
+            kind, item = channel.queue.get()
+            if kind == _DONE:
+                finished = True
+                break
+            if kind == _ERROR:
+                finished = True
+                raise item
+            if kind == _CHUNK:
+                if channel.answer_streaming:
+                    channel.answer_streaming = False
+                    yield True, _status_chunk("", end=True)
+                yield False, item
+            else:
+                for chunk in progress_chunks(channel, item):
+                    yield True, chunk
+    finally:
+        stop.set()
+        if finished:
+            # Only its cleanup is left
+            producer.join()
+        elif producer.is_alive():
+            if interrupt is not None:
+                try:
+                    interrupt()
+                except Exception as exc:
+                    logger.warning(f"Failed to interrupt chat stream {channel.key}: {exc}")
+            producer.join(stop_timeout)
+            if producer.is_alive():
+                logger.warning(
+                    f"Chat stream {channel.key} still running {stop_timeout}s after disconnect; "
+                    "cleanup deferred until it stops."
+                )
+        _arrive()
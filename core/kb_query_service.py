@@ -0,0 +1,147 @@
+"""
+Knowledge base query service.
+
+Runs PaperQA queries inside the API process instead of inside every user's
+interpreter kernel. The kernel-side ``query_knowledge_base`` is a thin HTTP
+client for ``POST /knowledge-base/internal/query``, so kernels no longer import
+paperqa, patch their event loop with nest_asyncio or each keep their own copy
+of a user's Docs.
+
+Queries only read the store the index worker last published (see
+``load_published_docs``); new papers become queryable when their build
+completes. One Docs object (plus its revision) is cached per user, bounded by
+``KB_QUERY_CACHE_SIZE`` with least-recently-used eviction. A per-user lock
+keeps concurrent queries from loading the same store twice.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from core import kb_progress
+from utils.pqa_multi_tenant import (
+    get_user_index_files,
+    get_user_settings,
+    load_published_docs,
+    read_published_revision,
+)
+from utils.pqa_base_corpus import merge_with_base
+from utils.pqa_media_store import media_reference
+from utils.pqa_query_cache import cached_aquery
+
+logger = logging.getLogger(__name__)
+
+KB_QUERY_CACHE_SIZE = int(os.getenv("KB_QUERY_CACHE_SIZE", "32"))
+
+def session_image_references(session: Any, user_id: Any) -> list[dict]:
+    """References to the stored figures attached to a session's contexts."""
+    images = []
+    seen = set()
+    used_context_ids = getattr(session, "used_contexts", set())
+
+    for context in session.contexts:
+        is_used = context.id in used_context_ids if used_context_ids else True
+        if not hasattr(context, "text") or not hasattr(context.text, "media"):
+            continue
+
+        for media in context.text.media:
+            try:
+                reference = media_reference(user_id, media)
+            except OSError as e:
+                logger.warning(f"[PQA] Failed to resolve media: {e}")
+                continue
+            if reference is None or reference["media_id"] in seen:
+                continue
+            seen.add(reference["media_id"])
+            info = media.info or {}
+            images.append({
+                **reference,
+                "page": info.get("page_num", info.get("page")),
+                "type": info.get("type", "image"),
+                "description": info.get("enriched_description", ""),
+                "context_id": context.id,
+                "used_in_answer": is_used,
+                "chunk_name": getattr(context.text, "name", ""),
+            })
+    return images
+
+
+class KBQueryService:
+    """Per-user Docs cache (LRU) and query entry point."""
+
+    def __init__(self, max_users: int = KB_QUERY_CACHE_SIZE) -> None:
+        self.max_users = max(max_users, 1)
+        self._docs: OrderedDict[str, dict] = OrderedDict()
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def _remember(self, key: str, docs: Any, revision: str) -> None:
+        self._docs[key] = {"docs": docs, "revision": revision}
+        self._docs.move_to_end(key)
+        while len(self._docs) > self.max_users:
+            evicted, _ = self._docs.popitem(last=False)
+            logger.info(f"[PQA] Evicted cached Docs for user {evicted}.")
+
+    async def _get_docs(self, user_id: Any, settings: Any) -> tuple[Any, Optional[str]]:
+        key = str(user_id)
+        revision = await asyncio.to_thread(read_published_revision, user_id)
+        if revision is None:
+            return None, None
+        cached = self._docs.get(key)
+        if cached and cached["revision"] == revision:
+            self._docs.move_to_end(key)
+            return cached["docs"], revision
+
+        # Unpickling stays off the API event loop
+        docs, revision = await asyncio.to_thread(load_published_docs, user_id, settings)
+        if docs is not None:
+            self._remember(key, docs, revision)
+        return docs, revision
+
+    async def query(self, user_id: Any, query: str, session_id: Optional[str] = None) -> dict:
+        """Answer ``query`` against the user's knowledge base."""
+        t_start = time.perf_counter()
+        settings = get_user_settings(user_id)
+        # The published index generation; a rebuild in progress does not affect it
+        index_files = await get_user_index_files(user_id, settings)
+
+        docs = revision = None
+        if index_files:
+            async with self._lock(str(user_id)):
+                docs, revision = await self._get_docs(user_id, settings)
+            if docs is None:
+                logger.info(f"[PQA] Knowledge base of user {user_id} has no completed build yet.")
+        # Every user also queries the shared base corpus, when one is deployed
+        docs, revision = await asyncio.to_thread(merge_with_base, docs, revision, settings)
+        if docs is None:
+            if index_files:
+                return {
+                    "answer": "Your Knowledge base is still being indexed. Please try again in a few minutes.",
+                    "images": [],
+                }
+            return {"answer": "No papers found in your Knowledge base. Please upload papers first.", "images": []}
+
+        session, cache_stats = await cached_aquery(
+            docs, query, settings, user_id, revision,
+            progress=lambda event: kb_progress.publish(user_id, session_id, event),
+        )
+        images = await asyncio.to_thread(session_image_references, session, user_id)
+        logger.info(
+            f"[PQA] Knowledge base query for user {user_id} took {time.perf_counter() - t_start:.2f}s "
+            f"({len(index_files)} user files, {len(images)} images, cache: {cache_stats})."
+        )
+        return {
+            "answer": str(session),
+            "images": images,
+            "cache": cache_stats,
+        }
+
+
+kb_query_service = KBQueryService()
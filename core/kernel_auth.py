@@ -0,0 +1,103 @@
+"""
+Per-kernel credentials for internal API calls.
+
+Interpreter kernels call back into the API over loopback (e.g.
+``POST /knowledge-base/internal/query``). Because the code in a kernel is
+LLM-generated, the request body cannot be trusted to name the user: each
+kernel instead gets a random token when its interpreter is created, and the
+API maps the token back to the (user, session) it was issued for.
+
+Tokens are kept in Redis so any API worker can resolve them. Only a hash of
+each token is stored, so the keys themselves do not grant access. They expire
+after ``KERNEL_TOKEN_TTL`` seconds without use and are deleted when the
+session's interpreter goes away.
+"""
+import hashlib
+import json
+import logging
+import os
+import secrets
+from typing import Optional
+
+import redis
+
+from core.cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+KERNEL_TOKEN_HEADER = "X-Kernel-Token"
+KERNEL_TOKEN_TTL = int(os.getenv("KERNEL_TOKEN_TTL", str(24 * 60 * 60)))
+
+_TOKEN_PREFIX = "kernel_token:"
+_SESSION_PREFIX = "kernel_token_session:"
+
+
+def _token_key(token_hash: str) -> str:
+    return f"{_TOKEN_PREFIX}{token_hash}"
+
+
+def _session_key(session_key: str) -> str:
+    return f"{_SESSION_PREFIX}{session_key}"
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_kernel_token(user_id: str, session_id: str) -> str:
+    """A new token for a session's kernel; replaces the session's previous token."""
+    token = secrets.token_urlsafe(32)
+    session_key = f"{user_id}:{session_id}"
+    identity = json.dumps({"user_id": str(user_id), "session_id": str(session_id)})
+    try:
+        previous = redis_client.get(_session_key(session_key))
+        pipe = redis_client.pipeline()
+        if previous:
+            pipe.delete(_token_key(previous.decode()))
+        pipe.set(_token_key(_hash(token)), identity, ex=KERNEL_TOKEN_TTL)
+        pipe.set(_session_key(session_key), _hash(token), ex=KERNEL_TOKEN_TTL)
+        pipe.execute()
+    except redis.RedisError as exc:
+        # The kernel still works; only its calls back into the API are refused
+        logger.warning(f"Failed to store kernel token for session {session_key}: {exc}")
+    return token
+
+
+def refresh_kernel_token(session_key: str) -> None:
+    """Keep an in-use session's token from expiring."""
+    try:
+        token_hash = redis_client.get(_session_key(session_key))
+        if token_hash:
+            pipe = redis_client.pipeline()
+            pipe.expire(_token_key(token_hash.decode()), KERNEL_TOKEN_TTL)
+            pipe.expire(_session_key(session_key), KERNEL_TOKEN_TTL)
+            pipe.execute()
+    except redis.RedisError as exc:
+        logger.warning(f"Failed to refresh kernel token for session {session_key}: {exc}")
+
+
+def revoke_kernel_token(session_key: str) -> None:
+    try:
+        token_hash = redis_client.get(_session_key(session_key))
+        keys = [_session_key(session_key)]
+        if token_hash:
+            keys.append(_token_key(token_hash.decode()))
+        redis_client.delete(*keys)
+    except redis.RedisError as exc:
+        logger.warning(f"Failed to revoke kernel token for session {session_key}: {exc}")
+
+
+def resolve_kernel_token(token: Optional[str]) -> Optional[tuple[str, str]]:
+    """The ``(user_id, session_id)`` a token was issued for, or None."""
+    if not token:
+        return None
+    try:
+        raw = redis_client.get(_token_key(_hash(token)))
+    except redis.RedisError as exc:
+        logger.warning(f"Failed to resolve kernel token: {exc}")
+        return None
+    if not raw:
+        return None
+    identity = json.loads(raw)
+    refresh_kernel_token(f"{identity['user_id']}:{identity['session_id']}")
+    return identity["user_id"], identity["session_id"]
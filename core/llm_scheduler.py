@@ -0,0 +1,471 @@
+"""
+Shared, rate-limit-aware scheduler for LLM and embedding requests.
+
+LLM traffic comes from the chat interpreter, the MCP tool planner, the
+kernels' ``get_station_info``/``web_search``, PaperQA queries and index-build
+embeddings, in three kinds of process (API, kernels, index worker).
+``install()`` wraps LiteLLM's request functions (``completion``,
+``acompletion``, ``responses``, ``aresponses``, ``embedding``,
+``aembedding``) so every one of those paths is admitted through a per-model
+token bucket kept in Redis:
+
+* budgets: requests and tokens per minute per model (``LLM_RATE_LIMITS``,
+  falling back to ``LLM_DEFAULT_RPM``/``LLM_DEFAULT_TPM``); tokens are
+  estimated up front and settled against the reported usage afterwards;
+* priorities: ``interactive`` requests may use the whole budget, while
+  ``background`` requests (index builds) must leave ``1 - LLM_BACKGROUND_SHARE``
+  of it untouched, so chat keeps headroom during large ingests;
+* adaptive backoff: a provider 429 pauses the model for every process, with
+  an exponential delay (or the provider's Retry-After) that relaxes again on
+  success, and the request is retried after the pause;
+* metrics: admitted requests, queue time and rate-limit hits per model and
+  priority (``get_scheduler_metrics``).
+
+If Redis is unreachable requests are let through unscheduled.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Iterator, Optional
+
+import redis
+
+from core.cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "500"))
+LLM_DEFAULT_TPM = float(os.getenv("LLM_DEFAULT_TPM", "500000"))
+# Share of each budget background work may use
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.5"))
+# Output tokens assumed for a request that does not cap them
+LLM_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKEN_ESTIMATE", "1024"))
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "2"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+# Give up waiting for budget after this long and send the request anyway
+LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", "300"))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+BUCKET_KEY_PREFIX = "llm_sched:bucket:"
+METRICS_KEY_PREFIX = "llm_sched:metrics:"
+# Tokens per image part, for estimates only
+_IMAGE_TOKEN_ESTIMATE = 1000
+
+
+def _load_rate_limits() -> dict:
+    raw = os.getenv("LLM_RATE_LIMITS", "")
+    if not raw:
+        return {}
+    try:
+        return {_model_key(k): v for k, v in json.loads(raw).items()}
+    except (ValueError, AttributeError) as exc:
+        logger.error(f"Ignoring invalid LLM_RATE_LIMITS: {exc}")
+        return {}
+
+
+def _model_key(model: Any) -> str:
+    model = str(model or "unknown")
+    return model.split("/", 1)[1] if model.startswith("openai/") else model
+
+
+RATE_LIMITS = _load_rate_limits()
+
+
+def get_budget(model: Any) -> tuple[float, float]:
+    """``(requests per minute, tokens per minute)`` for a model."""
+    limits = RATE_LIMITS.get(_model_key(model), {})
+    return float(limits.get("rpm", LLM_DEFAULT_RPM)), float(limits.get("tpm", LLM_DEFAULT_TPM))
+
+
+# ---------------------------------------------------------------------------
+# Priority classes
+# ---------------------------------------------------------------------------
+
+_default_priority = INTERACTIVE
+_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_priority", default=None)
+# Set while a scheduled call runs, so LiteLLM calling itself is not scheduled twice
+_in_scheduled_call: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_in_scheduled_call", default=False)
+
+
+def set_default_priority(priority: str) -> None:
+    """Priority for requests made outside ``llm_priority`` in this process."""
+    global _default_priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {priority!r}")
+    _default_priority = priority
+
+
+def current_priority() -> str:
+    return _priority.get() or _default_priority
+
+
+@contextlib.contextmanager
+def llm_priority(priority: str) -> Iterator[None]:
+    """Run the enclosed requests (including tasks and threads started from it) at ``priority``."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {priority!r}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# ---------------------------------------------------------------------------
+# Redis token buckets
+# ---------------------------------------------------------------------------
+
+# KEYS: bucket  ARGV: now, rpm, tpm, tokens, reserve
+# Returns the seconds to wait (as a string), or "0" once the request is admitted.
+_ACQUIRE_SCRIPT = redis_client.register_script("""
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[5])
+local tokens = math.min(tonumber(ARGV[4]), tpm * (1 - reserve))
+local b = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts', 'blocked_until')
+local req = tonumber(b[1]) or rpm
+local tok = tonumber(b[2]) or tpm
+local ts = tonumber(b[3]) or now
+local blocked = tonumber(b[4]) or 0
+local elapsed = math.max(now - ts, 0)
+req = math.min(rpm, req + elapsed * rpm / 60)
+tok = math.min(tpm, tok + elapsed * tpm / 60)
+local wait = 0
+if blocked > now then wait = blocked - now end
+local need_req = 1 + reserve * rpm
+local need_tok = tokens + reserve * tpm
+if req < need_req then wait = math.max(wait, (need_req - req) * 60 / rpm) end
+if tok < need_tok then wait = math.max(wait, (need_tok - tok) * 60 / tpm) end
+if wait == 0 then
+    req = req - 1
+    tok = tok - tokens
+end
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 600)
+return tostring(wait)
+""")
+
+# KEYS: bucket  ARGV: tokens to return (negative to charge), tpm
+_SETTLE_SCRIPT = redis_client.register_script("""
+local tok = tonumber(redis.call('HGET', KEYS[1], 'tok'))
+if tok then
+    redis.call('HSET', KEYS[1], 'tok', math.min(tonumber(ARGV[2]), tok + tonumber(ARGV[1])))
+end
+return 1
+""")
+
+# KEYS: bucket  ARGV: now, base, max, retry_after
+# Returns the pause (seconds) applied to the model.
+_RATE_LIMITED_SCRIPT = redis_client.register_script("""
+local strikes = redis.call('HINCRBY', KEYS[1], 'strikes', 1)
+local delay = math.min(tonumber(ARGV[3]), tonumber(ARGV[2]) * 2 ^ (strikes - 1))
+delay = math.max(delay, tonumber(ARGV[4]))
+local until_ts = tonumber(ARGV[1]) + delay
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+if until_ts > blocked then
+    redis.call('HSET', KEYS[1], 'blocked_until', until_ts)
+end
+-- The provider's view of the budget is lower than ours: drain the bucket
+redis.call('HSET', KEYS[1], 'req', 0, 'ts', ARGV[1])
+redis.call('EXPIRE', KEYS[1], 600)
+return tostring(delay)
+""")
+
+# KEYS: metrics  ARGV: wait_seconds
+_METRICS_SCRIPT = redis_client.register_script("""
+redis.call('HINCRBY', KEYS[1], 'requests', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'queue_seconds_total', ARGV[1])
+local max = tonumber(redis.call('HGET', KEYS[1], 'queue_seconds_max')) or 0
+if tonumber(ARGV[1]) > max then
+    redis.call('HSET', KEYS[1], 'queue_seconds_max', ARGV[1])
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call('HINCRBY', KEYS[1], 'queued_requests', 1)
+end
+return 1
+""")
+
+
+def _bucket_key(model: Any) -> str:
+    return f"{BUCKET_KEY_PREFIX}{_model_key(model)}"
+
+
+def _metrics_key(model: Any, priority: str) -> str:
+    return f"{METRICS_KEY_PREFIX}{_model_key(model)}:{priority}"
+
+
+def _try_acquire(model: Any, tokens: int, priority: str) -> float:
+    """Seconds to wait before retrying, or 0 if the request was admitted."""
+    rpm, tpm = get_budget(model)
+    reserve = 0.0 if priority == INTERACTIVE else max(0.0, 1.0 - LLM_BACKGROUND_SHARE)
+    try:
+        return float(_ACQUIRE_SCRIPT(keys=[_bucket_key(model)], args=[time.time(), rpm, tpm, tokens, reserve]))
+    except redis.RedisError as exc:
+        logger.warning(f"LLM scheduler unavailable, not throttling {model}: {exc}")
+        return 0.0
+
+
+def _wait_slice(wait: float, priority: str) -> float:
+    # Jitter spreads out waiters across processes; background re-checks less eagerly
+    jitter = random.uniform(0, 0.25 if priority == INTERACTIVE else 1.0)
+    return min(wait, 5.0) + jitter
+
+
+def _record(model: Any, priority: str, queue_seconds: float) -> None:
+    try:
+        _METRICS_SCRIPT(keys=[_metrics_key(model, priority)], args=[round(queue_seconds, 3)])
+    except redis.RedisError:
+        pass
+
+
+def _settle(model: Any, estimated: int, response: Any) -> None:
+    """Correct the bucket with the response's reported token usage."""
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get("usage")
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        used = usage.get("total_tokens") or usage.get("prompt_tokens")
+    else:
+        used = getattr(usage, "total_tokens", None) or getattr(usage, "prompt_tokens", None)
+    if not used:
+        return
+    _, tpm = get_budget(model)
+    try:
+        _SETTLE_SCRIPT(keys=[_bucket_key(model)], args=[estimated - int(used), tpm])
+    except redis.RedisError:
+        pass
+
+
+def _rate_limited(model: Any, exc: BaseException) -> float:
+    """Pause ``model`` for every process after a provider 429; returns the pause."""
+    try:
+        redis_client.hincrby(_metrics_key(model, current_priority()), "rate_limited", 1)
+    except redis.RedisError:
+        pass
+    retry_after = 0.0
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after") or 0)
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    try:
+        delay = float(_RATE_LIMITED_SCRIPT(
+            keys=[_bucket_key(model)],
+            args=[time.time(), LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, retry_after],
+        ))
+    except redis.RedisError:
+        delay = LLM_BACKOFF_BASE_SECONDS
+    logger.warning(f"Rate limited by provider for {model}; pausing it for {delay:.1f}s")
+    return delay
+
+
+def _succeeded(model: Any) -> None:
+    try:
+        if redis_client.hincrby(_bucket_key(model), "strikes", -1) < 0:
+            redis_client.hset(_bucket_key(model), "strikes", 0)
+    except redis.RedisError:
+        pass
+
+
+def _is_rate_limit_error(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+# ---------------------------------------------------------------------------
+# Token estimates
+# ---------------------------------------------------------------------------
+
+def _text_length(content: Any) -> tuple[int, int]:
+    """``(characters, images)`` in a message content or request input."""
+    if content is None:
+        return 0, 0
+    if isinstance(content, str):
+        return len(content), 0
+    if isinstance(content, dict):
+        if content.get("type") in ("image_url", "input_image", "image"):
+            return 0, 1
+        chars, images = 0, 0
+        for key in ("content", "text", "input", "arguments"):
+            c, i = _text_length(content.get(key))
+            chars, images = chars + c, images + i
+        return chars, images
+    if isinstance(content, (list, tuple)):
+        chars, images = 0, 0
+        for part in content:
+            c, i = _text_length(part)
+            chars, images = chars + c, images + i
+        return chars, images
+    return len(str(content)), 0
+
+
+def estimate_tokens(kwargs: dict, embedding: bool = False) -> int:
+    """Rough prompt + output token count for a request (4 characters per token)."""
+    chars, images = _text_length(kwargs.get("messages") or kwargs.get("input"))
+    tokens = chars // 4 + images * _IMAGE_TOKEN_ESTIMATE + 1
+    if embedding:
+        return tokens
+    max_output = (
+        kwargs.get("max_completion_tokens") or kwargs.get("max_tokens")
+        or kwargs.get("max_output_tokens") or LLM_OUTPUT_TOKEN_ESTIMATE
+    )
+    return tokens + min(int(max_output), LLM_OUTPUT_TOKEN_ESTIMATE)
+
+
+# ---------------------------------------------------------------------------
+# Scheduling wrappers
+# ---------------------------------------------------------------------------
+
+def acquire(model: Any, tokens: int, priority: Optional[str] = None) -> float:
+    """Block until ``model`` has budget for ``tokens``; returns the queue time."""
+    priority = priority or current_priority()
+    start = time.monotonic()
+    while True:
+        wait = _try_acquire(model, tokens, priority)
+        waited = time.monotonic() - start
+        if wait <= 0 or waited >= LLM_MAX_QUEUE_SECONDS:
+            break
+        time.sleep(_wait_slice(wait, priority))
+    _record(model, priority, waited)
+    return waited
+
+
+async def acquire_async(model: Any, tokens: int, priority: Optional[str] = None) -> float:
+    """Async ``acquire``: waits on the event loop instead of blocking it."""
+    priority = priority or current_priority()
+    start = time.monotonic()
+    while True:
+        wait = _try_acquire(model, tokens, priority)
+        waited = time.monotonic() - start
+        if wait <= 0 or waited >= LLM_MAX_QUEUE_SECONDS:
+            break
+        await asyncio.sleep(_wait_slice(wait, priority))
+    _record(model, priority, waited)
+    return waited
+
+
+def scheduled(fn: Callable, embedding: bool = False) -> Callable:
+    """Wrap a synchronous LiteLLM request function with the scheduler."""
+    if getattr(fn, "__llm_scheduled__", False):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not LLM_SCHEDULER_ENABLED or _in_scheduled_call.get():
+            return fn(*args, **kwargs)
+        model = kwargs.get("model", args[0] if args else None)
+        tokens = estimate_tokens(kwargs, embedding=embedding)
+        flag = _in_scheduled_call.set(True)
+        try:
+            for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+                acquire(model, tokens)
+                try:
+                    response = fn(*args, **kwargs)
+                except Exception as exc:
+                    if not _is_rate_limit_error(exc) or attempt == LLM_RATE_LIMIT_RETRIES:
+                        raise
+                    _rate_limited(model, exc)
+                    continue
+                _succeeded(model)
+                if not kwargs.get("stream"):
+                    _settle(model, tokens, response)
+                return response
+        finally:
+            _in_scheduled_call.reset(flag)
+
+    wrapper.__llm_scheduled__ = True
+    return wrapper
+
+
+def scheduled_async(fn: Callable, embedding: bool = False) -> Callable:
+    """Wrap an async LiteLLM request function with the scheduler."""
+    if getattr(fn, "__llm_scheduled__", False):
+        return fn
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not LLM_SCHEDULER_ENABLED or _in_scheduled_call.get():
+            return await fn(*args, **kwargs)
+        model = kwargs.get("model", args[0] if args else None)
+        tokens = estimate_tokens(kwargs, embedding=embedding)
+        flag = _in_scheduled_call.set(True)
+        try:
+            for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+                await acquire_async(model, tokens)
+                try:
+                    response = await fn(*args, **kwargs)
+                except Exception as exc:
+                    if not _is_rate_limit_error(exc) or attempt == LLM_RATE_LIMIT_RETRIES:
+                        raise
+                    _rate_limited(model, exc)
+                    continue
+                _succeeded(model)
+                if not kwargs.get("stream"):
+                    _settle(model, tokens, response)
+                return response
+        finally:
+            _in_scheduled_call.reset(flag)
+
+    wrapper.__llm_scheduled__ = True
+    return wrapper
+
+
+def install() -> None:
+    """Route LiteLLM's request functions through the scheduler (idempotent).
+
+    Call before other modules bind these functions with ``from litellm import ...``.
+    """
+    import litellm
+
+    for name in ("completion", "responses"):
+        if hasattr(litellm, name):
+            setattr(litellm, name, scheduled(getattr(litellm, name)))
+    for name in ("acompletion", "aresponses"):
+        if hasattr(litellm, name):
+            setattr(litellm, name, scheduled_async(getattr(litellm, name)))
+    litellm.embedding = scheduled(litellm.embedding, embedding=True)
+    litellm.aembedding = scheduled_async(litellm.aembedding, embedding=True)
+
+
+def get_scheduler_metrics() -> dict:
+    """Queue-time and rate-limit counters per model and priority, with current bucket levels."""
+    metrics: dict[str, dict] = {}
+    try:
+        for key in redis_client.scan_iter(match=f"{METRICS_KEY_PREFIX}*"):
+            name = key.decode().removeprefix(METRICS_KEY_PREFIX)
+            model, _, priority = name.rpartition(":")
+            raw = {k.decode(): float(v) for k, v in redis_client.hgetall(key).items()}
+            requests = int(raw.get("requests", 0))
+            metrics.setdefault(model, {})[priority] = {
+                "requests": requests,
+                "queued_requests": int(raw.get("queued_requests", 0)),
+                "rate_limited": int(raw.get("rate_limited", 0)),
+                "queue_seconds_avg": round(raw.get("queue_seconds_total", 0.0) / requests, 3) if requests else 0.0,
+                "queue_seconds_max": round(raw.get("queue_seconds_max", 0.0), 3),
+            }
+        for model, entry in metrics.items():
+            rpm, tpm = get_budget(model)
+            bucket = {k.decode(): v.decode() for k, v in redis_client.hgetall(_bucket_key(model)).items()}
+            entry["budget"] = {"rpm": rpm, "tpm": tpm}
+            entry["bucket"] = {
+                "requests_available": round(float(bucket.get("req", rpm)), 1),
+                "tokens_available": round(float(bucket.get("tok", tpm))),
+                "backoff_strikes": int(bucket.get("strikes", 0)),
+                "paused_until": float(bucket["blocked_until"]) if float(bucket.get("blocked_until", 0)) > time.time() else None,
+            }
+    except redis.RedisError as exc:
+        logger.warning(f"Failed to read LLM scheduler metrics: {exc}")
+    return metrics
@@ -7,6 +7,7 @@ from sqlmodel import Session, select
 from core.security import get_password_hash, verify_password
 from core.crypto import encrypt_secret
 from models import (
+    Conversation,
     MCPConnection,
     MCPConnectionCreate,
     MCPConnectionPublic,
@@ -16,6 +17,8 @@ from models import (
     UserCreate,
     UserUpdate,
     SystemPrompt,
+    Message,
+    MessageRole,
 )
 
 
@@ -119,6 +122,49 @@ def delete_system_prompt(*, session: Session, prompt: SystemPrompt) -> None:
     session.commit()
 
 
+# Conversation helpers
+
+def get_user_conversation(*, session: Session, conversation_id: UUID, user_id: Any) -> Conversation | None:
+    conversation = session.get(Conversation, conversation_id)
+    if conversation is None or conversation.user_id != user_id:
+        return None
+    return conversation
+
+
+def add_conversation_messages(
+    *,
+    session: Session,
+    conversation_id: UUID,
+    messages: List[dict[str, Any]],
+) -> List[Message]:
+    """Insert a batch of messages into a conversation in a single transaction.
+
+    Mirrors the single-message route: the first user message titles an untitled
+    conversation and ``updated_at`` is bumped for recency ordering.
+    """
+    conversation = session.get(Conversation, conversation_id)
+    if conversation is None:
+        return []
+
+    rows = []
+    for data in messages:
+        if (
+            data.get("role") == MessageRole.USER
+            and (not conversation.title or conversation.title.strip() in ["New conversation", ""])
+        ):
+            title_content = (data.get("content") or "").strip()
+            if title_content:
+                conversation.title = title_content[:50] + ("..." if len(title_content) > 50 else "")
+        row = Message(conversation_id=conversation_id, **data)
+        session.add(row)
+        rows.append(row)
+
+    conversation.updated_at = datetime.utcnow()
+    session.add(conversation)
+    session.commit()
+    return rows
+
+
 # MCP connection helpers
 
 def _normalise_connection_payload(data: dict[str, Any]) -> None:
@@ -5,6 +5,7 @@ mkdir -p /app/data/benchmarks
 mkdir -p /app/data/metadata
 mkdir -p /app/data/altimetry
 mkdir -p /app/data/papers
+mkdir -p /app/data/base_papers
 mkdir -p /app/static
 
 # Set permissions
@@ -15,9 +16,14 @@ if [ -f /app/scripts/fetch_data.sh ]; then
     chmod +x /app/scripts/fetch_data.sh
 fi
 
-# Run database initialization (migrations and initial data)
-echo "Running database initialization..."
-bash prestart.sh
+# Run database initialization (migrations and initial data) once, in the web
+# service; other services (index worker) set SKIP_PRESTART=1 and only wait for the DB
+if [ "${SKIP_PRESTART:-0}" = "1" ]; then
+    python backend_prestart.py
+else
+    echo "Running database initialization..."
+    bash prestart.sh
+fi
 
 # Execute the main command
 exec "$@"
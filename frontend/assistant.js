@@ -33,6 +33,7 @@ let activeLineCodeId = null;
 let isActiveLineRunning = false;
 let stopRequested = false;
 let stopRequestedCodeId = null;
+let serverPersistenceActive = false;
 let userProfilePromise = null;
 let welcomeRenderPromise = null;
 let welcomeRendered = false;
@@ -739,8 +740,13 @@ async function sendRequest(msgOverride=null) {
             attachments: attachmentSummaries,
             llmContent: llmContent || trimmedInput
         };
+        // Opt-in: let the backend persist this turn straight from the chat stream
+        const persistOnServer = Boolean(config.serverSidePersistence) && !!conversationManager;
+        if (persistOnServer && !conversationManager.currentConversationId) {
+            await conversationManager.createConversation();
+        }
         messages.push(userMessage);
-        appendMessage(userMessage);
+        appendMessage(userMessage, { persist: !persistOnServer });
         scrollToBottom();
         messageInput.value = '';
         pendingUploads = [];
@@ -752,6 +758,10 @@ async function sendRequest(msgOverride=null) {
         const params = {
             messages: serializeMessagesForRequest(messages)
         };
+        if (persistOnServer) {
+            params.conversation_id = conversationManager.currentConversationId;
+            params.user_display_content = userMessage.content;
+        }
 
         // Initialize AbortController to handle cancellation
         controller = new AbortController();
@@ -781,6 +791,8 @@ async function sendRequest(msgOverride=null) {
             return;
         }
 
+        serverPersistenceActive = interpreterCall.headers.get('X-Conversation-Persistence') === 'server';
+
         // Initialize a reader for the response body
         const reader = interpreterCall.body.getReader();
         const decoder = new TextDecoder("utf-8");
@@ -837,6 +849,7 @@ function resetButtons() {
     stopButton.disabled = true;
     controller = null;
     isGenerating = false;
+    serverPersistenceActive = false;
     if (stopRequested || isActiveLineRunning) {
         const codeId = stopRequestedCodeId || activeLineCodeId || lastExecutableCodeId || pendingConsoleParentId;
         if (codeId && !hasInterruptionNotice(codeId)) {
@@ -874,6 +887,10 @@ function saveCompletedAssistantMessage(message) {
     if (!conversationManager || !(message.role === 'assistant' || message.role === 'computer')) {
         return;
     }
+    // The backend already stored this message from the stream
+    if (serverPersistenceActive) {
+        return;
+    }
     if (message.type === 'console') {
         if (message.format === 'active_line') {
             return;
@@ -1,5 +1,8 @@
 const config = {
     environment: 'local', // Change to 'production' for production environment
+
+    // Persist chat turns server-side from the /chat stream instead of re-posting each message
+    serverSidePersistence: false,
     
     // API endpoints
     endpoints: {
@@ -251,7 +251,7 @@ async function loadConversation(conversationId) {
         }
         
         // Load conversation context into backend interpreter
-        await loadConversationIntoInterpreter(loadedMessages);
+        await loadConversationIntoInterpreter(conversationId);
         
         // Update the current conversation indicator
         displayConversations();
@@ -430,18 +430,15 @@ function debounce(func, wait) {
     };
 }
 
-async function loadConversationIntoInterpreter(messages) {
+async function loadConversationIntoInterpreter(conversationId) {
     try {
-        const response = await fetch(config.getEndpoints().loadConversation, {
+        // The server reads the stored messages itself; nothing is re-uploaded
+        const response = await fetch(`${config.getEndpoints().loadConversation}/${encodeURIComponent(conversationId)}`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json',
                 'X-Session-Id': sessionId,
                 ...getAuthHeaders()
-            },
-            body: JSON.stringify({
-                messages: messages
-            })
+            }
         });
         
         if (!response.ok) {
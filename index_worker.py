@@ -0,0 +1,78 @@
+"""
+Knowledge base index worker.
+
+Claims index jobs from the Redis queue (see core/index_queue.py) and runs
+the PaperQA index build for each user. On startup it also builds the shared
+base corpus snapshot if the deployed corpus changed. Run one or more of these
+next to the web service:
+
+    python index_worker.py
+"""
+import logging
+import os
+import signal
+import socket
+import time
+
+from core import llm_scheduler
+
+# Index builds only use the share of each LLM budget left over for background work
+llm_scheduler.install()
+llm_scheduler.set_default_priority(llm_scheduler.BACKGROUND)
+
+from core.index_queue import claim_index_job  # noqa: E402
+from utils.pqa_base_corpus import build_base_corpus  # noqa: E402
+from utils.pqa_multi_tenant import run_index_build  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = float(os.getenv("INDEX_WORKER_POLL_SECONDS", "1"))
+
+_stopping = False
+
+
+def _request_stop(signum, frame) -> None:
+    global _stopping
+    logger.info("Index worker stopping after the current job")
+    _stopping = True
+
+
+def main() -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    logger.info(f"Index worker {worker_id} started")
+
+    try:
+        build_base_corpus()
+    except Exception as exc:
+        # Users' own libraries still work without the base corpus
+        logger.error(f"[PQA] Base corpus build failed: {exc}")
+
+    while not _stopping:
+        try:
+            job = claim_index_job(worker_id)
+        except Exception as exc:
+            logger.error(f"Failed to claim index job: {exc}")
+            time.sleep(POLL_INTERVAL_SECONDS * 5)
+            continue
+        if job is None:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            continue
+
+        logger.info(
+            f"[PQA] Running index job for user {job.user_id} "
+            f"(queued {job.queue_seconds:.1f}s)"
+        )
+        try:
+            run_index_build(job.user_id)
+        except Exception as exc:
+            logger.error(f"[PQA] Index job failed for user {job.user_id}: {exc}")
+            job.fail(str(exc))
+        else:
+            job.succeed()
+
+
+if __name__ == "__main__":
+    main()
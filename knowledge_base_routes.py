@@ -1,20 +1,29 @@
 import os
+import asyncio
+import hashlib
+import ipaddress
+import json
 import logging
+import uuid
+import zipfile
 from pathlib import Path
-from typing import List
-from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Depends
-from fastapi.responses import JSONResponse
-import shutil
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from auth import get_auth_token, get_current_user  # Import auth and user context
+from core.index_progress import iter_index_events
+from core.index_queue import enqueue_index_job
+from core.kb_query_service import kb_query_service
+from core.kernel_auth import KERNEL_TOKEN_HEADER, resolve_kernel_token
+from models import KBQueryRequest
 from utils.pqa_multi_tenant import (
+    PAPER_EXTENSIONS,
     get_user_papers_dir,
-    get_user_index_dir,
     ensure_user_pqa_settings,
-    build_user_index_sync,
+    load_docs_file_manifest,
     read_index_status,
-    write_index_status,
-    clear_docs_cache,
+    scan_paper_files,
 )
 
 logger = logging.getLogger(__name__)
@@ -23,63 +32,17 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/knowledge-base", tags=["knowledge-base"])
 
 # Allowed types and limits
-ALLOWED_PAPER_EXTENSIONS = {'.pdf', '.txt', '.doc', '.docx', '.md'}
+ALLOWED_PAPER_EXTENSIONS = PAPER_EXTENSIONS
 MAX_PAPER_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_BULK_FILES = 500
+MAX_BULK_TOTAL_SIZE = 2 * 1024 * 1024 * 1024  # 2GB (uncompressed) per request
+_COPY_CHUNK_SIZE = 1024 * 1024
 
 def ensure_papers_directory(papers_dir: Path):
     """Ensure the given user's papers directory exists"""
     papers_dir.mkdir(parents=True, exist_ok=True)
 
 
-def _has_papers(user_id) -> bool:
-    """Return True if the user's papers directory contains at least one allowed file."""
-    papers_dir = get_user_papers_dir(user_id)
-    if not papers_dir.exists():
-        return False
-    return any(
-        f.is_file() and f.suffix.lower() in ALLOWED_PAPER_EXTENSIONS
-        for f in papers_dir.iterdir()
-    )
-
-
-def _clean_user_index(user_id) -> None:
-    """Remove all pqa_index_* subdirs and docs cache when the user has no papers left."""
-    index_dir = get_user_index_dir(user_id)
-    if not index_dir.exists():
-        return
-    for child in index_dir.iterdir():
-        if child.is_dir() and child.name.startswith("pqa_index"):
-            shutil.rmtree(child, ignore_errors=True)
-    clear_docs_cache(user_id)
-    write_index_status(user_id, status="ready")
-    logger.info(f"[PQA] No papers left for user {user_id}, cleaned index and docs cache")
-
-
-def _background_index_build(user_id) -> None:
-    """Background task: build/sync the PQA index for a user after upload or delete.
-
-    If the papers directory is empty (e.g. user deleted all papers) the stale
-    index is cleaned up directly instead of calling get_directory_index, which
-    avoids a PaperQA bug that can corrupt files.zip during removal of the
-    last file.
-    """
-    import time
-    try:
-        # Fast path: no papers left → just clean up the index directory
-        if not _has_papers(user_id):
-            _clean_user_index(user_id)
-            return
-
-        t0 = time.perf_counter()
-        logger.info(f"[PQA] Background index build starting for user {user_id}")
-        build_user_index_sync(user_id)
-        logger.info(
-            f"[PQA] Background index build complete for user {user_id} "
-            f"in {time.perf_counter() - t0:.2f}s"
-        )
-    except Exception as e:
-        logger.error(f"[PQA] Background index build failed for user {user_id}: {e}")
-
 @router.get("/papers")
 async def list_papers(token: str = Depends(get_auth_token)):
     """List all papers in the knowledge base for the current user"""
@@ -116,7 +79,6 @@ async def list_papers(token: str = Depends(get_auth_token)):
 
 @router.post("/papers/upload")
 async def upload_paper(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     token: str = Depends(get_auth_token),
 ):
@@ -160,8 +122,9 @@ async def upload_paper(
                     )
                 buffer.write(chunk)
 
-        # Trigger background index build so the index is ready before the next query
-        background_tasks.add_task(_background_index_build, user.id)
+        # Queue an index build (coalesced with other recent uploads) so the
+        # index is ready before the next query
+        enqueue_index_job(user.id)
 
         return {
             "message": "Paper uploaded successfully",
@@ -175,10 +138,151 @@ async def upload_paper(
         logger.error(f"Error uploading paper: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to upload paper")
 
+def _existing_paper_hashes(user_id, papers_dir: Path) -> dict:
+    """Map content sha256 -> file name for the user's current papers.
+
+    Reuses the index manifest so only new or changed files are hashed.
+    """
+    names = {
+        p.name: None for p in papers_dir.iterdir()
+        if p.is_file() and p.suffix.lower() in ALLOWED_PAPER_EXTENSIONS
+    }
+    scanned = scan_paper_files(papers_dir, names, load_docs_file_manifest(user_id))
+    return {entry["sha256"]: name for name, entry in scanned.items()}
+
+
+class _BulkIngest:
+    """Streams uploaded (or zipped) papers to disk, deduplicating by content hash."""
+
+    def __init__(self, papers_dir: Path, known_hashes: dict):
+        self.papers_dir = papers_dir
+        self.known_hashes = known_hashes
+        self.total_bytes = 0
+        self.results = []
+
+    def _result(self, source: str, status: str, **extra) -> None:
+        self.results.append({"filename": source, "status": status, **extra})
+
+    def add(self, source: str, stream) -> None:
+        name = Path(source.replace("\\", "/")).name
+        if len(self.results) >= MAX_BULK_FILES:
+            self._result(source, "rejected", detail=f"Batch limit of {MAX_BULK_FILES} files reached")
+            return
+        if not name or name.startswith("."):
+            self._result(source, "rejected", detail="Invalid filename")
+            return
+        if Path(name).suffix.lower() not in ALLOWED_PAPER_EXTENSIONS:
+            self._result(
+                source, "rejected",
+                detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_PAPER_EXTENSIONS)}",
+            )
+            return
+
+        # Hidden temp name with a non-paper suffix so indexing never picks it up
+        tmp_path = self.papers_dir / f".upload-{uuid.uuid4().hex}.tmp"
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with tmp_path.open("wb") as buffer:
+                while chunk := stream.read(_COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_PAPER_SIZE:
+                        raise ValueError(f"File too large. Maximum size: {MAX_PAPER_SIZE/1024/1024}MB")
+                    if self.total_bytes + size > MAX_BULK_TOTAL_SIZE:
+                        raise ValueError("Batch too large")
+                    sha256.update(chunk)
+                    buffer.write(chunk)
+        except ValueError as e:
+            tmp_path.unlink(missing_ok=True)
+            self._result(source, "rejected", detail=str(e))
+            return
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.error(f"Error saving bulk upload member {source}: {str(e)}")
+            self._result(source, "error", detail="Failed to save file")
+            return
+
+        digest = sha256.hexdigest()
+        target_path = self.papers_dir / name
+        if digest in self.known_hashes:
+            tmp_path.unlink(missing_ok=True)
+            self._result(source, "duplicate", duplicate_of=self.known_hashes[digest])
+        elif target_path.exists():
+            tmp_path.unlink(missing_ok=True)
+            self._result(source, "exists", detail=f"File '{name}' already exists")
+        else:
+            os.replace(tmp_path, target_path)
+            self.known_hashes[digest] = name
+            self.total_bytes += size
+            self._result(source, "uploaded", saved_as=name, size=size)
+
+    def add_zip(self, upload: UploadFile) -> None:
+        try:
+            with zipfile.ZipFile(upload.file) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or member.filename.startswith("__MACOSX/"):
+                        continue
+                    with archive.open(member) as stream:
+                        self.add(f"{upload.filename}/{member.filename}", stream)
+        except zipfile.BadZipFile:
+            self._result(upload.filename, "error", detail="Invalid zip archive")
+
+
+def _ingest_uploads(user_id, papers_dir: Path, files: List[UploadFile]) -> list:
+    ingest = _BulkIngest(papers_dir, _existing_paper_hashes(user_id, papers_dir))
+    for upload in files:
+        if Path(upload.filename or "").suffix.lower() == ".zip":
+            ingest.add_zip(upload)
+        else:
+            upload.file.seek(0)
+            ingest.add(upload.filename or "", upload.file)
+    return ingest.results
+
+
+@router.post("/papers/bulk-upload")
+async def bulk_upload_papers(
+    files: List[UploadFile] = File(...),
+    token: str = Depends(get_auth_token),
+):
+    """Upload many papers at once (multipart batch and/or zip archives).
+
+    Files already in the knowledge base (by content) are skipped, and a
+    single index build is queued for the whole batch.
+    """
+    try:
+        user = get_current_user(token)
+        if user is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+        papers_dir = get_user_papers_dir(user.id)
+        ensure_papers_directory(papers_dir)
+        ensure_user_pqa_settings(user.id)
+
+        results = await asyncio.to_thread(_ingest_uploads, user.id, papers_dir, files)
+
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        uploaded = counts.get("uploaded", 0)
+        if uploaded:
+            enqueue_index_job(user.id)
+
+        return {
+            "message": f"{uploaded} of {len(results)} files uploaded",
+            "counts": counts,
+            "index_job_queued": bool(uploaded),
+            "files": results,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in bulk upload: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to upload papers")
+
 @router.delete("/papers/{filename}")
 async def delete_paper(
     filename: str,
-    background_tasks: BackgroundTasks,
     token: str = Depends(get_auth_token),
 ):
     """Delete a paper from the knowledge base for the current user"""
@@ -208,8 +312,8 @@ async def delete_paper(
         # Delete the file
         file_path.unlink()
 
-        # Re-sync the index in the background (removes deleted file from index)
-        background_tasks.add_task(_background_index_build, user.id)
+        # Queue an index re-sync (removes deleted file from index)
+        enqueue_index_job(user.id)
 
         return {"message": f"Paper '{filename}' deleted successfully"}
 
@@ -259,4 +363,74 @@ async def get_knowledge_base_stats(token: str = Depends(get_auth_token)):
 
     except Exception as e:
         logger.error(f"Error getting knowledge base stats: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get knowledge base statistics") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to get knowledge base statistics") 
+
+
+@router.get("/index/events")
+async def index_build_events(token: str = Depends(get_auth_token)):
+    """Stream the current user's index build progress as server-sent events.
+
+    Events report files queued, parsed, embedded, cached and failed, per-file
+    durations and an ETA (see core/index_progress.py). The stream ends once
+    no build is running or queued; with nothing to report, a single ``idle``
+    event carries the index status.
+    """
+    user = get_current_user(token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    def event_stream():
+        sent = False
+        try:
+            for event in iter_index_events(user.id):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                sent = True
+                yield f"data: {json.dumps(event)}\n\n"
+            if not sent:
+                yield f"data: {json.dumps({'event': 'idle', 'index_status': read_index_status(user.id)})}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming index events for user {user.id}: {str(e)}")
+            yield f"data: {json.dumps({'event': 'error', 'error': 'Failed to read index progress'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _is_loopback(request: Request) -> bool:
+    try:
+        return request.client is not None and ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        return False
+
+
+@router.post("/internal/query")
+async def internal_query_knowledge_base(
+    payload: KBQueryRequest,
+    request: Request,
+    kernel_token: Optional[str] = Header(None, alias=KERNEL_TOKEN_HEADER),
+):
+    """Answer a knowledge base query on behalf of an interpreter kernel.
+
+    Kernels run in the same container and call this over loopback; the
+    endpoint is not reachable through the proxy. The user and session come
+    from the kernel's token, never from the (LLM-written) request body.
+    """
+    if not _is_loopback(request):
+        raise HTTPException(status_code=403, detail="Access denied")
+    identity = resolve_kernel_token(kernel_token)
+    if identity is None:
+        raise HTTPException(status_code=401, detail="Invalid kernel token")
+    user_id, session_id = identity
+    if payload.user_id is not None and str(payload.user_id) != user_id:
+        logger.warning(f"[PQA] Kernel of user {user_id} asked for user {payload.user_id}'s knowledge base.")
+        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        return await kb_query_service.query(user_id, payload.query, session_id)
+    except Exception as e:
+        logger.error(f"Error querying knowledge base for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to query knowledge base")
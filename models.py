@@ -202,6 +202,13 @@ class MCPPromptRequest(SQLModel):
     arguments: dict[str, Any] = Field(default_factory=dict)
 
 
+class KBQueryRequest(SQLModel):
+    # The kernel token decides the user and session; these are only cross-checked
+    user_id: Optional[uuid.UUID] = None
+    query: str
+    session_id: Optional[str] = None
+
+
 class SystemPrompt(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_id: uuid.UUID = Field(foreign_key="user.id", index=True, nullable=False)
@@ -335,6 +342,8 @@ class Message(MessageBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     conversation_id: uuid.UUID = Field(foreign_key="conversation.id", nullable=False, ondelete="CASCADE")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # The table also has a trigger-maintained ``search_vector`` tsvector column
+    # (GIN indexed) used by conversation search; it is intentionally not mapped.
     
     # Relationships
     conversation: Conversation | None = Relationship(back_populates="messages")
@@ -349,3 +358,83 @@ class MessagePublic(MessageBase):
 class MessagesPublic(SQLModel):
     data: list[MessagePublic]
     count: int
+
+
+# Conversation search
+class ConversationSearchHit(SQLModel):
+    id: uuid.UUID
+    title: str | None
+    is_favorite: bool
+    updated_at: datetime
+    rank: float
+    hit_count: int
+    message_id: uuid.UUID
+    snippet: str
+
+
+class ConversationSearchResults(SQLModel):
+    data: list[ConversationSearchHit]
+    count: int
+
+
+# Knowledge base (pgvector) models
+class PgVector(sa.types.UserDefinedType):
+    """pgvector ``vector`` column without a fixed dimension.
+
+    Rows for several embedding models share one column; per-model HNSW
+    indexes cast to the model's dimension (see utils/pqa_pg_store.py).
+    """
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw) -> str:
+        return "vector"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            return "[" + ",".join(repr(float(v)) for v in value) + "]"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            return [float(v) for v in value.strip("[]").split(",") if v]
+        return process
+
+
+class KBDocument(SQLModel, table=True):
+    __tablename__ = "kb_document"
+    __table_args__ = (
+        sa.UniqueConstraint("user_id", "file_name", "embedding_model", name="uq_kb_document_user_file_model"),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True, nullable=False, ondelete="CASCADE")
+    file_name: str = Field(max_length=512)
+    content_md5: str = Field(max_length=32)
+    embedding_model: str = Field(max_length=255)
+    docname: str = Field(max_length=255)
+    # Pickled paperqa Doc/DocDetails (citation and bibliographic metadata)
+    doc: bytes = Field(sa_column=sa.Column(sa.LargeBinary, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class KBChunk(SQLModel, table=True):
+    __tablename__ = "kb_chunk"
+
+    id: int | None = Field(default=None, sa_column=sa.Column(sa.BigInteger, primary_key=True, autoincrement=True))
+    document_id: uuid.UUID = Field(foreign_key="kb_document.id", index=True, nullable=False, ondelete="CASCADE")
+    # Denormalized from kb_document so ANN queries filter without a join
+    user_id: uuid.UUID = Field(index=True, nullable=False)
+    embedding_model: str = Field(max_length=255)
+    chunk_index: int
+    name: str = Field(sa_column=sa.Column(sa.Text, nullable=False))
+    text: str = Field(sa_column=sa.Column(sa.Text, nullable=False))
+    # Pickled list[ParsedMedia] (figures/tables attached to the chunk)
+    media: bytes | None = Field(default=None, sa_column=sa.Column(sa.LargeBinary, nullable=True))
+    embedding: list[float] = Field(sa_column=sa.Column(PgVector(), nullable=False))
+    # Partial HNSW indexes (one per embedding model) are created by migration /
+    # ensure_embedding_index(); they are expression indexes and not mapped here.
@@ -0,0 +1,143 @@
+"""
+Knowledge base retrieval benchmark.
+
+Runs a fixed question set against one user's knowledge base twice — once with
+embedding-only retrieval (every retrieved chunk summarized, as before) and once
+with the hybrid BM25 + embedding prefilter and relevance cutoff — with the
+answer/evidence caches bypassed. For each question it reports LLM calls,
+latency and the token overlap (F1) between the two answers.
+
+Usage:
+    python pqa_benchmark.py <user_id> [--questions questions.json] [--output results.json]
+
+``questions.json`` is a JSON list of strings; the default set below covers the
+sea-level topics the knowledge base is typically used for.
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+from collections import Counter
+
+import litellm
+from dotenv import load_dotenv
+
+load_dotenv(".env")
+
+from utils.pqa_multi_tenant import get_user_settings, load_published_docs  # noqa: E402
+from utils.pqa_query_cache import cached_aquery  # noqa: E402
+
+DEFAULT_QUESTIONS = [
+    "What methods are used to detect sea level rise acceleration?",
+    "How is vertical land motion accounted for in tide gauge records?",
+    "What causes interannual sea level variability in the tropical Pacific?",
+    "How are tide gauge datums defined and related to each other?",
+    "What are the main contributors to global mean sea level rise?",
+    "How do satellite altimetry and tide gauge trends compare?",
+    "What is the effect of ENSO on coastal sea levels?",
+    "How are extreme sea level return periods estimated?",
+]
+
+
+class _LLMCallCounter:
+    """Counts completion calls (not embeddings) made through LiteLLM."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, kwargs, completion_response, start_time, end_time) -> None:
+        if "embedding" not in str(kwargs.get("call_type", "")):
+            self.calls += 1
+
+
+def _answer_tokens(text: str) -> Counter:
+    return Counter(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def answer_overlap(reference: str, candidate: str) -> float:
+    """Token-level F1 between two answers (1.0 = identical bags of words)."""
+    ref, cand = _answer_tokens(reference), _answer_tokens(candidate)
+    common = sum((ref & cand).values())
+    if not common:
+        return 0.0
+    precision = common / sum(cand.values())
+    recall = common / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+async def _run_question(docs, question, settings, user_id, revision, counter, hybrid):
+    counter.calls = 0
+    start = time.perf_counter()
+    session, stats = await cached_aquery(
+        docs, question, settings, user_id, revision, use_cache=False, hybrid=hybrid
+    )
+    return {
+        "answer": session.answer,
+        "llm_calls": counter.calls,
+        "latency_seconds": round(time.perf_counter() - start, 2),
+        "contexts": len(session.contexts),
+        "chunks_skipped": stats["chunks_skipped"],
+    }
+
+
+async def run_benchmark(user_id: str, questions: list[str]) -> dict:
+    settings = get_user_settings(user_id)
+    # The store the index worker last published; the benchmark never writes it
+    docs, revision = await asyncio.to_thread(load_published_docs, user_id, settings)
+    if docs is None:
+        raise SystemExit(f"No completed knowledge base build for user {user_id}")
+
+    counter = _LLMCallCounter()
+    litellm.success_callback.append(counter)
+    results = []
+    try:
+        for question in questions:
+            print(f"[PQA] Benchmark: {question}")
+            baseline = await _run_question(docs, question, settings, user_id, revision, counter, hybrid=False)
+            hybrid = await _run_question(docs, question, settings, user_id, revision, counter, hybrid=True)
+            results.append({
+                "question": question,
+                "baseline": baseline,
+                "hybrid": hybrid,
+                "answer_overlap": round(answer_overlap(baseline["answer"], hybrid["answer"]), 3),
+            })
+    finally:
+        litellm.success_callback.remove(counter)
+
+    def _total(mode: str, field: str) -> float:
+        return sum(r[mode][field] for r in results)
+
+    summary = {
+        "questions": len(results),
+        "baseline_llm_calls": _total("baseline", "llm_calls"),
+        "hybrid_llm_calls": _total("hybrid", "llm_calls"),
+        "baseline_latency_seconds": round(_total("baseline", "latency_seconds"), 2),
+        "hybrid_latency_seconds": round(_total("hybrid", "latency_seconds"), 2),
+        "mean_answer_overlap": round(statistics.mean(r["answer_overlap"] for r in results), 3) if results else None,
+    }
+    return {"summary": summary, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark hybrid knowledge base retrieval.")
+    parser.add_argument("user_id")
+    parser.add_argument("--questions", help="JSON file with a list of questions")
+    parser.add_argument("--output", help="Write full results to this JSON file")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = json.load(f)
+
+    report = asyncio.run(run_benchmark(args.user_id, questions))
+    print(json.dumps(report["summary"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Checks for the local station lookup behind ``get_station_info``.
+
+Each query is answered by ``lookup_station_query`` and compared with the
+expected kind (and station). ``None`` means the query is left to the LLM:
+questions it cannot answer confidently, several names, or free-form text.
+
+Usage:
+    python station_lookup_check.py
+"""
+from utils.station_lookup import lookup_station_query
+
+CHECKS = [
+    # (query, expected kind or None, expected uhslc_id)
+    ("Honolulu, HI", "name", "057"),
+    ("057", "id", "057"),
+    ("honalulu", "name", "057"),
+    ("xyzzy", "not_found", None),
+    ("Is ??? a station?", "not_found", None),
+    ("Is Midway a station?", "name", "050"),
+    ("Where is Hilo?", "name", "060"),
+    ("Is there a station in Fiji?", "region", None),
+    ("What stations are in Hawaii?", "region", None),
+    ("Which station is closest to Tokyo?", None, None),
+    ("stations near Tokyo", None, None),
+    ("Hilo and Kahului", None, None),
+    ("Midway or Wake", None, None),
+    ("Is Apra Harbor a station?", None, None),
+]
+
+
+def main() -> int:
+    failures = 0
+    for query, kind, uhslc_id in CHECKS:
+        result = lookup_station_query(query)
+        got_kind = result["kind"] if result else None
+        got_id = result["station"]["uhslc_id"] if result and "station" in result else None
+        ok = got_kind == kind and (uhslc_id is None or got_id == uhslc_id)
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4}  {query!r} -> {got_kind} {got_id or ''}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,81 @@
+from typing import Any, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from auth import get_auth_token, get_current_user
+from models import User
+from utils.station_geo import nearest_stations, stations_in_bbox, stations_within
+from utils.station_lookup import find_stations
+
+router = APIRouter(prefix="/stations", tags=["stations"])
+
+
+def get_user(token: str = Depends(get_auth_token)) -> User:
+    user = get_current_user(token)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+    return user
+
+
+def _run(query, **kwargs: Any) -> dict:
+    try:
+        stations = query(**kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"stations": stations, "count": len(stations)}
+
+
+@router.get("/search")
+def search_stations(
+    q: str = Query(..., min_length=1, description="Station name (fuzzy) or uhslc_id"),
+    country: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=50),
+    user: User = Depends(get_user),
+):
+    return _run(find_stations, query=q, country=country, limit=limit)
+
+
+@router.get("/nearest")
+def get_nearest_stations(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = None,
+    station: Optional[str] = Query(None, description="Center on this station (name or uhslc_id) instead of lat/lon"),
+    k: int = Query(5, ge=1, le=100),
+    span: Optional[str] = Query(None, pattern="^(fd|rq)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user: User = Depends(get_user),
+):
+    return _run(nearest_stations, lat=lat, lon=lon, station=station, k=k, span=span, start=start, end=end)
+
+
+@router.get("/within")
+def get_stations_within(
+    radius_km: float = Query(..., gt=0, le=20040),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = None,
+    station: Optional[str] = Query(None, description="Center on this station (name or uhslc_id) instead of lat/lon"),
+    span: Optional[str] = Query(None, pattern="^(fd|rq)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user: User = Depends(get_user),
+):
+    return _run(stations_within, lat=lat, lon=lon, station=station, radius_km=radius_km, span=span, start=start, end=end)
+
+
+@router.get("/bbox")
+def get_stations_in_bbox(
+    min_lon: float = Query(...),
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(...),
+    max_lat: float = Query(..., ge=-90, le=90),
+    span: Optional[str] = Query(None, pattern="^(fd|rq)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user: User = Depends(get_user),
+):
+    """``min_lon`` greater than ``max_lon`` (e.g. 160 to -120) selects a box across the antimeridian."""
+    return _run(
+        stations_in_bbox, min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat,
+        span=span, start=start, end=end,
+    )
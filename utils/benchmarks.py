@@ -0,0 +1,185 @@
+"""
+Typed, preloaded table of the UHSLC tide gauge benchmarks.
+
+``data/benchmarks/all_benchmarks.json`` is a GeoJSON whose levels are strings
+with "nan" for missing values. It is parsed once into a pandas DataFrame with
+real dtypes, indexed by ``(uhslc_id, type)``:
+
+    uhslc_id (int), type (category: primary/secondary/gps/station), station_id ("003"),
+    benchmark, name, country, lat, lon, level_m, level_mm, level_ft (float, NaN when
+    unlevelled), level_date (datetime64), primary, from_sensor (bool), description,
+    photo_urls, reports
+
+Levels are the benchmark heights above station zero. ``datum_offsets`` looks
+them up for many stations at once through a dense id-indexed array per
+benchmark type, so converting a batch of station-zero series to benchmark
+heights needs no per-station filtering.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_PATH = Path(os.getenv(
+    "BENCHMARKS_PATH",
+    str(Path(__file__).resolve().parent.parent / "data" / "benchmarks" / "all_benchmarks.json"),
+))
+BENCHMARK_PHOTO_URL = "http://uhslc.soest.hawaii.edu/stations/images/benchmark_photos/{filename}"
+BENCHMARK_TYPES = ("primary", "secondary", "gps", "station")
+_LEVEL_UNITS = {"m": 1.0, "mm": 1000.0, "cm": 100.0, "ft": 1 / 0.3048}
+
+StationIds = Union[int, str, list, tuple, np.ndarray, pd.Series, None]
+
+
+def _float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _photo_urls(photo_files: Any) -> list[str]:
+    urls = []
+    for photo in photo_files or []:
+        filename = photo.get("file") if isinstance(photo, dict) else photo
+        if filename:
+            urls.append(BENCHMARK_PHOTO_URL.format(filename=filename))
+    return urls
+
+
+def _load_table(path: Path) -> pd.DataFrame:
+    features = json.loads(path.read_text())["features"]
+    rows = []
+    for feature in features:
+        props = feature["properties"]
+        lon, lat = feature["geometry"]["coordinates"][:2]
+        rows.append({
+            "uhslc_id": int(props["uhslc_id"]),
+            "type": str(props.get("type") or "").lower(),
+            "station_id": f"{int(props['uhslc_id']):03d}",
+            "benchmark": props.get("benchmark"),
+            "name": props.get("name"),
+            "country": props.get("country_name"),
+            "lat": float(lat),
+            "lon": float(lon),
+            "level_m": _float(props.get("level")),
+            "level_date": props.get("level_date"),
+            "primary": bool(props.get("primary")),
+            "from_sensor": props.get("from_sensor") not in (None, "", "0", "nan"),
+            "description": props.get("description"),
+            "photo_urls": _photo_urls(props.get("photo_files")),
+            "reports": props.get("reports") if isinstance(props.get("reports"), list) else [],
+        })
+    table = pd.DataFrame(rows)
+    table["type"] = pd.Categorical(table["type"], categories=BENCHMARK_TYPES)
+    table["level_mm"] = (table["level_m"] * 1000.0).round(1)
+    table["level_ft"] = table["level_m"] * _LEVEL_UNITS["ft"]
+    table["level_date"] = pd.to_datetime(table["level_date"], errors="coerce")
+    return table.set_index(["uhslc_id", "type"]).sort_index()
+
+
+def _offset_arrays(table: pd.DataFrame) -> dict[str, np.ndarray]:
+    """Per benchmark type, ``level_m`` in a dense array indexed by uhslc_id (NaN elsewhere).
+
+    A station with several levelled benchmarks of one type uses the most
+    recently levelled one.
+    """
+    size = int(table.index.get_level_values("uhslc_id").max()) + 1 if len(table) else 0
+    levelled = table.dropna(subset=["level_m"]).reset_index()
+    levelled = levelled.sort_values("level_date", na_position="first").drop_duplicates(
+        ["uhslc_id", "type"], keep="last"
+    )
+    arrays = {}
+    for benchmark_type in BENCHMARK_TYPES:
+        offsets = np.full(size, np.nan)
+        rows = levelled[levelled["type"] == benchmark_type]
+        offsets[rows["uhslc_id"].to_numpy()] = rows["level_m"].to_numpy()
+        arrays[benchmark_type] = offsets
+    return arrays
+
+
+class _BenchmarkCache:
+    """The parsed table, reloaded when the JSON file changes."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._mtime_ns: Optional[int] = None
+        self.table: Optional[pd.DataFrame] = None
+        self.offsets: dict[str, np.ndarray] = {}
+
+    def get(self) -> "_BenchmarkCache":
+        mtime_ns = BENCHMARKS_PATH.stat().st_mtime_ns
+        if mtime_ns != self._mtime_ns:
+            with self._lock:
+                if mtime_ns != self._mtime_ns:
+                    table = _load_table(BENCHMARKS_PATH)
+                    self.offsets = _offset_arrays(table)
+                    self.table = table
+                    self._mtime_ns = mtime_ns
+        return self
+
+
+_cache = _BenchmarkCache()
+
+
+def benchmark_table() -> pd.DataFrame:
+    """The full benchmark table (shared; copy before modifying)."""
+    return _cache.get().table
+
+
+def _station_id_array(station_ids: StationIds) -> np.ndarray:
+    if isinstance(station_ids, (int, np.integer, str)):
+        station_ids = [station_ids]
+    try:
+        return np.asarray([int(s) for s in station_ids], dtype=np.int64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Station ids must be uhslc_ids like 57 or '057', got {station_ids!r}")
+
+
+def _benchmark_type(benchmark_type: str) -> str:
+    key = str(benchmark_type).lower()
+    if key not in BENCHMARK_TYPES:
+        raise ValueError(f"benchmark_type must be one of {BENCHMARK_TYPES}, not {benchmark_type!r}")
+    return key
+
+
+def datum_offsets(station_ids: StationIds, benchmark_type: str = "primary", units: str = "mm") -> np.ndarray:
+    """Benchmark level above station zero for each station, aligned with ``station_ids``.
+
+    NaN where a station has no levelled benchmark of that type. Subtracting
+    the offset from station-zero water levels gives heights relative to the
+    benchmark.
+    """
+    if units not in _LEVEL_UNITS:
+        raise ValueError(f"units must be one of {tuple(_LEVEL_UNITS)}, not {units!r}")
+    offsets = _cache.get().offsets[_benchmark_type(benchmark_type)]
+    ids = _station_id_array(station_ids)
+    valid = (ids >= 0) & (ids < len(offsets))
+    result = np.full(len(ids), np.nan)
+    result[valid] = offsets[ids[valid]]
+    return result * _LEVEL_UNITS[units]
+
+
+def get_benchmarks(
+    station_ids: StationIds = None,
+    benchmark_type: Optional[str] = None,
+    levelled_only: bool = False,
+) -> pd.DataFrame:
+    """Benchmarks for one or more stations (all stations when ``station_ids`` is None).
+
+    ``station_ids`` takes uhslc_ids as ints or strings ("057", 57, ["003", "057"]).
+    Returns a flat DataFrame (one row per benchmark) ordered by station and type.
+    """
+    table = benchmark_table()
+    if station_ids is not None:
+        ids = np.unique(_station_id_array(station_ids))
+        table = table[table.index.get_level_values("uhslc_id").isin(ids)]
+    if benchmark_type is not None:
+        table = table[table.index.get_level_values("type") == _benchmark_type(benchmark_type)]
+    if levelled_only:
+        table = table[table["level_m"].notna()]
+    return table.reset_index()
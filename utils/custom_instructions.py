@@ -72,8 +72,17 @@ Important notes:
                 print(get_station_info("Honolulu, HI"))   # -> 057
                 print(get_station_info("057"))            # -> "Honolulu, HI"
                 print(get_station_info("Is ??? a station?"))      # -> "Not in UHSLC Fast Delivery station list."
-                print(get_station_info("What stations are in Hawaii?"))
+                print(get_station_info("What stations are in Hawaii?"))  # -> one {"uhslc_id", "name"} JSON line per station
+                print(get_station_info("Honalulu"))       # -> 057 (closest match: Honolulu, HI)
                 # If upstream prompt says “return both id and name”, model may return: "uhslc_id": 057, "name": "Honolulu, HI"
+            Names, ids and regions are resolved instantly from a local station index; only open-ended questions are sent to an LLM.
+            find_stations("<name or id>", country=None, limit=5) returns the best matches as dicts (uhslc_id, name, country, lat, lon, score) when I need more than one candidate.
+            For questions about where stations are, use the spatial station functions (also pre-loaded; do not compute distances from fd_metadata.geojson myself):
+                nearest_stations(lat, lon, k=5)  or  nearest_stations(station="Guam", k=5)      # nearest first, with distance_km
+                stations_within(station="Guam", radius_km=200)  or  stations_within(lat, lon, radius_km)
+                stations_in_bbox(min_lon, min_lat, max_lon, max_lat)    # e.g. stations_in_bbox(160, -30, -120, 0) crosses the antimeridian
+            Longitudes may be -180..180 or 0..360; results give lon in -180..180 (lon_360 as in the metadata) plus fd_span and rq_span.
+            All three accept span="fd" or span="rq" with start="YYYY[-MM-DD]" and/or end=... to keep only stations whose Fast Delivery / Research Quality record covers that period.
 
             3. get_climate_index(climate_index_name)
             This function is already defined and available for immediate use. You must use get_climate_index("<INDEX_NAME>") whenever a user requests climate index data.
@@ -159,8 +168,10 @@ Important notes:
             The function returns a dictionary with:
                 - "answer": The text answer with citations (text description only)
                 - "images": List of extracted figures/images from the papers (if any; may include many pages)
-                    Each image has: "path" (local file path), "relative_path" (for display), 
-                    "page" (page number), "description" (if available), "used_in_answer" (bool)
+                    Each image has: "path" (local file path), "url" (for display, relative to the host),
+                    "thumbnail_path" / "thumbnail_url" (small preview), "page" (page number),
+                    "description" (if available), "used_in_answer" (bool)
+                - "cache": Cache statistics (answer cache hit/miss, evidence hits/misses, LLM calls saved); no need to show these to the user
 
             **STANDARD USAGE (for text queries - no images needed)**
                 result = query_knowledge_base("What methods are used for sea level analysis?", "{user_id}", "{session_id}")
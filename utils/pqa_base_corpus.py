@@ -0,0 +1,245 @@
+"""
+Shared, read-only base corpus for knowledge base queries.
+
+Papers in ``PQA_BASE_CORPUS_DIR`` (e.g. a curated archive of journal articles)
+are parsed and embedded once per deploy into a memmap snapshot under
+``.pqa/base/``. The index worker builds it at startup; the snapshot revision
+covers the file contents and the embedding/chunking settings, so an unchanged
+corpus is never rebuilt. At query time the base snapshot is merged with the
+user's own store through ``MergedVectorStore``, so every user can query the
+base corpus without it being copied into their library.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Iterable, Optional, Sequence
+
+from pydantic import PrivateAttr
+
+from paperqa import Docs, Settings
+from paperqa.llms import VectorStore
+
+from core.cache import redis_client
+from utils.pqa_media_store import store_texts_media
+from utils.pqa_memmap_store import export_memmap_store, load_memmap_docs, read_memmap_revision
+from utils.pqa_multi_tenant import (
+    PAPER_EXTENSIONS,
+    PQA_HOME,
+    PQA_ROOT,
+    _compute_revision,
+    _embed_texts,
+    _make_build_settings,
+    load_shared_chunks,
+    save_shared_chunks,
+    scan_paper_files,
+    shared_chunks_key,
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_CORPUS_DIR = Path(os.getenv("PQA_BASE_CORPUS_DIR", str(PQA_HOME / "base_papers")))
+BASE_ROOT = PQA_ROOT / "base"
+BASE_STORE_DIR = BASE_ROOT / "memmap"
+# File sizes, mtimes and hashes from the last scan, so unchanged files are not re-hashed
+BASE_MANIFEST_PATH = BASE_ROOT / "files.json"
+# Figures from the base corpus live in the media store under this owner
+BASE_MEDIA_OWNER = "base"
+BASE_BUILD_LOCK_KEY = "kb_index:lock:base"
+BASE_BUILD_LOCK_SECONDS = 6 * 60 * 60
+
+_base_docs: dict = {}
+
+
+def get_base_settings() -> Settings:
+    from utils.my_pqa_settings import create_pqa_settings
+
+    return create_pqa_settings(
+        paper_directory=BASE_CORPUS_DIR,
+        index_directory=BASE_ROOT / "index",
+    )
+
+
+def _base_files() -> dict:
+    if not BASE_CORPUS_DIR.is_dir():
+        return {}
+    names = {
+        p.name: None for p in BASE_CORPUS_DIR.iterdir()
+        if p.is_file() and p.suffix.lower() in PAPER_EXTENSIONS
+    }
+    try:
+        previous = json.loads(BASE_MANIFEST_PATH.read_text())
+    except (OSError, ValueError):
+        previous = {}
+    files = scan_paper_files(BASE_CORPUS_DIR, names, previous)
+    if files != previous:
+        try:
+            BASE_MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+            # Several workers may start at once
+            tmp_path = BASE_MANIFEST_PATH.with_name(f"files.json.tmp-{os.getpid()}")
+            tmp_path.write_text(json.dumps(files, indent=2, sort_keys=True))
+            os.replace(tmp_path, BASE_MANIFEST_PATH)
+        except OSError as exc:
+            logger.warning(f"[PQA] Failed to save base corpus manifest: {exc}")
+    return files
+
+
+def _base_revision(files: dict, settings: Settings) -> str:
+    """``<embedding model>:<digest>``; the prefix lets queries check compatibility."""
+    digest = hashlib.md5(
+        f"{_compute_revision(files)}:{shared_chunks_key('base', settings)}".encode()
+    ).hexdigest()
+    return f"{settings.embedding}:{digest}"
+
+
+async def _build_base_docs(files: dict, settings: Settings) -> Docs:
+    build_settings = _make_build_settings(settings)
+    embedding_model = settings.get_embedding_model()
+    embed_semaphore = asyncio.Semaphore(4)
+    docs = Docs()
+
+    for name, entry in sorted(files.items()):
+        shared_key = shared_chunks_key(entry["sha256"], settings)
+        shared = await asyncio.to_thread(load_shared_chunks, shared_key)
+        if shared is not None:
+            doc, texts = shared
+        else:
+            file_docs = Docs()
+            try:
+                docname = await file_docs.aadd(BASE_CORPUS_DIR / name, settings=build_settings)
+            except Exception as exc:
+                logger.warning(f"[PQA] Failed to parse base corpus file {name}: {exc}")
+                continue
+            if not docname:
+                continue
+            doc, texts = next(iter(file_docs.docs.values())), file_docs.texts
+            await _embed_texts(texts, settings, embedding_model, embed_semaphore)
+            await asyncio.to_thread(save_shared_chunks, shared_key, doc, texts)
+        await asyncio.to_thread(store_texts_media, BASE_MEDIA_OWNER, texts)
+        for text in texts:
+            for media in text.media or []:
+                media.info["media_owner"] = BASE_MEDIA_OWNER
+        await docs.aadd_texts(texts, doc, settings=build_settings)
+    return docs
+
+
+def build_base_corpus() -> Optional[str]:
+    """Build the base corpus snapshot unless it is already current.
+
+    Returns the snapshot revision, or None when there is no base corpus.
+    Guarded by a Redis lock so only one worker builds per deploy.
+    """
+    settings = get_base_settings()
+    files = _base_files()
+    if not files:
+        logger.info(f"[PQA] No base corpus in {BASE_CORPUS_DIR}.")
+        return None
+    revision = _base_revision(files, settings)
+    if read_memmap_revision(BASE_STORE_DIR) == revision:
+        logger.info(f"[PQA] Base corpus snapshot is current ({len(files)} files).")
+        return revision
+
+    if not redis_client.set(BASE_BUILD_LOCK_KEY, str(os.getpid()), nx=True, ex=BASE_BUILD_LOCK_SECONDS):
+        logger.info("[PQA] Base corpus is being built by another worker.")
+        return None
+    try:
+        t0 = time.perf_counter()
+        docs = asyncio.run(_build_base_docs(files, settings))
+        export_memmap_store(BASE_STORE_DIR, docs, revision)
+        logger.info(
+            f"[PQA] Built base corpus ({len(docs.docs)} of {len(files)} files) "
+            f"in {time.perf_counter() - t0:.2f}s."
+        )
+        return revision
+    finally:
+        redis_client.delete(BASE_BUILD_LOCK_KEY)
+
+
+def load_base_docs(settings: Settings) -> tuple[Optional[Docs], Optional[str]]:
+    """The base corpus Docs and its revision, if built for ``settings.embedding``."""
+    revision = read_memmap_revision(BASE_STORE_DIR)
+    if revision is None or not revision.startswith(f"{settings.embedding}:"):
+        return None, None
+    cached = _base_docs.get("current")
+    if cached and cached["revision"] == revision:
+        return cached["docs"], revision
+    docs = load_memmap_docs(BASE_STORE_DIR, revision)
+    if docs is None:
+        return None, None
+    _base_docs["current"] = {"docs": docs, "revision": revision}
+    return docs, revision
+
+
+class _QueryEmbedding:
+    """Embeds the query once and hands the vector to every merged store."""
+
+    def __init__(self, embedding: list[float]) -> None:
+        self.embedding = embedding
+
+    async def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embedding for _ in texts]
+
+
+class MergedVectorStore(VectorStore):
+    """Read-only union of several Docs' vector stores, ranked by score."""
+
+    _sources: list = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def of(cls, sources: Sequence[Docs]) -> "MergedVectorStore":
+        store = cls()
+        store._sources = list(sources)
+        return store
+
+    def __len__(self) -> int:
+        return sum(max(len(s.texts_index), len(s.texts)) for s in self._sources)
+
+    async def add_texts_and_embeddings(self, texts: Iterable[Any]) -> None:
+        return None
+
+    def clear(self) -> None:
+        return None
+
+    async def similarity_search(
+        self, query: str, k: int, embedding_model: Any
+    ) -> tuple[Sequence[Any], list[float]]:
+        query_embedding = _QueryEmbedding((await embedding_model.embed_documents([query]))[0])
+        results: list[tuple[Any, float]] = []
+        for source in self._sources:
+            # In-memory Docs index their texts lazily
+            await source._build_texts_index(embedding_model)
+            texts, scores = await source.texts_index.similarity_search(
+                query, k + len(source.deleted_dockeys), query_embedding
+            )
+            results.extend(
+                (t, s) for t, s in zip(texts, scores)
+                if t.doc.dockey not in source.deleted_dockeys
+            )
+        results.sort(key=lambda pair: pair[1], reverse=True)
+        results = results[:k]
+        return [t for t, _ in results], [s for _, s in results]
+
+
+def merge_with_base(
+    docs: Optional[Docs], revision: Optional[str], settings: Settings
+) -> tuple[Optional[Docs], Optional[str]]:
+    """Combine a user's Docs with the base corpus for querying.
+
+    The returned revision covers both, so cached answers are invalidated when
+    either side changes. Without a compatible base corpus the inputs are
+    returned unchanged.
+    """
+    base_docs, base_revision = load_base_docs(settings)
+    if base_docs is None:
+        return docs, revision
+    if docs is None:
+        return base_docs, f"base:{base_revision}"
+    # PaperQA reads .docs to tell "no papers" from "not enough information"
+    merged = Docs(
+        docs={**base_docs.docs, **docs.docs},
+        texts_index=MergedVectorStore.of([docs, base_docs]),
+    )
+    return merged, f"{revision}+base:{base_revision}"
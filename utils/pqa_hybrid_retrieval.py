@@ -0,0 +1,164 @@
+"""
+Hybrid BM25 + embedding retrieval for knowledge base queries.
+
+PaperQA's retrieval is embedding-only and every retrieved chunk is sent to
+the summary LLM. Here a larger candidate pool is pulled from the vector
+store, re-scored with BM25 over the chunk text, and the two scores are fused:
+
+    fused = alpha * cosine / max(cosine) + (1 - alpha) * bm25 / max(bm25)
+
+Chunks whose fused score falls below ``KB_RELEVANCE_CUTOFF`` times the best
+chunk's are dropped before summarization, so marginal chunks no longer cost
+an LLM call each. BM25 statistics (IDF, average length) are computed over the
+candidate pool, which works the same for every store backend (pgvector,
+memmap, pickle) without keeping a second corpus-wide index. The final pick
+applies ``texts_index_mmr_lambda`` to the fused scores, as PaperQA's own MMR
+search does to the cosine scores.
+"""
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Any
+
+import numpy as np
+
+from paperqa import Settings
+
+logger = logging.getLogger(__name__)
+
+HYBRID_RETRIEVAL = os.getenv("KB_HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+# Candidate pool size as a multiple of evidence_k
+HYBRID_POOL_FACTOR = int(os.getenv("KB_HYBRID_POOL_FACTOR", "4"))
+# Weight of the vector score in the fused score (1.0 = embedding only)
+HYBRID_ALPHA = float(os.getenv("KB_HYBRID_ALPHA", "0.6"))
+# Relative to the best chunk; 0 disables the cutoff
+RELEVANCE_CUTOFF = float(os.getenv("KB_RELEVANCE_CUTOFF", "0.45"))
+# Never summarize fewer chunks than this (when available)
+MIN_EVIDENCE_CHUNKS = int(os.getenv("KB_MIN_EVIDENCE_CHUNKS", "2"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the "
+    "this to was were what when where which who why with does do did can".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def bm25_scores(query: str, documents: list[str]) -> np.ndarray:
+    """Okapi BM25 score of ``query`` against each document in ``documents``."""
+    query_terms = set(tokenize(query))
+    if not documents or not query_terms:
+        return np.zeros(len(documents))
+    doc_tokens = [tokenize(d) for d in documents]
+    lengths = np.array([len(t) for t in doc_tokens], dtype=float)
+    avg_len = lengths.mean() or 1.0
+    n = len(documents)
+
+    scores = np.zeros(n)
+    counts = [Counter(t) for t in doc_tokens]
+    for term in query_terms:
+        tf = np.array([c.get(term, 0) for c in counts], dtype=float)
+        df = int((tf > 0).sum())
+        if df == 0:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_len))
+    return scores
+
+
+def fuse_scores(vector_scores: np.ndarray, lexical_scores: np.ndarray, alpha: float) -> np.ndarray:
+    """Max-normalise both score lists and blend them; result is scaled to max 1."""
+    def _norm(scores: np.ndarray) -> np.ndarray:
+        top = scores.max() if len(scores) else 0.0
+        return scores / top if top > 0 else np.zeros_like(scores)
+
+    fused = alpha * _norm(np.clip(vector_scores, 0, None)) + (1 - alpha) * _norm(lexical_scores)
+    return _norm(fused)
+
+
+def retrieval_config(hybrid: bool, settings: Settings) -> dict:
+    """The retrieval settings that change which chunks are summarized (for cache keys)."""
+    config = {"hybrid": hybrid, "mmr_lambda": settings.texts_index_mmr_lambda}
+    if hybrid:
+        config.update(
+            pool_factor=HYBRID_POOL_FACTOR,
+            alpha=HYBRID_ALPHA,
+            cutoff=RELEVANCE_CUTOFF,
+            min_chunks=MIN_EVIDENCE_CHUNKS,
+        )
+    return config
+
+
+def mmr_order(pool: list[Any], scores: np.ndarray, k: int, mmr_lambda: float) -> np.ndarray:
+    """Indices of up to ``k`` chunks chosen by maximal marginal relevance over ``scores``.
+
+    Same trade-off as PaperQA's ``max_marginal_relevance_search``: each pick
+    maximizes ``mmr_lambda * score - (1 - mmr_lambda) * max similarity to the
+    chunks already picked``. Falls back to plain score order when MMR is off
+    or a chunk has no embedding.
+    """
+    order = np.argsort(-scores)
+    if len(pool) <= k or mmr_lambda >= 1.0 or any(t.embedding is None for t in pool):
+        return order[:k]
+    embeddings = np.asarray([t.embedding for t in pool], dtype=float)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+    similarity = embeddings @ embeddings.T
+
+    selected = [int(order[0])]
+    while len(selected) < k:
+        mmr = mmr_lambda * scores - (1 - mmr_lambda) * similarity[:, selected].max(axis=1)
+        mmr[selected] = -np.inf
+        selected.append(int(mmr.argmax()))
+    return np.asarray(selected)
+
+
+async def hybrid_retrieve(
+    docs: Any,
+    query: str,
+    settings: Settings,
+    alpha: float = HYBRID_ALPHA,
+    cutoff: float = RELEVANCE_CUTOFF,
+) -> tuple[list[Any], dict]:
+    """Return up to ``evidence_k`` chunks worth summarizing, plus retrieval stats."""
+    k = settings.answer.evidence_k
+    embedding_model = settings.get_embedding_model()
+    # In-memory (pickle) Docs index their texts lazily, as retrieve_texts does
+    await docs._build_texts_index(embedding_model)
+    texts, scores = await docs.texts_index.similarity_search(
+        query, k * max(HYBRID_POOL_FACTOR, 1), embedding_model
+    )
+    # Drop deleted docs and repeated chunks, keeping the best-scoring copy
+    pool: list[Any] = []
+    pool_scores: list[float] = []
+    seen: set[str] = set()
+    for text, score in zip(texts, scores):
+        if text.doc.dockey in docs.deleted_dockeys or text.name in seen:
+            continue
+        seen.add(text.name)
+        pool.append(text)
+        pool_scores.append(score)
+    if not pool:
+        return [], {"candidates": 0, "chunks_skipped": 0}
+
+    fused = fuse_scores(
+        np.asarray(pool_scores, dtype=float),
+        bm25_scores(query, [t.text for t in pool]),
+        alpha,
+    )
+    order = mmr_order(pool, fused, k, settings.texts_index_mmr_lambda)
+    selected = [
+        pool[i] for rank, i in enumerate(order)
+        if rank < MIN_EVIDENCE_CHUNKS or fused[i] >= cutoff
+    ]
+    skipped = len(order) - len(selected)
+    if skipped:
+        logger.info(f"[PQA] Relevance cutoff skipped {skipped} of {len(order)} chunks.")
+    return selected, {"candidates": len(pool), "chunks_skipped": skipped}
@@ -0,0 +1,138 @@
+"""
+Per-user, content-addressed store for figures extracted from knowledge base papers.
+
+Figures are written once, when a paper is indexed, to
+``.pqa/media/<user_id>/<sha256>.<ext>`` next to a ``<sha256>.thumb.png``
+thumbnail, and the hash is recorded in the chunk's ``media.info``. At query
+time the returned image references are derived from that hash, so nothing is
+re-encoded (no base64 round trip) or re-written per chat session. The store
+lives on the data volume shared by the API and the index worker, and is served
+read-only at ``/kb-media``.
+"""
+import hashlib
+import logging
+import os
+import shutil
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MEDIA_ROOT = Path(os.getenv("PQA_HOME", "/app/data")) / ".pqa" / "media"
+MEDIA_URL_PREFIX = "/kb-media"
+THUMBNAIL_SIZE = (320, 320)
+
+
+def get_user_media_dir(user_id: Any) -> Path:
+    return MEDIA_ROOT / str(user_id)
+
+
+def _media_ext(media: Any) -> str:
+    suffix = str(media.info.get("suffix", "png")).removeprefix(".").lower()
+    return "jpg" if suffix == "jpeg" else suffix or "png"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _write_thumbnail(data: bytes, path: Path) -> None:
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            buffer = BytesIO()
+            image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB").save(buffer, format="PNG")
+        _write_atomic(path, buffer.getvalue())
+    except Exception as exc:
+        logger.warning(f"[PQA] Failed to create thumbnail {path.name}: {exc}")
+
+
+def media_digest(media: Any) -> Optional[str]:
+    """The media's content hash: the one recorded at index time, else computed."""
+    if media.info.get("media_sha256"):
+        return media.info["media_sha256"]
+    return hashlib.sha256(media.data).hexdigest() if media.data else None
+
+
+def _write_media(user_id: Any, media: Any, digest: str) -> None:
+    user_dir = get_user_media_dir(user_id)
+    image_path = user_dir / f"{digest}.{_media_ext(media)}"
+    if image_path.exists():
+        return
+    user_dir.mkdir(parents=True, exist_ok=True)
+    _write_atomic(image_path, media.data)
+    _write_thumbnail(media.data, user_dir / f"{digest}.thumb.png")
+
+
+def store_media(user_id: Any, media: Any) -> Optional[str]:
+    """Write one media item (and its thumbnail) if missing; returns its hash.
+
+    The hash is recorded in ``media.info``, which changes the hash of the
+    text the media belongs to: only call this before the text is indexed.
+    """
+    if not media.data:
+        return None
+    digest = media_digest(media)
+    media.info["media_sha256"] = digest
+    _write_media(user_id, media, digest)
+    return digest
+
+
+def store_texts_media(user_id: Any, texts: Iterable[Any]) -> int:
+    """Store every figure attached to ``texts``; returns how many were present."""
+    count = 0
+    for text in texts:
+        for media in text.media or []:
+            if store_media(user_id, media):
+                count += 1
+    return count
+
+
+def backfill_media_digests(user_id: Any, texts: Iterable[Any]) -> int:
+    """Store figures indexed before the media store existed and record their hash.
+
+    Returns how many media items changed; their texts hash differently now,
+    so the caller must rebuild its vector index over them.
+    """
+    count = 0
+    for text in texts:
+        for media in text.media or []:
+            if not media.info.get("media_sha256") and store_media(user_id, media):
+                count += 1
+    return count
+
+
+def media_reference(user_id: Any, media: Any) -> Optional[dict]:
+    """File paths and URLs for a stored media item.
+
+    Media indexed before the store existed is written on first use, without
+    touching ``media.info`` (the texts are shared with the cached Docs).
+    Media from the shared base corpus carries its own ``media_owner``.
+    """
+    user_id = media.info.get("media_owner", user_id)
+    digest = media_digest(media)
+    if not digest:
+        return None
+    ext = _media_ext(media)
+    user_dir = get_user_media_dir(user_id)
+    if not (user_dir / f"{digest}.{ext}").exists():
+        if not media.data:
+            return None
+        _write_media(user_id, media, digest)
+    thumb_path = user_dir / f"{digest}.thumb.png"
+    return {
+        "media_id": digest,
+        "path": str(user_dir / f"{digest}.{ext}"),
+        "url": f"{MEDIA_URL_PREFIX}/{user_id}/{digest}.{ext}",
+        "thumbnail_path": str(thumb_path) if thumb_path.exists() else None,
+        "thumbnail_url": f"{MEDIA_URL_PREFIX}/{user_id}/{digest}.thumb.png" if thumb_path.exists() else None,
+    }
+
+
+def clear_user_media(user_id: Any) -> None:
+    shutil.rmtree(get_user_media_dir(user_id), ignore_errors=True)
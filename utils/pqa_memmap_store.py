@@ -0,0 +1,229 @@
+"""
+Memory-mapped embedding store for per-user PaperQA knowledge bases.
+
+After an index build the user's Docs is exported to a new snapshot under
+``docs_cache/memmap.snapshots/``, and the ``docs_cache/memmap`` symlink is
+swapped to it in one step, so readers always find a complete snapshot. A
+snapshot holds:
+
+* ``embeddings.npy`` - contiguous float32 matrix (one L2-normalised row per
+  chunk), opened with ``mmap_mode="r"`` so pages are shared across kernels
+  through the OS page cache;
+* ``chunks.json``    - compact per-chunk metadata (doc index, name and byte
+  ranges into the blobs below);
+* ``texts.bin`` / ``media.bin`` - concatenated chunk text (UTF-8) and pickled
+  media, read only for the chunks a query retrieves;
+* ``docs.pkl``       - the (small) list of source Doc objects;
+* ``revision.txt``   - written last; a snapshot is valid only if it matches.
+
+Loading is a few small reads plus an mmap, and similarity search is a single
+vectorised matrix-vector product over the memmap. The snapshot is the only
+copy of the store: incremental builds start from it (``load_editable_docs``)
+instead of from a pickled Docs.
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+from pydantic import PrivateAttr
+
+from paperqa import Docs
+from paperqa.llms import VectorStore
+from paperqa.types import Text
+
+logger = logging.getLogger(__name__)
+
+
+# Earlier snapshots kept for queries still reading them
+MEMMAP_SNAPSHOTS_KEEP = int(os.getenv("PQA_MEMMAP_SNAPSHOTS_KEEP", "2"))
+
+
+def _snapshots_dir(store_dir: Path) -> Path:
+    return store_dir.with_name(f"{store_dir.name}.snapshots")
+
+
+def export_memmap_store(store_dir: Path, docs: Any, revision: str) -> None:
+    """Write ``docs`` as a new memmap snapshot and publish it at ``store_dir``."""
+    store_dir = Path(store_dir)
+    snapshots_dir = _snapshots_dir(store_dir)
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    snapshot = snapshots_dir / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    snapshot.mkdir()
+    try:
+        n_chunks = _write_memmap_files(snapshot, docs, revision)
+    except Exception:
+        shutil.rmtree(snapshot, ignore_errors=True)
+        raise
+
+    tmp_link = store_dir.with_name(f".{store_dir.name}.tmp-{os.getpid()}")
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(Path(snapshots_dir.name) / snapshot.name, tmp_link)
+    if store_dir.is_dir() and not store_dir.is_symlink():
+        # Exported before snapshots were published through a link
+        shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_link, store_dir)
+    logger.info(f"[PQA] Exported memmap store ({n_chunks} chunks) to {snapshot}.")
+
+    older = sorted((c for c in snapshots_dir.iterdir() if c != snapshot), key=lambda c: c.name, reverse=True)
+    for old in older[MEMMAP_SNAPSHOTS_KEEP:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _write_memmap_files(tmp_dir: Path, docs: Any, revision: str) -> int:
+    doc_index: dict[str, int] = {}
+    doc_list: list = []
+    chunks: list[list] = []
+    vectors: list = []
+    text_offset = media_offset = 0
+    with open(tmp_dir / "texts.bin", "wb") as texts_f, open(tmp_dir / "media.bin", "wb") as media_f:
+        for t in docs.texts:
+            if t.embedding is None:
+                continue
+            if t.doc.dockey in docs.deleted_dockeys:
+                continue
+            if t.doc.dockey not in doc_index:
+                doc_index[t.doc.dockey] = len(doc_list)
+                doc_list.append(t.doc)
+            text_bytes = t.text.encode("utf-8")
+            texts_f.write(text_bytes)
+            media_bytes = pickle.dumps(t.media, protocol=pickle.HIGHEST_PROTOCOL) if t.media else b""
+            media_f.write(media_bytes)
+            chunks.append([
+                doc_index[t.doc.dockey], t.name,
+                text_offset, len(text_bytes),
+                media_offset, len(media_bytes),
+            ])
+            text_offset += len(text_bytes)
+            media_offset += len(media_bytes)
+            vectors.append(t.embedding)
+
+    if vectors:
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+    else:
+        # Every paper failed to parse or embed: an empty, still valid snapshot
+        matrix = np.empty((0, 0), dtype=np.float32)
+    np.save(tmp_dir / "embeddings.npy", matrix)
+    (tmp_dir / "chunks.json").write_text(json.dumps(chunks, separators=(",", ":")))
+    with open(tmp_dir / "docs.pkl", "wb") as f:
+        pickle.dump(doc_list, f, protocol=pickle.HIGHEST_PROTOCOL)
+    (tmp_dir / "revision.txt").write_text(revision)
+    return len(chunks)
+
+
+def read_memmap_revision(store_dir: Path) -> Optional[str]:
+    rev_path = Path(store_dir) / "revision.txt"
+    try:
+        return rev_path.read_text().strip()
+    except OSError:
+        return None
+
+
+class MemmapVectorStore(VectorStore):
+    """Read-only PaperQA vector store over an exported memmap snapshot."""
+
+    path: str
+    _embeddings: Any = PrivateAttr(default=None)
+    _chunks: list = PrivateAttr(default_factory=list)
+    _docs: list = PrivateAttr(default_factory=list)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        store_dir = Path(self.path)
+        self._chunks = json.loads((store_dir / "chunks.json").read_text())
+        # A zero-length matrix cannot be memory-mapped
+        self._embeddings = (
+            np.load(store_dir / "embeddings.npy", mmap_mode="r") if self._chunks
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        with open(store_dir / "docs.pkl", "rb") as f:
+            self._docs = pickle.load(f)  # noqa: S301 — trusted internal cache
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    async def add_texts_and_embeddings(self, texts: Iterable[Any]) -> None:
+        return None
+
+    def clear(self) -> None:
+        return None
+
+    def _read_blob(self, name: str, offset: int, length: int) -> bytes:
+        if not length:
+            return b""
+        with open(Path(self.path) / name, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _text(self, i: int) -> Text:
+        doc_idx, name, t_off, t_len, m_off, m_len = self._chunks[i]
+        media = self._read_blob("media.bin", m_off, m_len)
+        return Text(
+            text=self._read_blob("texts.bin", t_off, t_len).decode("utf-8"),
+            name=name,
+            media=pickle.loads(media) if media else [],  # noqa: S301
+            doc=self._docs[doc_idx],
+            embedding=self._embeddings[i].tolist(),
+        )
+
+    async def similarity_search(
+        self, query: str, k: int, embedding_model: Any
+    ) -> tuple[Sequence[Text], list[float]]:
+        n = len(self._chunks)
+        if n == 0:
+            return [], []
+        k = min(k, n)
+        query_vec = np.asarray((await embedding_model.embed_documents([query]))[0], dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec) or 1.0
+        scores = self._embeddings @ query_vec
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._text(int(i)) for i in top], [float(scores[i]) for i in top]
+
+
+def _open_store(store_dir: Path, expected_revision: Optional[str]) -> Optional[MemmapVectorStore]:
+    # Pin the snapshot: the link may move to a newer one while this store is in use
+    snapshot = Path(store_dir).resolve()
+    revision = read_memmap_revision(snapshot)
+    if revision is None or (expected_revision is not None and revision != expected_revision):
+        return None
+    try:
+        return MemmapVectorStore(path=str(snapshot))
+    except Exception as exc:
+        logger.warning(f"[PQA] Failed to open memmap store {snapshot}: {exc}")
+        return None
+
+
+def load_memmap_docs(store_dir: Path, expected_revision: Optional[str]) -> Optional[Docs]:
+    """Return a Docs served from the memmap snapshot, or None on miss / error."""
+    store = _open_store(store_dir, expected_revision)
+    if store is None:
+        return None
+    return Docs(docs={doc.dockey: doc for doc in store._docs}, texts_index=store)
+
+
+def load_editable_docs(store_dir: Path) -> Optional[Docs]:
+    """An in-memory Docs with every chunk of the snapshot, for incremental builds."""
+    store = _open_store(store_dir, None)
+    if store is None:
+        return None
+    docs = Docs()
+    try:
+        for i in range(len(store)):
+            text = store._text(i)
+            if text.doc.dockey not in docs.docs:
+                docs.docs[text.doc.dockey] = text.doc
+                docs.docnames.add(text.doc.docname)
+            docs.texts.append(text)
+    except Exception as exc:
+        logger.warning(f"[PQA] Failed to read memmap store {store.path}: {exc}")
+        return None
+    return docs
@@ -1,11 +1,17 @@
 import asyncio
+import functools
 import hashlib
+import inspect
+import multiprocessing
 import os
 import json
 import logging
 import pickle
 import shutil
 import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Optional
@@ -14,20 +20,11 @@ from paperqa import Settings
 from paperqa.settings import AgentSettings, IndexSettings
 from paperqa.agents.search import get_directory_index, SearchIndex
 
-logger = logging.getLogger(__name__)
-
-# Per-user lock to prevent concurrent index builds from corrupting files.zip
-_user_index_locks: dict[str, threading.Lock] = {}
-_locks_lock = threading.Lock()  # protects access to _user_index_locks
+from core.index_progress import IndexProgress
+from utils.pqa_media_store import backfill_media_digests, clear_user_media, store_texts_media
+from utils.pqa_memmap_store import export_memmap_store, load_editable_docs, load_memmap_docs, read_memmap_revision
 
-
-def _get_user_lock(user_id: Any) -> threading.Lock:
-    """Return (or create) a per-user threading lock for index builds."""
-    key = str(user_id)
-    with _locks_lock:
-        if key not in _user_index_locks:
-            _user_index_locks[key] = threading.Lock()
-        return _user_index_locks[key]
+logger = logging.getLogger(__name__)
 
 # Roots derived from environment
 PQA_HOME = Path(os.getenv("PQA_HOME", "/app/data"))
@@ -36,6 +33,14 @@ SETTINGS_DIR = PQA_ROOT / "settings"
 INDEXES_ROOT = PQA_ROOT / "indexes"
 PAPERS_ROOT = Path(os.getenv("PAPER_DIRECTORY", str(PQA_HOME / "papers")))
 
+# File types accepted into a user's knowledge base
+PAPER_EXTENSIONS = {'.pdf', '.txt', '.doc', '.docx', '.md'}
+
+# Where parsed chunks + embeddings live: "pgvector" (Postgres, shared across
+# workers), "memmap" (per-user float32 .npy snapshot, mmap'd at query time)
+# or "pickle" (legacy per-user docs_cache/docs.pkl)
+KB_STORE = os.getenv("PQA_KB_STORE", "pgvector")
+
 
 def get_user_papers_dir(user_id: Any) -> Path:
     return PAPERS_ROOT / str(user_id)
@@ -71,25 +76,44 @@ def _index_status_path(user_id: Any) -> Path:
     return get_user_index_dir(user_id) / "index_status.json"
 
 
+# Number of recent builds kept in index_status.json for timing comparisons
+BUILD_HISTORY_LIMIT = 20
+
+
 def write_index_status(
     user_id: Any,
     status: str = "ready",
     error: Optional[str] = None,
+    build_stats: Optional[dict] = None,
 ) -> None:
-    """Write a small JSON file recording the current index-build status."""
+    """Write a small JSON file recording the current index-build status.
+
+    ``build_stats`` (library size, files added/removed, wall-clock seconds) is
+    stored as ``last_build`` and appended to a short ``build_history``; both
+    are carried over unchanged by status-only writes.
+    """
     path = _index_status_path(user_id)
     path.parent.mkdir(parents=True, exist_ok=True)
+    previous = _read_index_status_file(user_id)
     payload = {
         "status": status,
         "last_updated": datetime.now(timezone.utc).isoformat(),
     }
     if error:
         payload["last_error"] = error
+    history = previous.get("build_history") or []
+    if build_stats:
+        build_stats = {**build_stats, "finished_at": payload["last_updated"]}
+        history = (history + [build_stats])[-BUILD_HISTORY_LIMIT:]
+        payload["last_build"] = build_stats
+    elif previous.get("last_build"):
+        payload["last_build"] = previous["last_build"]
+    if history:
+        payload["build_history"] = history
     path.write_text(json.dumps(payload, indent=2))
 
 
-def read_index_status(user_id: Any) -> dict:
-    """Read the index-build status for a user (returns empty dict if missing)."""
+def _read_index_status_file(user_id: Any) -> dict:
     path = _index_status_path(user_id)
     if path.exists():
         try:
@@ -99,6 +123,172 @@ def read_index_status(user_id: Any) -> dict:
     return {}
 
 
+def read_index_status(user_id: Any) -> dict:
+    """Read the index-build status for a user (returns empty dict if missing).
+
+    When an index job exists in the queue its state, attempts and timings
+    are included under ``job``.
+    """
+    status = _read_index_status_file(user_id)
+    from core.index_queue import get_index_job
+    job = get_index_job(user_id)
+    if job:
+        status["job"] = job
+    return status
+
+
+# ---------------------------------------------------------------------------
+# Index generations
+# ---------------------------------------------------------------------------
+# The PaperQA search index is never updated in place. Each build writes a new
+# generations/<id>/ directory, seeded from the published generation by
+# hard-linking its immutable files, and is published by atomically
+# repointing the ``current`` symlink. Queries resolve ``current`` once and
+# keep reading that generation, and a build that crashes leaves the
+# published generation untouched.
+
+# Published generations kept besides ``current`` for queries still reading them
+INDEX_GENERATIONS_KEEP = int(os.getenv("PQA_INDEX_GENERATIONS_KEEP", "2"))
+# Present while a generation is being built; removed when it is published
+_GENERATION_BUILDING_MARKER = ".building"
+# PaperQA rewrites these in place, so new generations get their own copy
+_GENERATION_COPIED_FILES = {"files.zip"}
+
+
+def get_user_index_generations_dir(user_id: Any) -> Path:
+    return get_user_index_dir(user_id) / "generations"
+
+
+def get_user_current_index_link(user_id: Any) -> Path:
+    return get_user_index_dir(user_id) / "current"
+
+
+def get_current_index_generation(user_id: Any) -> Optional[Path]:
+    """Directory of the user's published index generation, if any."""
+    link = get_user_current_index_link(user_id)
+    if not link.is_symlink():
+        return None
+    target = link.resolve()
+    return target if target.is_dir() else None
+
+
+def _settings_for_index_directory(settings: Settings, index_directory: Path) -> Settings:
+    index = settings.agent.index.model_copy(update={"index_directory": index_directory})
+    return settings.model_copy(
+        update={"agent": settings.agent.model_copy(update={"index": index})}
+    )
+
+
+def _index_subdirs(directory: Path) -> list[Path]:
+    """PaperQA index directories (``pqa_index_*``) directly under ``directory``."""
+    if not directory.is_dir():
+        return []
+    return [
+        child for child in directory.iterdir()
+        if child.is_dir() and child.name.startswith("pqa_index")
+    ]
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    if Path(src).name in _GENERATION_COPIED_FILES:
+        shutil.copy2(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _start_index_generation(user_id: Any) -> Path:
+    """Create a new generation directory seeded from the published one.
+
+    Before the first generation exists, the legacy ``pqa_index_*`` directories
+    directly under the user's index directory are used as the seed.
+    """
+    generations_dir = get_user_index_generations_dir(user_id)
+    generations_dir.mkdir(parents=True, exist_ok=True)
+    current = get_current_index_generation(user_id)
+    # Builds are serialized per user, so any unfinished generation is from a crashed build
+    for child in generations_dir.iterdir():
+        if child != current and (child / _GENERATION_BUILDING_MARKER).exists():
+            logger.info(f"[PQA] Removing unfinished index generation {child.name} for user {user_id}")
+            shutil.rmtree(child, ignore_errors=True)
+
+    generation = generations_dir / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    generation.mkdir()
+    (generation / _GENERATION_BUILDING_MARKER).touch()
+    for child in _index_subdirs(current or get_user_index_dir(user_id)):
+        shutil.copytree(
+            child,
+            generation / child.name,
+            copy_function=_link_or_copy,
+            ignore=shutil.ignore_patterns("*.lock"),
+        )
+    return generation
+
+
+def _reset_index_generation(generation: Path) -> None:
+    for child in _index_subdirs(generation):
+        shutil.rmtree(child, ignore_errors=True)
+
+
+def _publish_index_generation(user_id: Any, generation: Path) -> None:
+    """Atomically point ``current`` at ``generation`` and prune old generations."""
+    index_dir = get_user_index_dir(user_id)
+    link = get_user_current_index_link(user_id)
+    tmp_link = index_dir / f".current.tmp-{os.getpid()}"
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(Path(generation.parent.name) / generation.name, tmp_link)
+    if link.is_dir() and not link.is_symlink():
+        # Created by something that opened the index before the first publish
+        shutil.rmtree(link, ignore_errors=True)
+    os.replace(tmp_link, link)
+    (generation / _GENERATION_BUILDING_MARKER).unlink(missing_ok=True)
+    logger.info(f"[PQA] Published index generation {generation.name} for user {user_id}")
+
+    published = sorted(
+        (
+            child for child in generation.parent.iterdir()
+            if child != generation and child.is_dir()
+            and not (child / _GENERATION_BUILDING_MARKER).exists()
+        ),
+        key=lambda child: child.name,
+        reverse=True,
+    )
+    for old in published[INDEX_GENERATIONS_KEEP:]:
+        shutil.rmtree(old, ignore_errors=True)
+    # Legacy in-place indexes are superseded by the first published generation
+    for child in _index_subdirs(index_dir):
+        shutil.rmtree(child, ignore_errors=True)
+
+
+def clear_index_generations(user_id: Any) -> None:
+    get_user_current_index_link(user_id).unlink(missing_ok=True)
+    shutil.rmtree(get_user_index_generations_dir(user_id), ignore_errors=True)
+
+
+async def get_user_index_files(user_id: Any, settings: Settings) -> dict:
+    """Files in the user's published index generation ({} before the first build).
+
+    Reads the generation without syncing it with the paper directory; new
+    papers become visible once the index worker publishes the next generation.
+    """
+    generation = get_current_index_generation(user_id)
+    if generation is None:
+        # Index built in place before generations were introduced
+        generation = get_user_index_dir(user_id)
+        if not _index_subdirs(generation):
+            return {}
+    try:
+        index = await get_directory_index(
+            settings=_settings_for_index_directory(settings, generation), build=False
+        )
+    except RuntimeError:
+        # PaperQA raises for an empty index
+        return {}
+    return await index.index_files
+
+
 # ---------------------------------------------------------------------------
 # Docs disk-cache helpers (pickle-based, shared between FastAPI and OI)
 # ---------------------------------------------------------------------------
@@ -115,9 +305,80 @@ def _docs_revision_path(user_id: Any) -> Path:
     return _docs_cache_dir(user_id) / "revision.txt"
 
 
-def _compute_revision(index_files: dict) -> str:
-    """Compute a stable revision fingerprint from the set of indexed file names."""
-    return hashlib.md5(str(sorted(index_files.keys())).encode()).hexdigest()
+def _memmap_store_dir(user_id: Any) -> Path:
+    return _docs_cache_dir(user_id) / "memmap"
+
+
+def _docs_files_manifest_path(user_id: Any) -> Path:
+    return _docs_cache_dir(user_id) / "files.json"
+
+
+def _file_digests(path: Path) -> tuple[str, str]:
+    """Return ``(md5, sha256)`` of a file, reading it once."""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(block)
+            sha256.update(block)
+    return md5.hexdigest(), sha256.hexdigest()
+
+
+def load_docs_file_manifest(user_id: Any) -> dict:
+    """Read the per-file manifest of the cached Docs (empty dict if missing).
+
+    Maps each paper file name to ``{"size", "mtime_ns", "md5", "sha256", "docname"}``.
+    """
+    path = _docs_files_manifest_path(user_id)
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except Exception:
+            return {}
+    return {}
+
+
+def _save_docs_file_manifest(user_id: Any, manifest: dict) -> None:
+    path = _docs_files_manifest_path(user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def scan_paper_files(
+    paper_directory: Path, index_files: dict, previous: Optional[dict] = None
+) -> dict:
+    """Fingerprint every indexed file that still exists on disk.
+
+    Files are only re-hashed when their size or mtime differs from the
+    previous manifest entry, so a same-name replacement is detected without
+    hashing the whole library on every call.
+    """
+    previous = previous or {}
+    current: dict = {}
+    for name in index_files.keys():
+        path = Path(paper_directory) / name
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entry = previous.get(name) or {}
+        if (
+            entry.get("size") == stat.st_size
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry.get("md5")
+            and entry.get("sha256")
+        ):
+            md5, sha256 = entry["md5"], entry["sha256"]
+        else:
+            md5, sha256 = _file_digests(path)
+        current[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5, "sha256": sha256}
+    return current
+
+
+def _compute_revision(files: dict) -> str:
+    """Compute a stable revision fingerprint from file names and content hashes."""
+    pairs = sorted((name, entry["md5"]) for name, entry in files.items())
+    return hashlib.md5(str(pairs).encode()).hexdigest()
 
 
 def save_docs_to_disk(user_id: Any, docs: Any, revision: str) -> None:
@@ -130,27 +391,74 @@ def save_docs_to_disk(user_id: Any, docs: Any, revision: str) -> None:
     cache_dir.mkdir(parents=True, exist_ok=True)
     pkl_path = _docs_pkl_path(user_id)
     rev_path = _docs_revision_path(user_id)
+    tmp_path = pkl_path.with_suffix(".pkl.tmp")
     try:
-        with open(pkl_path, "wb") as f:
+        # Queries read the pickle concurrently: replace it in one step
+        with open(tmp_path, "wb") as f:
             pickle.dump(docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, pkl_path)
         rev_path.write_text(revision)
         logger.info(f"[PQA] Docs cache saved to disk for user {user_id}.")
     except Exception as exc:
         logger.warning(f"[PQA] Failed to pickle Docs for user {user_id}: {exc}")
+        tmp_path.unlink(missing_ok=True)
         pkl_path.unlink(missing_ok=True)
         rev_path.unlink(missing_ok=True)
 
 
-def load_docs_from_disk(user_id: Any, expected_revision: str) -> Any:
+def read_published_revision(user_id: Any) -> Optional[str]:
+    """Revision of the user's last completed knowledge base build, if any."""
+    if KB_STORE == "memmap":
+        return read_memmap_revision(_memmap_store_dir(user_id))
+    try:
+        return _docs_revision_path(user_id).read_text().strip() or None
+    except OSError:
+        return None
+
+
+def load_published_docs(user_id: Any, settings: Settings) -> tuple[Any, Optional[str]]:
+    """The user's last completed knowledge base store, without changing it.
+
+    Queries only read what the index worker published; parsing, embedding
+    and every write to the store happen in the worker, under its per-user
+    lock. Returns ``(None, None)`` until the first build has completed.
+    """
+    revision = read_published_revision(user_id)
+    if revision is None:
+        return None, None
+    if KB_STORE == "pgvector":
+        from utils.pqa_pg_store import make_pg_query_docs
+
+        return make_pg_query_docs(user_id, settings), revision
+    if KB_STORE == "memmap":
+        docs = load_memmap_docs(_memmap_store_dir(user_id), revision)
+        return (docs, revision) if docs is not None else (None, None)
+
+    try:
+        with open(_docs_pkl_path(user_id), "rb") as f:
+            docs = pickle.load(f)  # noqa: S301 — trusted internal cache
+    except Exception as exc:
+        logger.warning(f"[PQA] Failed to load Docs from disk for user {user_id}: {exc}")
+        return None, None
+    if read_published_revision(user_id) != revision:
+        # A build finished while we were reading; serve it on the next query
+        logger.info(f"[PQA] Docs for user {user_id} changed while loading; re-reading.")
+        return load_published_docs(user_id, settings)
+    return docs, revision
+
+
+def load_docs_from_disk(user_id: Any, expected_revision: Optional[str]) -> Any:
     """Load a pickled Docs object from disk if the revision matches.
 
+    Pass ``expected_revision=None`` to load whatever is cached (used as the
+    starting point for incremental updates).
     Returns the Docs object on success, or None on miss / error.
     """
     pkl_path = _docs_pkl_path(user_id)
     rev_path = _docs_revision_path(user_id)
     if not pkl_path.exists() or not rev_path.exists():
         return None
-    if rev_path.read_text().strip() != expected_revision:
+    if expected_revision is not None and rev_path.read_text().strip() != expected_revision:
         return None
     try:
         with open(pkl_path, "rb") as f:
@@ -163,10 +471,169 @@ def load_docs_from_disk(user_id: Any, expected_revision: str) -> Any:
 
 
 def clear_docs_cache(user_id: Any) -> None:
-    """Remove the on-disk Docs cache for a user."""
+    """Remove the on-disk Docs cache (and pgvector rows) for a user."""
     cache_dir = _docs_cache_dir(user_id)
     if cache_dir.exists():
         shutil.rmtree(cache_dir, ignore_errors=True)
+    if KB_STORE == "pgvector":
+        from utils.pqa_pg_store import delete_user_kb
+        try:
+            delete_user_kb(user_id)
+        except Exception as exc:
+            logger.warning(f"[PQA] Failed to delete pgvector rows for user {user_id}: {exc}")
+
+
+# ---------------------------------------------------------------------------
+# Shared content-addressed chunk cache (deduplicates papers across users)
+# ---------------------------------------------------------------------------
+
+SHARED_CHUNKS_ROOT = PQA_ROOT / "shared" / "chunks"
+
+
+def _callable_name(fn: Any) -> Optional[str]:
+    if fn is None:
+        return None
+    return f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', repr(fn))}"
+
+
+def shared_chunks_key(sha256: str, settings: Settings) -> str:
+    """Cache key for a paper's parsed chunks under the given settings.
+
+    Covers everything that changes the stored chunks, citation or vectors:
+    parser, chunking/reader options, media handling, citation LLM/prompt,
+    embedding model and the PaperQA version.
+    """
+    import paperqa
+
+    parsing = settings.parsing
+    fingerprint = json.dumps(
+        {
+            "paperqa": paperqa.__version__,
+            "parse_pdf": _callable_name(parsing.parse_pdf),
+            "reader_config": parsing.reader_config,
+            "page_size_limit": parsing.page_size_limit,
+            "multimodal": str(parsing.multimodal),
+            "citation_prompt": parsing.citation_prompt,
+            "llm": settings.llm,
+            "embedding": settings.embedding,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    settings_hash = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+    return f"{sha256}-{settings_hash}"
+
+
+def _shared_chunks_path(key: str) -> Path:
+    return SHARED_CHUNKS_ROOT / key[:2] / f"{key}.pkl"
+
+
+def load_shared_chunks(key: str) -> Optional[tuple[Any, list]]:
+    """Return ``(doc, texts)`` with embeddings for a cached paper, or None."""
+    path = _shared_chunks_path(key)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "rb") as f:
+            doc, texts = pickle.load(f)  # noqa: S301 — trusted internal cache
+    except Exception as exc:
+        logger.warning(f"[PQA] Discarding unreadable shared chunk cache {path.name}: {exc}")
+        path.unlink(missing_ok=True)
+        return None
+    if not texts or any(t.embedding is None for t in texts):
+        return None
+    return doc, texts
+
+
+def save_shared_chunks(key: str, doc: Any, texts: list) -> None:
+    """Store a fully embedded paper in the shared cache (atomic replace)."""
+    path = _shared_chunks_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((doc, texts), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as exc:
+        logger.warning(f"[PQA] Failed to write shared chunk cache {path.name}: {exc}")
+        tmp_path.unlink(missing_ok=True)
+
+
+# ---------------------------------------------------------------------------
+# Parallel parsing / embedding helpers for Docs builds
+# ---------------------------------------------------------------------------
+
+PARSE_WORKERS = int(os.getenv("PQA_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+EMBED_BATCH_SIZE = int(os.getenv("PQA_EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("PQA_EMBED_CONCURRENCY", "4"))
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Return the shared PDF-parsing process pool, creating it on first use.
+
+    Workers are spawned rather than forked because both the web process and
+    the interpreter kernel are multi-threaded.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def _reset_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+
+def _make_build_settings(settings: Settings) -> Settings:
+    """Copy of ``settings`` used while adding papers to Docs.
+
+    Embedding is deferred so it can be batched separately, and a synchronous
+    PDF parser is wrapped to run on the process pool so CPU-bound parsing of
+    one paper overlaps with network-bound work for the others.
+    """
+    parse_pdf = settings.parsing.parse_pdf
+    parsing_update: dict = {"defer_embedding": True}
+    if parse_pdf is not None and not inspect.iscoroutinefunction(parse_pdf) and PARSE_WORKERS > 1:
+
+        async def parse_pdf_in_pool(path, **kwargs):
+            call = functools.partial(parse_pdf, path, **kwargs)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(_get_parse_pool(), call)
+            except BrokenProcessPool:
+                logger.warning(f"[PQA] Parse pool crashed while parsing {path}; parsing inline.")
+                _reset_parse_pool()
+                return call()
+
+        parsing_update["parse_pdf"] = parse_pdf_in_pool
+    return settings.model_copy(
+        update={"parsing": settings.parsing.model_copy(update=parsing_update)}
+    )
+
+
+async def _embed_texts(
+    texts: list, settings: Settings, embedding_model: Any, semaphore: asyncio.Semaphore
+) -> None:
+    """Embed ``texts`` in batches of EMBED_BATCH_SIZE, bounded by ``semaphore``."""
+    with_enrichment = settings.parsing.should_parse_and_enrich_media[1]
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[start:start + EMBED_BATCH_SIZE]
+        inputs = await asyncio.gather(*(t.get_embeddable_text(with_enrichment) for t in batch))
+        async with semaphore:
+            vectors = await embedding_model.embed_documents(texts=list(inputs))
+        for text, vector in zip(batch, vectors):
+            text.embedding = vector
 
 
 def ensure_user_dirs(user_id: Any) -> None:
@@ -175,9 +642,49 @@ def ensure_user_dirs(user_id: Any) -> None:
     SETTINGS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+# Last JSON written per user settings file, so unchanged content is not rewritten
+_written_settings: dict[str, str] = {}
+# Memoized Settings per user: {user_id: (config_version, Settings)}
+_settings_cache: dict[str, tuple[tuple, Settings]] = {}
+_settings_lock = threading.Lock()
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _settings_config_version() -> tuple:
+    """Changes whenever the settings module or the JSON template is edited."""
+    from utils import my_pqa_settings
+
+    return (
+        _mtime_ns(Path(my_pqa_settings.__file__)),
+        _mtime_ns(SETTINGS_DIR / "pqa_settings.json"),
+    )
+
+
+def _write_if_changed(path: Path, content: str) -> bool:
+    """Write ``content`` to ``path`` unless it already holds exactly that; returns True if written."""
+    key = str(path)
+    if _written_settings.get(key) == content and path.exists():
+        return False
+    try:
+        unchanged = path.read_text() == content
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        path.write_text(content)
+    _written_settings[key] = content
+    return not unchanged
+
+
 def ensure_user_pqa_settings(user_id: Any) -> Path:
     """Ensure a per-user PaperQA settings file exists and points to that user's papers and index directories.
 
+    The file is only rewritten when its content would change.
     Returns the absolute path to the user-specific settings JSON.
     """
     ensure_user_dirs(user_id)
@@ -202,7 +709,7 @@ def ensure_user_pqa_settings(user_id: Any) -> Path:
 
     # Override with per-user paths
     index["paper_directory"] = str(get_user_papers_dir(user_id))
-    index["index_directory"] = str(get_user_index_dir(user_id))
+    index["index_directory"] = str(get_user_current_index_link(user_id))
     # Store file paths relative to paper_directory to match sync comparison logic
     index["use_absolute_paper_directory"] = False
     index["sync_with_paper_directory"] = True
@@ -212,7 +719,7 @@ def ensure_user_pqa_settings(user_id: Any) -> Path:
     settings_data["agent"] = agent
 
     # Write the user-specific settings
-    user_settings_path.write_text(json.dumps(settings_data, indent=2))
+    _write_if_changed(user_settings_path, json.dumps(settings_data, indent=2))
     return user_settings_path
 
 
@@ -224,15 +731,26 @@ def get_user_settings(user_id: Any) -> Settings:
     
     Multi-tenant support:
     - Each user gets their own paper_directory: /app/data/papers/<user_id>/
-    - Each user gets their own index_directory: /app/data/.pqa/indexes/<user_id>/
+    - Each user gets their own index_directory: /app/data/.pqa/indexes/<user_id>/current
+      (a symlink to the published index generation)
     - A per-user JSON file is also created at /app/data/.pqa/settings/user_<user_id>.json
       for debugging/inspection (though the actual Settings object uses Python config)
+
+    The Settings object is memoized per user and rebuilt only when the
+    settings module or template changes. Callers must treat it as read-only
+    (use ``model_copy(update=...)`` for per-call changes).
     """
+    key = str(user_id)
+    version = _settings_config_version()
+    with _settings_lock:
+        cached = _settings_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
     # Ensure directories and per-user JSON file exist (for debugging/inspection)
     ensure_user_pqa_settings(user_id)
     
     user_papers_dir = get_user_papers_dir(user_id)
-    user_index_dir = get_user_index_dir(user_id)
     user_manifest = get_user_manifest_path(user_id)
     
     # Use the Python-based settings module for comprehensive configuration
@@ -240,10 +758,12 @@ def get_user_settings(user_id: Any) -> Settings:
     
     settings = create_pqa_settings(
         paper_directory=user_papers_dir,
-        index_directory=user_index_dir,
+        # Published index generation; builds write to a new generation instead
+        index_directory=get_user_current_index_link(user_id),
         manifest_file=user_manifest,
     )
-    
+    with _settings_lock:
+        _settings_cache[key] = (version, settings)
     return settings
 
 
@@ -258,105 +778,330 @@ async def build_user_index(user_id: Any) -> SearchIndex:
     (with all papers added) and pickles it to disk so the first query
     can load it instantly instead of re-parsing/re-embedding every paper.
     
-    If the on-disk index is corrupted (e.g. truncated files.zip from a
-    previous race condition) the index directory is wiped and rebuilt fresh.
+    The index is built into a new generation directory and published
+    atomically once it is complete, so queries keep reading the previous
+    generation meanwhile and an interrupted build never damages it.
     """
     write_index_status(user_id, status="building")
+    t_start = time.perf_counter()
+    progress = IndexProgress(user_id)
     try:
         settings = get_user_settings(user_id)
+        progress.set_phase("search_index")
+        generation = await asyncio.to_thread(_start_index_generation, user_id)
+        build_settings = _settings_for_index_directory(settings, generation)
         try:
-            index = await get_directory_index(settings=settings)
-        except Exception as first_err:
-            # Detect corrupt index (zlib / zip errors) and recover
-            err_msg = str(first_err).lower()
-            if "decompress" in err_msg or "truncated" in err_msg or "zlib" in err_msg:
-                index_dir = get_user_index_dir(user_id)
-                logger.warning(
-                    f"[PQA] Corrupt index detected for user {user_id}, "
-                    f"cleaning {index_dir} and rebuilding..."
-                )
-                for child in index_dir.iterdir():
-                    if child.is_dir() and child.name.startswith("pqa_index"):
-                        shutil.rmtree(child, ignore_errors=True)
-                index = await get_directory_index(settings=settings)
-            else:
-                raise
+            index = await get_directory_index(settings=build_settings)
+        except Exception as exc:
+            # Only reachable if the published generation itself is unreadable
+            logger.warning(
+                f"[PQA] Could not update index generation {generation.name} for user {user_id} "
+                f"({exc}); rebuilding it from the paper directory."
+            )
+            await asyncio.to_thread(_reset_index_generation, generation)
+            index = await get_directory_index(settings=build_settings)
+        await asyncio.to_thread(_publish_index_generation, user_id, generation)
+
+        t_index = time.perf_counter() - t_start
 
         # Pre-build and cache the Docs object so the first query is fast
-        await _build_and_cache_docs(user_id, settings, index)
-
-        write_index_status(user_id, status="ready")
+        build_stats = await _build_and_cache_docs(user_id, settings, index, progress)
+        build_stats["index_seconds"] = round(t_index, 3)
+        build_stats["index_generation"] = generation.name
+        build_stats["total_seconds"] = round(time.perf_counter() - t_start, 3)
+        # Per-file timings, for finding papers that are slow to parse or embed
+        build_stats["slowest_files"] = progress.slowest_files()
+
+        write_index_status(user_id, status="ready", build_stats=build_stats)
+        progress.finish()
         return index
     except Exception as exc:
         write_index_status(user_id, status="error", error=str(exc))
+        progress.finish(error=str(exc))
         raise
 
 
-async def _build_and_cache_docs(
-    user_id: Any, settings: Settings, index: SearchIndex
-) -> None:
-    """Build a Docs object from the index and pickle it to disk.
-
-    Skips the build if the on-disk cache is already up-to-date.
+def _query_docs_for_local_store(user_id: Any, docs: Any, revision: str) -> Any:
+    """Docs to hand to queries: the pickled Docs itself, or its memmap snapshot."""
+    if KB_STORE != "memmap":
+        return docs
+    store_dir = _memmap_store_dir(user_id)
+    if read_memmap_revision(store_dir) != revision:
+        export_memmap_store(store_dir, docs, revision)
+    return load_memmap_docs(store_dir, revision) or docs
+
+
+async def _update_docs(
+    user_id: Any, settings: Settings, index_files: dict, progress: Optional[IndexProgress] = None
+) -> tuple[Any, str, dict]:
+    """Bring the user's knowledge base store in line with their paper directory.
+
+    Deletes documents whose file was removed or replaced and parses/embeds
+    only new or changed files. With the pickle store the cached Docs is
+    updated in place and re-saved; with memmap the Docs is rebuilt from the
+    current snapshot, updated and exported as a new snapshot whose Docs is
+    returned; with pgvector the rows are updated and
+    a Docs backed by an ANN query is returned. Only the index worker calls
+    this, holding the user's index lock. Returns ``(docs, revision, stats)``.
     """
     from paperqa import Docs
 
+    if progress is None:
+        progress = IndexProgress(user_id, publish=False)
+    t_start = time.perf_counter()
+    use_pg = KB_STORE == "pgvector"
+    paper_directory = Path(settings.agent.index.paper_directory)
+    previous = load_docs_file_manifest(user_id)
+    current = scan_paper_files(paper_directory, index_files, previous)
+    revision = _compute_revision(current)
+    stats = {
+        "library_files": len(current),
+        "files_added": 0,
+        "files_removed": 0,
+        "files_failed": 0,
+        "shared_cache_hits": 0,
+        "media_stored": 0,
+    }
+    rev_path = _docs_revision_path(user_id)
+    stored_revision = read_published_revision(user_id)
+
+    if use_pg:
+        from utils.pqa_pg_store import add_kb_document, delete_kb_documents, make_pg_query_docs
+
+        docs = make_pg_query_docs(user_id, settings)
+        if previous and stored_revision == revision:
+            logger.info(f"[PQA] pgvector store already up-to-date for user {user_id}.")
+            stats["docs_seconds"] = round(time.perf_counter() - t_start, 3)
+            return docs, revision, stats
+        if not previous:
+            # Rows we cannot map back to files: re-add everything
+            await asyncio.to_thread(delete_kb_documents, user_id, settings.embedding)
+    else:
+        if KB_STORE == "memmap" and previous and stored_revision == revision:
+            # Serve straight from the snapshot without unpickling the Docs
+            memmap_docs = load_memmap_docs(_memmap_store_dir(user_id), revision)
+            if memmap_docs is not None:
+                stats["docs_seconds"] = round(time.perf_counter() - t_start, 3)
+                return memmap_docs, revision, stats
+        if KB_STORE == "memmap":
+            # The snapshot is the only copy of the store
+            docs = await asyncio.to_thread(load_editable_docs, _memmap_store_dir(user_id))
+        else:
+            docs = load_docs_from_disk(user_id, None)
+        backfilled = 0
+        if docs is None or not previous:
+            # No usable pickle, or one we cannot map back to files: re-add everything
+            docs = Docs()
+            previous = {}
+        else:
+            # Figures indexed before the media store existed get their hash
+            # recorded here, never at query time
+            backfilled = await asyncio.to_thread(backfill_media_digests, user_id, docs.texts)
+            if backfilled:
+                # Their texts hash differently now: re-index the kept embeddings
+                docs.texts_index.clear()
+                stats["media_stored"] += backfilled
+        if previous and stored_revision == revision and not backfilled:
+            logger.info(f"[PQA] Docs disk-cache already up-to-date for user {user_id}.")
+            stats["docs_seconds"] = round(time.perf_counter() - t_start, 3)
+            return _query_docs_for_local_store(user_id, docs, revision), revision, stats
+
+    removed = [
+        name for name, entry in previous.items()
+        if name not in current or current[name]["md5"] != entry.get("md5")
+    ]
+    added = [
+        name for name, entry in current.items()
+        if name not in previous or previous[name].get("md5") != entry["md5"]
+    ]
+    logger.info(
+        f"[PQA] Updating knowledge base for user {user_id}: "
+        f"{len(added)} to add, {len(removed)} to remove, "
+        f"{len(current) - len(added)} unchanged."
+    )
+    progress.queue_files(added, removed=len(removed), unchanged=len(current) - len(added))
+
+    if use_pg:
+        await asyncio.to_thread(delete_kb_documents, user_id, settings.embedding, removed)
+    else:
+        for name in removed:
+            docname = previous[name].get("docname")
+            if docname:
+                docs.delete(docname=docname)
+        if removed:
+            # Rebuild the vector index lazily from the surviving texts; their
+            # embeddings are kept so nothing is re-embedded.
+            docs.texts_index.clear()
+            docs.deleted_dockeys.clear()
+
+    manifest = {
+        name: {**entry, "docname": previous[name].get("docname")}
+        for name, entry in current.items()
+        if name not in added
+    }
+
+    build_settings = _make_build_settings(settings)
+    embedding_model = settings.get_embedding_model()
+    parse_semaphore = asyncio.Semaphore(max(PARSE_WORKERS, 2))
+    embed_semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def store_document(name: str, doc: Any, texts: list) -> Optional[str]:
+        if use_pg:
+            return await asyncio.to_thread(
+                add_kb_document, user_id, name, current[name]["md5"], settings.embedding, doc, texts
+            )
+        if await docs.aadd_texts(texts, doc, settings=build_settings):
+            return doc.docname
+        return None
+
+    async def add_file(name: str) -> None:
+        progress.file_started(name)
+        shared_key = shared_chunks_key(current[name]["sha256"], settings)
+        shared = await asyncio.to_thread(load_shared_chunks, shared_key)
+        if shared is not None:
+            # Already parsed and embedded (possibly by another user): no LLM
+            # or embedding calls needed
+            doc, texts = shared
+            stats["shared_cache_hits"] += 1
+            progress.file_cached(name, len(texts))
+        else:
+            # Parse (on the process pool) into a per-file Docs; the next file
+            # starts parsing while this one's chunks are being embedded.
+            file_docs = Docs()
+            async with parse_semaphore:
+                progress.resume(name)
+                try:
+                    docname = await file_docs.aadd(paper_directory / name, settings=build_settings)
+                except Exception as exc:
+                    # Keep the entry so the file is not retried until it changes
+                    logger.warning(f"[PQA] Failed to parse {name} for user {user_id}: {exc}")
+                    manifest[name] = {**current[name], "docname": None}
+                    stats["files_failed"] += 1
+                    progress.file_failed(name, "parse", exc)
+                    return
+            if not docname:
+                manifest[name] = {**current[name], "docname": None}
+                progress.file_failed(name, "parse", "no text could be extracted")
+                return
+            doc, texts = next(iter(file_docs.docs.values())), file_docs.texts
+            progress.file_parsed(name, len(texts))
+            try:
+                await _embed_texts(texts, settings, embedding_model, embed_semaphore)
+            except Exception as exc:
+                # Transient (API) failure: leave it out of the manifest so the
+                # next build retries it
+                logger.warning(f"[PQA] Failed to embed {name} for user {user_id}: {exc}")
+                stats["files_failed"] += 1
+                progress.file_failed(name, "embed", exc)
+                return
+            progress.file_embedded(name)
+
+        # Figures are written to the user's media store once, here, and
+        # referenced by hash from media.info at query time
+        try:
+            stats["media_stored"] += await asyncio.to_thread(store_texts_media, user_id, texts)
+        except OSError as exc:
+            logger.warning(f"[PQA] Failed to store figures from {name} for user {user_id}: {exc}")
+        if shared is None:
+            await asyncio.to_thread(save_shared_chunks, shared_key, doc, texts)
+
+        try:
+            docname = await store_document(name, doc, texts)
+        except Exception as exc:
+            logger.warning(f"[PQA] Failed to store {name} for user {user_id}: {exc}")
+            stats["files_failed"] += 1
+            progress.file_failed(name, "store", exc)
+            return
+        manifest[name] = {**current[name], "docname": docname}
+        stats["files_added"] += 1
+        progress.file_done(name)
+
+    await asyncio.gather(*(add_file(name) for name in added))
+    progress.set_phase("saving")
+
+    revision = _compute_revision(manifest)
+    if use_pg:
+        # The pickle is superseded by the database rows
+        _docs_pkl_path(user_id).unlink(missing_ok=True)
+        rev_path.parent.mkdir(parents=True, exist_ok=True)
+        rev_path.write_text(revision)
+    elif KB_STORE == "memmap":
+        # A pickled Docs would duplicate every embedding in the snapshot
+        _docs_pkl_path(user_id).unlink(missing_ok=True)
+        rev_path.unlink(missing_ok=True)
+        docs = _query_docs_for_local_store(user_id, docs, revision)
+    else:
+        save_docs_to_disk(user_id, docs, revision)
+        docs = _query_docs_for_local_store(user_id, docs, revision)
+    _save_docs_file_manifest(user_id, manifest)
+    stats["files_removed"] = len(removed)
+    stats["docs_seconds"] = round(time.perf_counter() - t_start, 3)
+    logger.info(
+        f"[PQA] Knowledge base updated for user {user_id} in {stats['docs_seconds']:.2f}s "
+        f"({stats['files_added']} added, {stats['shared_cache_hits']} from shared cache, "
+        f"{len(removed)} removed, {stats['library_files']} in library)."
+    )
+    return docs, revision, stats
+
+
+async def _build_and_cache_docs(
+    user_id: Any, settings: Settings, index: SearchIndex, progress: Optional[IndexProgress] = None
+) -> dict:
+    """Incrementally update the user's knowledge base store from the index.
+
+    Only files added or changed since the last build are parsed and embedded.
+    Returns the build stats recorded in index_status.json.
+    """
     index_files = await index.index_files
     if not index_files:
         clear_docs_cache(user_id)
-        return
+        return {"library_files": 0, "files_added": 0, "files_removed": 0, "files_failed": 0, "shared_cache_hits": 0}
 
-    revision = _compute_revision(index_files)
+    _, _, stats = await _update_docs(user_id, settings, index_files, progress)
+    return stats
 
-    # Check if already up-to-date on disk
-    existing = load_docs_from_disk(user_id, revision)
-    if existing is not None:
-        logger.info(f"[PQA] Docs disk-cache already up-to-date for user {user_id}.")
-        return
 
-    logger.info(
-        f"[PQA] Pre-building Docs object for user {user_id} "
-        f"({len(index_files)} files)..."
+def has_user_papers(user_id: Any) -> bool:
+    """Return True if the user's papers directory contains at least one paper."""
+    papers_dir = get_user_papers_dir(user_id)
+    if not papers_dir.exists():
+        return False
+    return any(
+        f.is_file() and f.suffix.lower() in PAPER_EXTENSIONS
+        for f in papers_dir.iterdir()
     )
-    docs = Docs()
-    paper_directory = settings.agent.index.paper_directory
-    for file_path in index_files.keys():
-        full_path = paper_directory / file_path
-        if full_path.exists():
-            await docs.aadd(full_path, settings=settings)
 
-    save_docs_to_disk(user_id, docs, revision)
-    logger.info(f"[PQA] Docs pre-build complete for user {user_id}.")
 
-
-def build_user_index_sync(user_id: Any) -> SearchIndex:
-    """Synchronous wrapper for build_user_index.
-    
-    Use this from synchronous code (e.g., OpenInterpreter, FastAPI BackgroundTasks).
-    A per-user lock serialises index builds so only one runs at a time,
-    preventing concurrent writes that can corrupt the on-disk index.
-    
-    If a build is already running, this call **waits** for it to finish and
-    then runs another build to pick up any papers that arrived in the meantime.
-    This avoids the problem where a second upload's build is skipped and
-    the disk Docs cache ends up stale.  Redundant builds are cheap because
-    get_directory_index and _build_and_cache_docs both short-circuit when
-    nothing has changed.
+def clean_user_index(user_id: Any) -> None:
+    """Remove all index generations and docs cache when the user has no papers left."""
+    index_dir = get_user_index_dir(user_id)
+    if not index_dir.exists():
+        return
+    clear_index_generations(user_id)
+    for child in _index_subdirs(index_dir):
+        shutil.rmtree(child, ignore_errors=True)
+    clear_docs_cache(user_id)
+    clear_user_media(user_id)
+    write_index_status(user_id, status="ready")
+    logger.info(f"[PQA] No papers left for user {user_id}, cleaned index and docs cache")
+
+
+def run_index_build(user_id: Any) -> None:
+    """Build/sync the PQA index for a user (run by the index worker).
+
+    If the papers directory is empty (e.g. user deleted all papers) the stale
+    index is cleaned up directly instead of calling get_directory_index, which
+    avoids a PaperQA bug that can corrupt files.zip during removal of the
+    last file. Raises on failure so the queue can retry.
     """
-    lock = _get_user_lock(user_id)
-    lock.acquire()  # blocking — waits for any in-progress build to finish
-    try:
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = None
-
-        if loop and loop.is_running():
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, build_user_index(user_id))
-                return future.result()
-        else:
-            return asyncio.run(build_user_index(user_id))
-    finally:
-        lock.release()
\ No newline at end of file
+    if not has_user_papers(user_id):
+        clean_user_index(user_id)
+        return
+
+    t0 = time.perf_counter()
+    logger.info(f"[PQA] Index build starting for user {user_id}")
+    asyncio.run(build_user_index(user_id))
+    logger.info(
+        f"[PQA] Index build complete for user {user_id} "
+        f"in {time.perf_counter() - t0:.2f}s"
+    )
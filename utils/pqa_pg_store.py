@@ -0,0 +1,275 @@
+"""
+Postgres/pgvector storage for per-user PaperQA knowledge bases.
+
+Parsed chunks, their embeddings and the source Doc metadata live in the
+``kb_document`` / ``kb_chunk`` tables instead of a pickled ``Docs`` per user.
+Retrieval is an approximate-nearest-neighbour query against a partial HNSW
+index per embedding model, so a query session only ever holds the top-k
+chunks it retrieved and the index is shared by every worker and node.
+"""
+import asyncio
+import logging
+import pickle
+import re
+import threading
+import uuid
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+from pydantic import Field, PrivateAttr
+from sqlmodel import Session, delete, func, select
+
+from paperqa import Docs, Settings
+from paperqa.llms import VectorStore
+from paperqa.types import Text
+
+from core.db import engine
+from models import KBChunk, KBDocument
+
+logger = logging.getLogger(__name__)
+
+# pgvector's HNSW supports up to 2000 dims for ``vector``; larger models
+# (e.g. text-embedding-3-large) are indexed as ``halfvec``.
+MAX_VECTOR_INDEX_DIMS = 2000
+HNSW_EF_SEARCH = 100
+
+_indexed_models: set[tuple[str, int]] = set()
+_indexed_models_lock = threading.Lock()
+
+
+def _as_uuid(user_id: Any) -> uuid.UUID:
+    return user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id))
+
+
+def _vector_expr(dim: int) -> tuple[str, str]:
+    """Return ``(cast expression, vector type)`` used by the index for ``dim``."""
+    kind = "vector" if dim <= MAX_VECTOR_INDEX_DIMS else "halfvec"
+    return f"embedding::{kind}({dim})", kind
+
+
+def _index_name(embedding_model: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", embedding_model.lower()).strip("_")
+    return f"ix_kb_chunk_embedding_{slug}"[:63]
+
+
+def ensure_embedding_index(embedding_model: str, dim: int) -> None:
+    """Create the partial HNSW index for an embedding model if it is missing."""
+    key = (embedding_model, dim)
+    with _indexed_models_lock:
+        if key in _indexed_models:
+            return
+    expr, kind = _vector_expr(dim)
+    model_literal = embedding_model.replace("'", "''")
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            f"CREATE INDEX IF NOT EXISTS {_index_name(embedding_model)} ON kb_chunk "
+            f"USING hnsw (({expr}) {kind}_cosine_ops) "
+            f"WHERE embedding_model = '{model_literal}'"
+        ))
+    with _indexed_models_lock:
+        _indexed_models.add(key)
+
+
+def delete_kb_documents(
+    user_id: Any, embedding_model: str, file_names: Optional[Iterable[str]] = None
+) -> None:
+    """Delete a user's documents (and their chunks) for one embedding model.
+
+    ``file_names=None`` deletes every document for that model.
+    """
+    statement = delete(KBDocument).where(
+        KBDocument.user_id == _as_uuid(user_id),
+        KBDocument.embedding_model == embedding_model,
+    )
+    if file_names is not None:
+        file_names = list(file_names)
+        if not file_names:
+            return
+        statement = statement.where(KBDocument.file_name.in_(file_names))
+    with Session(engine) as session:
+        session.exec(statement)
+        session.commit()
+
+
+def delete_user_kb(user_id: Any) -> None:
+    """Delete every knowledge base document for a user (all models)."""
+    with Session(engine) as session:
+        session.exec(delete(KBDocument).where(KBDocument.user_id == _as_uuid(user_id)))
+        session.commit()
+
+
+def _unique_docname(docname: str, existing: set[str]) -> str:
+    if docname not in existing:
+        return docname
+    suffix = ord("a")
+    while f"{docname}{chr(suffix)}" in existing:
+        suffix += 1
+    return f"{docname}{chr(suffix)}"
+
+
+def add_kb_document(
+    user_id: Any,
+    file_name: str,
+    content_md5: str,
+    embedding_model: str,
+    doc: Any,
+    texts: Sequence[Text],
+) -> str:
+    """Store one embedded paper, replacing any previous version of the file.
+
+    Returns the docname used, made unique within the user's library the same
+    way ``Docs.aadd_texts`` does.
+    """
+    user_uuid = _as_uuid(user_id)
+    with Session(engine) as session:
+        session.exec(delete(KBDocument).where(
+            KBDocument.user_id == user_uuid,
+            KBDocument.file_name == file_name,
+            KBDocument.embedding_model == embedding_model,
+        ))
+        existing = set(session.exec(select(KBDocument.docname).where(
+            KBDocument.user_id == user_uuid,
+            KBDocument.embedding_model == embedding_model,
+        )).all())
+        docname = _unique_docname(doc.docname, existing)
+        if docname != doc.docname:
+            for t in texts:
+                t.name = t.name.replace(doc.docname, docname)
+            doc.docname = docname
+
+        document = KBDocument(
+            user_id=user_uuid,
+            file_name=file_name,
+            content_md5=content_md5,
+            embedding_model=embedding_model,
+            docname=docname,
+            doc=pickle.dumps(doc, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+        session.add(document)
+        session.flush()
+        session.add_all([
+            KBChunk(
+                document_id=document.id,
+                user_id=user_uuid,
+                embedding_model=embedding_model,
+                chunk_index=i,
+                name=t.name,
+                text=t.text,
+                media=pickle.dumps(t.media, protocol=pickle.HIGHEST_PROTOCOL) if t.media else None,
+                embedding=list(t.embedding),
+            )
+            for i, t in enumerate(texts)
+        ])
+        session.commit()
+
+    if texts:
+        ensure_embedding_index(embedding_model, len(texts[0].embedding))
+    return docname
+
+
+def count_kb_chunks(user_id: Any, embedding_model: str) -> int:
+    with Session(engine) as session:
+        return session.exec(
+            select(func.count()).select_from(KBChunk).where(
+                KBChunk.user_id == _as_uuid(user_id),
+                KBChunk.embedding_model == embedding_model,
+            )
+        ).one()
+
+
+class PGVectorStore(VectorStore):
+    """Read-only PaperQA vector store backed by ``kb_chunk``.
+
+    Chunks are written at index time (``add_kb_document``), so adding texts
+    and clearing are no-ops here; ``similarity_search`` runs an ANN query.
+    """
+
+    user_id: str
+    embedding_model_name: str
+    ef_search: int = Field(default=HNSW_EF_SEARCH)
+    _docs: dict = PrivateAttr(default_factory=dict)
+
+    def __len__(self) -> int:
+        return count_kb_chunks(self.user_id, self.embedding_model_name)
+
+    async def add_texts_and_embeddings(self, texts: Iterable[Any]) -> None:
+        return None
+
+    def clear(self) -> None:
+        return None
+
+    def _search(self, query_embedding: list[float], k: int) -> list[tuple[Text, float]]:
+        dim = len(query_embedding)
+        expr, kind = _vector_expr(dim)
+        query_vector = "[" + ",".join(repr(float(v)) for v in query_embedding) + "]"
+        with engine.begin() as conn:
+            conn.execute(sa.text("SELECT set_config('hnsw.ef_search', :ef, true)"), {"ef": str(max(self.ef_search, k))})
+            # Keep scanning the index until k rows survive the user/model filter
+            conn.execute(sa.text("SELECT set_config('hnsw.iterative_scan', 'relaxed_order', true)"))
+            rows = conn.execute(
+                sa.text(
+                    f"SELECT document_id, name, text, media, embedding::text AS embedding, "
+                    f"1 - ({expr} <=> CAST(:q AS {kind}({dim}))) AS score "
+                    f"FROM kb_chunk "
+                    f"WHERE user_id = :user_id AND embedding_model = :model "
+                    f"ORDER BY {expr} <=> CAST(:q AS {kind}({dim})) "
+                    f"LIMIT :k"
+                ),
+                {"q": query_vector, "user_id": _as_uuid(self.user_id), "model": self.embedding_model_name, "k": k},
+            ).all()
+
+            missing = {r.document_id for r in rows} - self._docs.keys()
+            if missing:
+                for doc_row in conn.execute(
+                    sa.text("SELECT id, doc FROM kb_document WHERE id = ANY(:ids)"),
+                    {"ids": list(missing)},
+                ):
+                    self._docs[doc_row.id] = pickle.loads(doc_row.doc)  # noqa: S301 — trusted internal data
+
+        results = [
+            (
+                Text(
+                    text=r.text,
+                    name=r.name,
+                    media=pickle.loads(r.media) if r.media else [],  # noqa: S301
+                    doc=self._docs[r.document_id],
+                    embedding=[float(v) for v in r.embedding.strip("[]").split(",")],
+                ),
+                float(r.score),
+            )
+            for r in rows
+        ]
+        # relaxed_order may return rows slightly out of order
+        results.sort(key=lambda pair: pair[1], reverse=True)
+        return results
+
+    async def similarity_search(
+        self, query: str, k: int, embedding_model: Any
+    ) -> tuple[Sequence[Text], list[float]]:
+        k = min(k, 1000)
+        query_embedding = (await embedding_model.embed_documents([query]))[0]
+        results = await asyncio.to_thread(self._search, list(np.asarray(query_embedding, dtype=float)), k)
+        return [t for t, _ in results], [s for _, s in results]
+
+
+def load_kb_docs(user_id: Any, embedding_model: str) -> dict:
+    """The user's Doc metadata (no chunks), keyed by ``kb_document.id``."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(KBDocument.id, KBDocument.doc).where(
+                KBDocument.user_id == _as_uuid(user_id),
+                KBDocument.embedding_model == embedding_model,
+            )
+        ).all()
+    return {row_id: pickle.loads(doc) for row_id, doc in rows}  # noqa: S301 — trusted internal data
+
+
+def make_pg_query_docs(user_id: Any, settings: Settings) -> Docs:
+    """A ``Docs`` whose retrieval is served from pgvector for this user."""
+    store = PGVectorStore(
+        user_id=str(user_id),
+        embedding_model_name=settings.embedding,
+    )
+    store._docs = load_kb_docs(user_id, settings.embedding)
+    return Docs(docs={doc.dockey: doc for doc in store._docs.values()}, texts_index=store)
@@ -0,0 +1,316 @@
+"""
+Answer and evidence caches for knowledge base queries (Redis).
+
+Two levels, both shared by every kernel/worker through Redis:
+
+1. Evidence: one entry per (chunk, question). The chunk is identified by a
+   hash of its name and text, so an unchanged chunk keeps its cached
+   summaries across library revisions (and across users with the same paper).
+2. Answers: the final PQASession keyed by user, library revision and the
+   normalized question. With ``KB_ANSWER_SIMILARITY_THRESHOLD`` > 0 a
+   near-duplicate question (cosine similarity of question embeddings) also
+   counts as a hit.
+
+Both are keyed by a fingerprint of the settings that shape the output, so
+changing the LLM or prompts never serves stale results.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+from typing import Any, Callable, Optional
+
+import numpy as np
+import redis
+
+from lmi.types import set_llm_session_ids
+from lmi.utils import gather_with_concurrency
+from paperqa import Settings
+from paperqa.core import llm_parse_json, map_fxn_summary
+from paperqa.types import PQASession
+
+from core.cache import redis_client
+from utils.pqa_hybrid_retrieval import HYBRID_RETRIEVAL, hybrid_retrieve, retrieval_config
+
+logger = logging.getLogger(__name__)
+
+EVIDENCE_CACHE_TTL = int(os.getenv("KB_EVIDENCE_CACHE_TTL", str(7 * 24 * 60 * 60)))
+ANSWER_CACHE_TTL = int(os.getenv("KB_ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+# 0 disables near-duplicate matching (exact normalized match only)
+ANSWER_SIMILARITY_THRESHOLD = float(os.getenv("KB_ANSWER_SIMILARITY_THRESHOLD", "0"))
+
+EVIDENCE_PREFIX = "kb_evidence:"
+ANSWER_PREFIX = "kb_answer:"
+ANSWER_QUESTIONS_PREFIX = "kb_answer_questions:"
+
+# Receives progress events (see core/kb_progress.py) as the query runs
+ProgressCallback = Callable[[dict], None]
+
+
+def _sha(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?.!;: ")
+
+
+def _evidence_fingerprint(settings: Settings) -> str:
+    return _sha(json.dumps({
+        "summary_llm": settings.summary_llm,
+        "prompts": settings.prompts.model_dump(mode="json"),
+        "summary_length": settings.answer.evidence_summary_length,
+        "skip_citation_strip": settings.answer.skip_evidence_citation_strip,
+        "text_only_fallback": settings.answer.evidence_text_only_fallback,
+    }, sort_keys=True, default=str))[:16]
+
+
+def _answer_fingerprint(settings: Settings, hybrid: bool = HYBRID_RETRIEVAL) -> str:
+    return _sha(json.dumps({
+        "llm": settings.llm,
+        "summary_llm": settings.summary_llm,
+        "embedding": settings.embedding,
+        "answer": settings.answer.model_dump(mode="json"),
+        # Whether and how evidence is gathered before answering
+        "evidence_retrieval": settings.answer.evidence_retrieval,
+        "get_evidence_if_no_contexts": settings.answer.get_evidence_if_no_contexts,
+        "prompts": settings.prompts.model_dump(mode="json"),
+        # Which chunks get summarized changes the answer
+        "retrieval": retrieval_config(hybrid, settings),
+    }, sort_keys=True, default=str))[:16]
+
+
+def _emit(progress: Optional[ProgressCallback], event: dict) -> None:
+    if progress is None:
+        return
+    try:
+        progress(event)
+    except Exception as exc:
+        logger.warning(f"[PQA] Progress callback failed: {exc}")
+
+
+def _evidence_event(context: Any, cached: bool) -> dict:
+    return {
+        "event": "evidence",
+        "citation": f"{context.text.name}: {context.text.doc.formatted_citation}",
+        "score": context.score,
+        "cached": cached,
+    }
+
+
+def _chunk_hash(text: Any) -> str:
+    return _sha(f"{text.name}\n{text.text}")
+
+
+def _get_pickle(key: str) -> Any:
+    try:
+        raw = redis_client.get(key)
+    except redis.RedisError as exc:
+        logger.warning(f"[PQA] Query cache read failed: {exc}")
+        return None
+    if not raw:
+        return None
+    try:
+        return pickle.loads(raw)  # noqa: S301 — trusted internal cache
+    except Exception:
+        return None
+
+
+def _set_pickle(key: str, value: Any, ttl: int) -> None:
+    try:
+        redis_client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+    except (redis.RedisError, pickle.PicklingError) as exc:
+        logger.warning(f"[PQA] Query cache write failed: {exc}")
+
+
+async def _find_similar_answer_key(
+    questions_key: str, query: str, settings: Settings
+) -> tuple[Optional[str], Optional[list[float]]]:
+    """Return the answer key of the closest cached question above the threshold."""
+    embedding = (await settings.get_embedding_model().embed_documents([query]))[0]
+    try:
+        entries = redis_client.hgetall(questions_key)
+    except redis.RedisError as exc:
+        logger.warning(f"[PQA] Query cache read failed: {exc}")
+        return None, embedding
+    if not entries:
+        return None, embedding
+    keys = [k.decode() for k in entries]
+    matrix = np.asarray([json.loads(v) for v in entries.values()], dtype=np.float32)
+    q = np.asarray(embedding, dtype=np.float32)
+    scores = matrix @ q / (np.linalg.norm(matrix, axis=1) * (np.linalg.norm(q) or 1.0) + 1e-12)
+    best = int(np.argmax(scores))
+    if scores[best] >= ANSWER_SIMILARITY_THRESHOLD:
+        return keys[best], embedding
+    return None, embedding
+
+
+async def _gather_evidence_cached(
+    docs: Any, session: PQASession, settings: Settings, stats: dict,
+    use_cache: bool = True, hybrid: bool = HYBRID_RETRIEVAL,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """Mirror ``Docs.aget_evidence`` but reuse cached (chunk, question) summaries."""
+    answer_config = settings.answer
+    prompt_config = settings.prompts
+    if not docs.docs and len(docs.texts_index) == 0:
+        return
+    # Each summary is one LLM call, unless summaries are skipped altogether
+    summary_calls = 0 if answer_config.evidence_skip_summary else 1
+    if not answer_config.evidence_retrieval:
+        # Every chunk is summarized, as in aget_evidence
+        matches = list(docs.texts)
+        retrieval_stats = {"chunks_skipped": 0}
+    elif hybrid:
+        matches, retrieval_stats = await hybrid_retrieve(docs, session.question, settings)
+        stats["chunks_skipped"] += retrieval_stats["chunks_skipped"]
+        stats["llm_calls_saved"] += retrieval_stats["chunks_skipped"] * summary_calls
+    else:
+        matches = await docs.retrieve_texts(session.question, answer_config.evidence_k, settings)
+        matches = matches[: answer_config.evidence_k]
+        retrieval_stats = {"chunks_skipped": 0}
+    _emit(progress, {"event": "retrieval", "chunks": len(matches), **retrieval_stats})
+
+    fingerprint = _evidence_fingerprint(settings)
+    question_hash = _sha(normalize_query(session.question))
+    keys = [f"{EVIDENCE_PREFIX}{fingerprint}:{_chunk_hash(m)}:{question_hash}" for m in matches]
+    try:
+        cached_raw = redis_client.mget(keys) if keys and use_cache else [None] * len(keys)
+    except redis.RedisError as exc:
+        logger.warning(f"[PQA] Evidence cache read failed: {exc}")
+        cached_raw = [None] * len(keys)
+
+    contexts = []
+    missing: list[tuple[str, Any]] = []
+    for key, match, raw in zip(keys, matches, cached_raw):
+        context = None
+        if raw:
+            try:
+                context = pickle.loads(raw)  # noqa: S301 — trusted internal cache
+            except Exception:
+                context = None
+        if context is None:
+            missing.append((key, match))
+        else:
+            contexts.append(context)
+            if context.score > 0:
+                _emit(progress, _evidence_event(context, cached=True))
+    stats["evidence_hits"] += len(contexts)
+    stats["evidence_misses"] += len(missing)
+    stats["llm_calls_saved"] += len(contexts) * summary_calls
+    stats["summary_calls"] += len(matches) * summary_calls
+
+    if missing:
+        if prompt_config.use_json:
+            prompt_templates = (prompt_config.summary_json, prompt_config.summary_json_system)
+        else:
+            prompt_templates = (prompt_config.summary, prompt_config.system)
+        if answer_config.evidence_skip_summary:
+            prompt_templates = None
+
+        async def _summarize(m: Any) -> tuple[Any, list]:
+            result = await map_fxn_summary(
+                text=m,
+                question=session.question,
+                summary_llm_model=settings.get_summary_llm(),
+                prompt_templates=prompt_templates,
+                extra_prompt_data={
+                    "summary_length": answer_config.evidence_summary_length,
+                    "citation": f"{m.name}: {m.doc.formatted_citation}",
+                },
+                parser=llm_parse_json if prompt_config.use_json else None,
+                skip_citation_strip=answer_config.skip_evidence_citation_strip,
+                evidence_text_only_fallback=answer_config.evidence_text_only_fallback,
+            )
+            if result[0] is not None and result[0].score > 0:
+                _emit(progress, _evidence_event(result[0], cached=False))
+            return result
+
+        with set_llm_session_ids(session.id):
+            results = await gather_with_concurrency(
+                answer_config.max_concurrent_requests,
+                [_summarize(m) for _, m in missing],
+            )
+        for (key, _), (context, llm_results) in zip(missing, results):
+            for r in llm_results:
+                session.add_tokens(r)
+            if context is not None:
+                # Irrelevant (score 0) summaries are cached too so they are skipped next time
+                if use_cache:
+                    _set_pickle(key, context, EVIDENCE_CACHE_TTL)
+                contexts.append(context)
+
+    session.contexts += list({
+        c for c in contexts if c.score > 0 and c not in session.contexts
+    })
+
+
+async def cached_aquery(
+    docs: Any, query: str, settings: Settings, user_id: Any, revision: str,
+    use_cache: bool = True, hybrid: bool = HYBRID_RETRIEVAL,
+    progress: Optional[ProgressCallback] = None,
+) -> tuple[PQASession, dict]:
+    """Answer ``query`` like ``docs.aquery`` using the answer and evidence caches.
+
+    Returns ``(session, cache_stats)`` where ``cache_stats`` reports the answer
+    cache result (``hit`` / ``similar`` / ``miss``), evidence hits and misses,
+    chunks dropped by the relevance cutoff and the number of LLM calls saved
+    (on an answer hit: the summaries and answer call the cached answer made).
+    ``use_cache=False`` bypasses both caches (used by the retrieval benchmark).
+    ``progress`` is called with retrieval, evidence and answer-token events.
+    """
+    stats = {
+        "answer_cache": "miss", "evidence_hits": 0, "evidence_misses": 0,
+        "chunks_skipped": 0, "llm_calls_saved": 0, "summary_calls": 0,
+    }
+    answer_fp = _answer_fingerprint(settings, hybrid)
+    scope = f"{user_id}:{revision}:{answer_fp}"
+    answer_key = f"{ANSWER_PREFIX}{scope}:{_sha(normalize_query(query))}"
+    questions_key = f"{ANSWER_QUESTIONS_PREFIX}{scope}"
+
+    # Entries are {"session": PQASession, "llm_calls": LLM calls it took}
+    cached = _get_pickle(answer_key) if use_cache else None
+    query_embedding = None
+    if cached is None and use_cache and ANSWER_SIMILARITY_THRESHOLD > 0:
+        similar_key, query_embedding = await _find_similar_answer_key(questions_key, query, settings)
+        if similar_key:
+            cached = _get_pickle(similar_key)
+            if cached is not None:
+                stats["answer_cache"] = "similar"
+    elif cached is not None:
+        stats["answer_cache"] = "hit"
+    if cached is not None:
+        stats["llm_calls_saved"] = cached["llm_calls"]
+        _emit(progress, {"event": "answer_cache", "result": stats["answer_cache"]})
+        return cached["session"], stats
+
+    session = PQASession(question=query, config_md5=settings.md5)
+    if settings.answer.get_evidence_if_no_contexts:
+        await _gather_evidence_cached(
+            docs, session, settings, stats, use_cache=use_cache, hybrid=hybrid, progress=progress
+        )
+
+    # Evidence is already gathered; stop aquery from re-running retrieval
+    answer_settings = settings.model_copy(
+        update={"answer": settings.answer.model_copy(update={"get_evidence_if_no_contexts": False})}
+    )
+    callbacks = None
+    if progress is not None:
+        # Answer LLM streams its text through callbacks chunk by chunk
+        callbacks = [lambda chunk: _emit(progress, {"event": "answer_token", "text": chunk})]
+    session = await docs.aquery(session, settings=answer_settings, callbacks=callbacks)
+
+    if not use_cache:
+        return session, stats
+    # The summaries this answer needed (cached or not) plus the answer call
+    _set_pickle(answer_key, {"session": session, "llm_calls": stats["summary_calls"] + 1}, ANSWER_CACHE_TTL)
+    if query_embedding is not None:
+        try:
+            redis_client.hset(questions_key, answer_key, json.dumps(list(map(float, query_embedding))))
+            redis_client.expire(questions_key, ANSWER_CACHE_TTL)
+        except redis.RedisError as exc:
+            logger.warning(f"[PQA] Query cache write failed: {exc}")
+    return session, stats
@@ -100,12 +100,11 @@ class PromptManager:
                     "- Residual: Observation − Prediction\n"
                     "- QC is preliminary.\n"                    
                     "## SEA Benchmarks (Local)\n"
-                    "- File: `./data/benchmarks/all_benchmarks.json`\n"
-                    "- Filter: `properties.uhslc_id_fmt == \"{station_id}\"`\n"
-                    "- Use `geometry.coordinates[:2]` for [lon, lat]; do not use `properties.lat/lon`\n"
-                    "- Benchmark fields: `benchmark`, `description`, `level_date`, `type`, `level` (mm or “N/A”)\n"
-                    "- Photos: properties.photo_files may be a list of strings or dicts; for dicts, filename 'file'; build URLs as  \n"
-                    "`http://uhslc.soest.hawaii.edu/stations/images/benchmark_photos/{filename}`\n"
+                    "- Use the pre-loaded `get_benchmarks(station_ids, benchmark_type=None, levelled_only=False)`; do not parse `./data/benchmarks/all_benchmarks.json` yourself\n"
+                    "- `station_ids` takes one or many uhslc_ids (`\"057\"`, `57`, `[\"003\", \"057\"]`); returns a DataFrame, one row per benchmark\n"
+                    "- Columns: `uhslc_id`, `station_id`, `type` (primary, secondary, gps, station), `benchmark`, `description`, `lat`, `lon` (from the geometry), `level_m`, `level_mm`, `level_ft` (NaN when not levelled), `level_date`, `photo_urls`, `reports`\n"
+                    "- `datum_offsets(station_ids, benchmark_type=\"primary\", units=\"mm\")` returns the benchmark levels for many stations at once as an array aligned with `station_ids` (NaN when missing)\n"
+                    "- Photos: `photo_urls` holds the full image URLs\n"
                     "-- Show up to 3 thumbnails\n"
                     "- Mapping: allow Esri World Imagery; center using station or average benchmark coords\n"
                     "- Report the number of benchmarks; summarize clearly\n"
@@ -0,0 +1,195 @@
+"""
+Spatial queries over the UHSLC Fast Delivery stations.
+
+A haversine BallTree over the stations in ``fd_metadata.geojson`` (see
+``utils/station_lookup.py``) answers nearest-station, radius and
+bounding-box queries without brute-forcing distances in pandas:
+
+    nearest_stations(21.3, -157.9, k=3)
+    stations_within(station="Guam", radius_km=200)
+    stations_in_bbox(160, -30, -120, 0)      # crosses the antimeridian
+
+Longitudes may be given as -180..180 or 0..360 and are returned as
+-180..180 (``lon_360`` keeps the metadata's convention). Every query takes a
+time-coverage filter: ``span="fd"`` or ``"rq"`` (Fast Delivery or Research
+Quality record) with ``start`` and/or ``end`` keeps the stations whose record
+covers that period, e.g. ``span="rq", start="1980"``.
+"""
+import threading
+from typing import Any, Optional
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from utils.station_lookup import CONFIDENT_SCORE, find_stations, get_station_index
+
+EARTH_RADIUS_KM = 6371.0088
+SPANS = ("fd", "rq")
+
+
+def normalize_lon(lon: Any) -> Any:
+    """Longitude(s) in [-180, 180)."""
+    return (np.asarray(lon, dtype=float) + 180.0) % 360.0 - 180.0
+
+
+def _to_date(value: Any) -> np.datetime64:
+    """A date from "YYYY", "YYYY-MM", "YYYY-MM-DD", a year or a datetime."""
+    if value is None:
+        return np.datetime64("NaT", "D")
+    if isinstance(value, (int, np.integer)):
+        value = f"{int(value):04d}"
+    return np.datetime64(value).astype("datetime64[D]")
+
+
+class StationGeoIndex:
+    """Station coordinates, record spans and a BallTree over them."""
+
+    def __init__(self, stations: list[dict]) -> None:
+        self.stations = [s for s in stations if s["lat"] is not None and s["lon"] is not None]
+        self.lat = np.array([s["lat"] for s in self.stations], dtype=float)
+        self.lon = normalize_lon([s["lon"] for s in self.stations])
+        self.tree = BallTree(np.radians(np.column_stack([self.lat, self.lon])), metric="haversine")
+        self.spans = {}
+        for span in SPANS:
+            ranges = [s.get(f"{span}_span") or {} for s in self.stations]
+            self.spans[span] = (
+                np.array([_to_date(r.get("oldest")) for r in ranges]),
+                np.array([_to_date(r.get("latest")) for r in ranges]),
+            )
+
+    def coverage_mask(self, span: Optional[str] = None, start: Any = None, end: Any = None) -> np.ndarray:
+        """Stations whose ``span`` record covers ``start``..``end``, or the single date given (all stations without a filter)."""
+        mask = np.ones(len(self.stations), dtype=bool)
+        if span is None:
+            if start is not None or end is not None:
+                raise ValueError("start/end need span='fd' or span='rq'")
+            return mask
+        if span not in SPANS:
+            raise ValueError(f"span must be one of {SPANS}, not {span!r}")
+        oldest, latest = self.spans[span]
+        # NaT compares False, so stations without a record drop out
+        mask &= ~np.isnat(oldest)
+        # A single date must lie inside the record on both sides
+        first = start if start is not None else end
+        last = end if end is not None else start
+        if first is not None:
+            mask &= oldest <= _to_date(first)
+        if last is not None:
+            mask &= latest >= _to_date(last)
+        return mask
+
+    def nearest(self, lat: float, lon: float, k: int = 5, **coverage: Any) -> list[dict]:
+        mask = self.coverage_mask(**coverage)
+        if k <= 0 or not mask.any():
+            return []
+        # Query past the filtered-out stations; the index is a few hundred points
+        n = len(self.stations) if not mask.all() else min(k, len(self.stations))
+        dist, ind = self.tree.query(self._point(lat, lon), k=n)
+        hits = [(i, d) for i, d in zip(ind[0], dist[0]) if mask[i]][:k]
+        return [self._result(i, d) for i, d in hits]
+
+    def within(self, lat: float, lon: float, radius_km: float, **coverage: Any) -> list[dict]:
+        mask = self.coverage_mask(**coverage)
+        ind, dist = self.tree.query_radius(
+            self._point(lat, lon), r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True
+        )
+        return [self._result(i, d) for i, d in zip(ind[0], dist[0]) if mask[i]]
+
+    def in_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float, **coverage: Any) -> list[dict]:
+        """Stations inside the box; ``min_lon > max_lon`` (after normalizing) crosses the antimeridian."""
+        mask = self.coverage_mask(**coverage) & (self.lat >= min_lat) & (self.lat <= max_lat)
+        if max_lon - min_lon < 360:
+            west, east = normalize_lon(min_lon), normalize_lon(max_lon)
+            if west <= east:
+                mask &= (self.lon >= west) & (self.lon <= east)
+            else:
+                mask &= (self.lon >= west) | (self.lon <= east)
+        return [self._result(i) for i in np.flatnonzero(mask)]
+
+    @staticmethod
+    def _point(lat: float, lon: float) -> np.ndarray:
+        return np.radians([[float(lat), float(normalize_lon(lon))]])
+
+    def _result(self, i: int, distance: Optional[float] = None) -> dict:
+        station = self.stations[i]
+        result = {
+            "uhslc_id": station["uhslc_id"],
+            "name": station["name"],
+            "country": station["country"],
+            "lat": station["lat"],
+            "lon": round(float(self.lon[i]), 4),
+            "lon_360": station["lon"],
+            "fd_span": station["fd_span"],
+            "rq_span": station["rq_span"],
+        }
+        if distance is not None:
+            result["distance_km"] = round(float(distance) * EARTH_RADIUS_KM, 2)
+        return result
+
+
+_geo_index: Optional[StationGeoIndex] = None
+_geo_index_lock = threading.Lock()
+
+
+def get_station_geo_index() -> StationGeoIndex:
+    """The process-wide spatial index, built on first use."""
+    global _geo_index
+    if _geo_index is None:
+        with _geo_index_lock:
+            if _geo_index is None:
+                _geo_index = StationGeoIndex(get_station_index().stations)
+    return _geo_index
+
+
+def _center(lat: Optional[float], lon: Optional[float], station: Any) -> tuple[float, float]:
+    if station is not None:
+        matches = find_stations(str(station), limit=1)
+        if not matches or matches[0]["score"] < CONFIDENT_SCORE:
+            raise ValueError(f"Unknown station: {station!r}")
+        if matches[0]["lat"] is None:
+            raise ValueError(f"No coordinates for station {matches[0]['uhslc_id']} ({matches[0]['name']})")
+        return matches[0]["lat"], matches[0]["lon"]
+    if lat is None or lon is None:
+        raise ValueError("Give lat and lon, or station")
+    return lat, lon
+
+
+def nearest_stations(
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    k: int = 5,
+    station: Any = None,
+    span: Optional[str] = None,
+    start: Any = None,
+    end: Any = None,
+) -> list[dict]:
+    """The ``k`` stations closest to a point (or to a station given by name/id), nearest first."""
+    lat, lon = _center(lat, lon, station)
+    return get_station_geo_index().nearest(lat, lon, k=k, span=span, start=start, end=end)
+
+
+def stations_within(
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: float = 100.0,
+    station: Any = None,
+    span: Optional[str] = None,
+    start: Any = None,
+    end: Any = None,
+) -> list[dict]:
+    """Stations within ``radius_km`` of a point (or of a station), nearest first."""
+    lat, lon = _center(lat, lon, station)
+    return get_station_geo_index().within(lat, lon, radius_km, span=span, start=start, end=end)
+
+
+def stations_in_bbox(
+    min_lon: float,
+    min_lat: float,
+    max_lon: float,
+    max_lat: float,
+    span: Optional[str] = None,
+    start: Any = None,
+    end: Any = None,
+) -> list[dict]:
+    """Stations inside a lon/lat box; a box from 160 to -120 (or 160 to 240) spans the antimeridian."""
+    return get_station_geo_index().in_bbox(min_lon, min_lat, max_lon, max_lat, span=span, start=start, end=end)
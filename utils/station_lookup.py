@@ -0,0 +1,396 @@
+"""
+Local lookup of UHSLC Fast Delivery tide gauge stations.
+
+An in-memory index over ``data/metadata/fd_metadata.geojson``, with the names
+from the station list appendix (e.g. "Honolulu, HI" next to the metadata's
+"Honolulu, Hawaii") as canonical names. Names are normalized (case, punctuation,
+diacritics, common abbreviations such as "Pt." or "Isl."), candidates come
+from a trigram index, and are ranked by trigram similarity and edit
+distance, so a lookup takes microseconds instead of an LLM round trip.
+
+    find_stations("Honalulu")            # fuzzy name
+    find_stations("57")                  # uhslc_id
+    find_stations("Pearl", country="United States")
+    stations_in_region("Hawaii")         # state/territory suffix or country
+
+``get_station_info`` in the interpreter kernel answers from here and only
+asks the LLM when a free-form question cannot be resolved locally.
+"""
+import json
+import os
+import re
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Any, Optional
+
+STATION_METADATA_PATH = Path(os.getenv(
+    "STATION_METADATA_PATH",
+    str(Path(__file__).resolve().parent.parent / "data" / "metadata" / "fd_metadata.geojson"),
+))
+
+# A match at or above this score is used without asking the LLM
+CONFIDENT_SCORE = 0.75
+# Top matches closer than this are reported as ambiguous
+AMBIGUITY_MARGIN = 0.05
+# Candidates must share this fraction of the query's trigrams
+_MIN_TRIGRAM_OVERLAP = 0.25
+
+_ABBREVIATIONS = {
+    "pt": "point",
+    "isl": "island",
+    "st": "saint",
+    "ste": "sainte",
+    "mt": "mount",
+    "ft": "fort",
+    "aus": "australia",
+}
+# Region suffixes used in station names ("Hilo, HI", "Sitka, AK")
+_REGION_CODES = {
+    "hi": "hawaii",
+    "ak": "alaska",
+    "ca": "california",
+    "or": "oregon",
+    "wa": "washington",
+    "fl": "florida",
+    "ga": "georgia",
+    "sc": "south carolina",
+    "nc": "north carolina",
+    "nj": "new jersey",
+    "ri": "rhode island",
+    "tx": "texas",
+    "pr": "puerto rico",
+    "gu": "guam",
+    "as": "american samoa",
+}
+_COUNTRY_ALIASES = {
+    "usa": "united states of america",
+    "us": "united states of america",
+    "united states": "united states of america",
+    "america": "united states of america",
+    "uk": "united kingdom of great britain and northern ireland",
+    "britain": "united kingdom of great britain and northern ireland",
+    "united kingdom": "united kingdom of great britain and northern ireland",
+    "micronesia": "micronesia federated states of",
+    "fsm": "micronesia federated states of",
+    "iran": "iran islamic republic of",
+    "taiwan": "taiwan province of china",
+    "tanzania": "tanzania united republic of",
+    "vietnam": "viet nam",
+}
+# Words that make a query a question about stations rather than a station name
+_QUERY_WORDS = frozenset(
+    "what which where show list find all any the a an is are there in of for at near "
+    "station stations tide gauge gauges uhslc fast delivery fd id ids name names "
+    "me give get tell please located".split()
+)
+
+# Several names in one query ("Hilo and Kahului") are left to the LLM
+_CONJUNCTIONS = frozenset("and or nor vs versus".split())
+_NAME_SEPARATOR_RE = re.compile(r"[&/;+]")
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+# "Is." is only an abbreviation with its period ("Cocos Is."); a bare "is" is the verb
+_ISLAND_ABBREVIATION_RE = re.compile(r"\bis\.(?=\s|$)")
+_SPACE_RE = re.compile(r"\s+")
+_ID_RE = re.compile(r"^\s*(?:id\s*)?#?0*(\d{1,3})\s*$", re.IGNORECASE)
+
+
+def _words(text: str) -> list[str]:
+    """Lowercase words without diacritics or punctuation ("Is." becomes "island")."""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = _ISLAND_ABBREVIATION_RE.sub("island", text.replace("(the)", ""))
+    return _SPACE_RE.sub(" ", _PUNCTUATION_RE.sub(" ", text)).split()
+
+
+def _expand(words: list[str]) -> str:
+    return " ".join(_ABBREVIATIONS.get(w, w) for w in words)
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip diacritics and punctuation, and expand abbreviations."""
+    return _expand(_words(text))
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Levenshtein distance; stops early once it exceeds ``limit``."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _edit_similarity(a: str, b: str) -> float:
+    longest = max(len(a), len(b))
+    if not longest:
+        return 1.0
+    return 1.0 - edit_distance(a, b) / longest
+
+
+def format_station_id(uhslc_id: Any) -> str:
+    return f"{int(uhslc_id):03d}"
+
+
+def _load_appendix_names() -> dict[str, str]:
+    """``{uhslc_id: name}`` from the station list appendix."""
+    from utils.station_list_appendix import station_list_appendix
+
+    names = {}
+    for line in station_list_appendix.splitlines():
+        if line.startswith('{"id"'):
+            entry = json.loads(line)
+            names[entry["id"]] = entry["name"]
+    return names
+
+
+class StationIndex:
+    """Stations plus the normalized-name, trigram and region indexes used to search them."""
+
+    def __init__(self, stations: list[dict]) -> None:
+        self.stations = stations
+        self.by_id = {s["uhslc_id"]: s for s in stations}
+        # (normalized alias, station) pairs and a trigram -> alias positions index
+        self._aliases: list[tuple[str, dict]] = []
+        self._trigram_index: dict[str, set[int]] = {}
+        self._exact: dict[str, list[dict]] = {}
+        self.regions: dict[str, list[dict]] = {}
+        for station in stations:
+            for alias in station["aliases"]:
+                key = normalize(alias)
+                if not key or any(a == key and s is station for a, s in self._aliases):
+                    continue
+                position = len(self._aliases)
+                self._aliases.append((key, station))
+                self._exact.setdefault(key, []).append(station)
+                for gram in _trigrams(key):
+                    self._trigram_index.setdefault(gram, set()).add(position)
+            for region in station["regions"]:
+                members = self.regions.setdefault(region, [])
+                if station not in members:
+                    members.append(station)
+
+    @classmethod
+    def from_geojson(cls, path: Path = STATION_METADATA_PATH) -> "StationIndex":
+        try:
+            features = json.loads(Path(path).read_text())["features"]
+        except (OSError, ValueError, KeyError):
+            features = []
+        appendix = _load_appendix_names()
+
+        stations: dict[str, dict] = {}
+        for feature in features:
+            props = feature.get("properties") or {}
+            if props.get("uhslc_id") is None:
+                continue
+            uhslc_id = format_station_id(props["uhslc_id"])
+            lon, lat = (feature.get("geometry") or {}).get("coordinates", [None, None])[:2]
+            stations[uhslc_id] = {
+                "uhslc_id": uhslc_id,
+                "name": props.get("name"),
+                "country": props.get("country"),
+                "lat": lat,
+                "lon": lon,
+                "fd_span": props.get("fd_span"),
+                "rq_span": props.get("rq_span"),
+                "rq_basin": props.get("rq_basin"),
+                "aliases": [props.get("name") or ""],
+            }
+        for uhslc_id, name in appendix.items():
+            station = stations.setdefault(uhslc_id, {
+                "uhslc_id": uhslc_id, "name": name, "country": None,
+                "lat": None, "lon": None, "fd_span": None, "rq_span": None, "rq_basin": None,
+                "aliases": [],
+            })
+            station["aliases"].append(name)
+            # The station list's name ("Honolulu, HI") is the canonical one
+            station["name"] = name
+
+        for station in stations.values():
+            regions = set()
+            for alias in list(station["aliases"]):
+                if "," in alias:
+                    place, suffix = alias.rsplit(",", 1)
+                    suffix = normalize(suffix)
+                    if suffix in _REGION_CODES:
+                        # "Sitka, AK" is also found as "Sitka, Alaska"
+                        station["aliases"].append(f"{place}, {_REGION_CODES[suffix]}")
+                    regions.add(_REGION_CODES.get(suffix, suffix))
+            if station["country"]:
+                regions.add(normalize(station["country"]))
+            station["regions"] = sorted(r for r in regions if r)
+        return cls(sorted(stations.values(), key=lambda s: s["uhslc_id"]))
+
+    # -- lookups ------------------------------------------------------------
+
+    def get(self, uhslc_id: Any) -> Optional[dict]:
+        try:
+            return self.by_id.get(format_station_id(uhslc_id))
+        except (TypeError, ValueError):
+            return None
+
+    def has_name(self, name: str) -> bool:
+        return normalize(name) in self._exact
+
+    def resolve_region(self, text: str) -> Optional[str]:
+        """The region (state/territory or country) named by ``text``, if any."""
+        key = normalize(text)
+        key = _COUNTRY_ALIASES.get(key, _REGION_CODES.get(key, key))
+        if key in self.regions:
+            return key
+        # Partial country names ("philippines", "micronesia federated states")
+        matches = [r for r in self.regions if r.startswith(key + " ") or f" {key} " in f" {r} "]
+        return matches[0] if len(matches) == 1 else None
+
+    def search(self, query: str, country: Optional[str] = None, limit: int = 5) -> list[dict]:
+        """Best-matching stations for a name or id, each with a ``score`` in [0, 1]."""
+        region = self.resolve_region(country) if country else None
+        if country and region is None:
+            return []
+
+        id_match = _ID_RE.match(str(query))
+        if id_match:
+            station = self.get(id_match.group(1))
+            if station and (region is None or region in station["regions"]):
+                return [_result(station, 1.0, station["name"])]
+
+        key = normalize(query)
+        if not key:
+            return []
+        scored: dict[str, tuple[float, str]] = {}
+        for alias_key, station in self._candidates(key):
+            if region is not None and region not in station["regions"]:
+                continue
+            score = _score(key, alias_key)
+            best = scored.get(station["uhslc_id"])
+            if best is None or score > best[0]:
+                scored[station["uhslc_id"]] = (score, alias_key)
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][0], item[0]))
+        return [_result(self.by_id[sid], score, alias) for sid, (score, alias) in ranked[:limit]]
+
+    def _candidates(self, key: str) -> list[tuple[str, dict]]:
+        exact = self._exact.get(key)
+        if exact:
+            return [(key, s) for s in exact]
+        grams = _trigrams(key)
+        counts: dict[int, int] = {}
+        for gram in grams:
+            for position in self._trigram_index.get(gram, ()):
+                counts[position] = counts.get(position, 0) + 1
+        needed = max(1, int(len(grams) * _MIN_TRIGRAM_OVERLAP))
+        return [self._aliases[p] for p, n in counts.items() if n >= needed]
+
+
+def _score(query: str, alias: str) -> float:
+    if query == alias:
+        return 1.0
+    query_tokens, alias_tokens = query.split(), alias.split()
+    if all(t in alias_tokens for t in query_tokens):
+        # "honolulu" in "honolulu hawaii"; penalize very partial matches slightly
+        return 0.9 + 0.05 * len(query_tokens) / len(alias_tokens)
+    if len(query) >= 3 and alias.startswith(query):
+        # Typed prefix ("hono")
+        return 0.8 + 0.05 * len(query) / len(alias)
+    q_grams, a_grams = _trigrams(query), _trigrams(alias)
+    trigram = len(q_grams & a_grams) / len(q_grams | a_grams)
+    # Compare against the alias's leading words too ("honalulu" vs "honolulu hawaii")
+    head = " ".join(alias_tokens[:len(query_tokens)])
+    edit = max(_edit_similarity(query, alias), _edit_similarity(query, head))
+    # Below the token-containment scores above
+    return round(min(max(trigram, edit), 0.89), 4)
+
+
+def _result(station: dict, score: float, matched: str) -> dict:
+    return {
+        "uhslc_id": station["uhslc_id"],
+        "name": station["name"],
+        "country": station["country"],
+        "lat": station["lat"],
+        "lon": station["lon"],
+        "score": round(score, 3),
+        "matched": matched,
+    }
+
+
+_index: Optional[StationIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_station_index() -> StationIndex:
+    """The process-wide station index, built on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = StationIndex.from_geojson()
+    return _index
+
+
+def find_stations(query: str, country: Optional[str] = None, limit: int = 5) -> list[dict]:
+    """Stations matching a name or uhslc_id, best first (optionally within a country/region)."""
+    return get_station_index().search(query, country=country, limit=limit)
+
+
+def stations_in_region(region: str) -> list[dict]:
+    """All stations in a US state/territory (e.g. "Hawaii", "HI") or a country."""
+    index = get_station_index()
+    key = index.resolve_region(region)
+    if key is None:
+        return []
+    return [_result(s, 1.0, key) for s in index.regions[key]]
+
+
+def lookup_station_query(query: str) -> Optional[dict]:
+    """Answer a ``get_station_info`` query locally, or return None to defer to the LLM.
+
+    Returns ``{"kind": "id" | "name" | "region" | "ambiguous" | "not_found", ...}``.
+    """
+    index = get_station_index()
+    text = str(query).strip()
+    id_match = _ID_RE.match(text)
+    if id_match:
+        station = index.get(id_match.group(1))
+        if station is None:
+            return {"kind": "not_found", "query": text}
+        return {"kind": "id", "station": _result(station, 1.0, station["name"])}
+
+    # Question words are dropped before abbreviations are expanded
+    words = _words(text)
+    if _NAME_SEPARATOR_RE.search(text) or any(w in _CONJUNCTIONS for w in words):
+        return None
+    kept = [w for w in words if w not in _QUERY_WORDS]
+    remainder = _expand(kept)
+    is_question = len(kept) < len(words)
+    if is_question and not kept and not all(re.search(r"\w", t) for t in text.split()):
+        # "Is ??? a station?": the name is nothing we can match
+        return {"kind": "not_found", "query": text}
+
+    if remainder:
+        region = index.resolve_region(remainder)
+        # "Hawaii stations" / "stations in Japan"; a bare "Guam" is a station name
+        if region is not None and (is_question or not index.has_name(remainder)):
+            return {"kind": "region", "region": region, "stations": stations_in_region(region)}
+
+    matches = index.search(remainder or text, limit=3)
+    if not matches or matches[0]["score"] < CONFIDENT_SCORE:
+        # Questions go to the LLM; only a bare unknown name is simply not listed
+        if is_question or not kept or len(kept) > 3:
+            return None
+        return {"kind": "not_found", "query": text}
+    if len(matches) > 1 and matches[0]["score"] - matches[1]["score"] < AMBIGUITY_MARGIN:
+        close = [m for m in matches if matches[0]["score"] - m["score"] < AMBIGUITY_MARGIN]
+        return {"kind": "ambiguous", "query": text, "matches": close}
+    return {"kind": "name", "station": matches[0], "exact": matches[0]["score"] >= 0.9}
+
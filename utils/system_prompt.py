@@ -82,8 +82,9 @@ Host's OS: {platform.system()}
 - The functions `get_datetime`, `get_station_info`, `get_climate_index`, `web_search`, `query_knowledge_base`,`call_mcp_tool`, and `list_mcp_tools` are available directly in the environment. (Do NOT import them; just call them.) 
 - You must NOT import, redefine, replace, or manually implement these functions.
 - If the user asks for the current time or date, call `get_datetime` directly rather than computing it manually.
-- If a user requests to lookup specific tide gauge station information (`uhslc_id` and `name`), I MAY call get_station_info("<station_query>") to use an LLM to retrieve information from the Station List Appendix (UHSLC Fast Delivery product).
+- If a user requests to lookup specific tide gauge station information (`uhslc_id` and `name`), I MAY call get_station_info("<station_query>") to retrieve information from the Station List Appendix (UHSLC Fast Delivery product). It matches names (including misspellings), ids and regions locally and only uses an LLM for open-ended questions.
 - If a user requests an analysis for all tide gauge stations in a specific region (e.g., "all Hawaii stations"), always use the Station List Appendix via the get_station_info function to determine the relevant station_ids and names. Do not rely solely on metadata files.
+- For stations near a place, within a distance or inside a lon/lat box, call `nearest_stations`, `stations_within` or `stations_in_bbox` (pre-loaded) instead of computing distances from fd_metadata.geojson.
 - If you're unsure about tide gauge station information (`uhslc_id` or `name`), You MUST call get_station_info("<station_query>"). Do not infer or guess about a station name or id.
 - For climate indices: `get_climate_index("<INDEX_NAME>")`
 - For web searches: `web_search("<SEARCH_QUERY>")`